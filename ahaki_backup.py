@@ -0,0 +1,147 @@
+"""Online backups of ahaki.sqlite.
+
+The backup API copies pages in steps from its own read connection; in WAL
+mode writers keep committing while a backup runs (a step that sees a
+concurrent commit makes SQLite restart the copy).
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+import ahaki_db
+
+BACKUP_PREFIX = "ahaki_"
+BACKUP_MANIFEST = "backup_manifest.json"
+BACKUP_KEEP = 30
+BACKUP_STEP_PAGES = 1024
+BACKUP_MAX_RESTARTS = 5
+
+
+def default_backup_dir(db_path):
+    return Path(os.environ.get("AHAKI_BACKUP_DIR") or Path(db_path).parent / "backups")
+
+
+def load_backup_manifest(dest_dir):
+    path = Path(dest_dir) / BACKUP_MANIFEST
+    if not path.exists():
+        return []
+    return json.loads(path.read_text(encoding="utf-8")).get("backups", [])
+
+
+def save_backup_manifest(dest_dir, backups):
+    path = Path(dest_dir) / BACKUP_MANIFEST
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(
+        json.dumps({"backups": backups}, ensure_ascii=False, indent=2) + "\n", encoding="utf-8"
+    )
+    os.replace(tmp_path, path)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def backup_progress(db_path, max_restarts, step_sleep):
+    """Progress callback for Connection.backup() that bounds its restarts.
+
+    When another connection writes between two steps, SQLite starts the
+    copy over, so under steady writes a stepped copy might never finish.
+    A step that leaves as many pages remaining as the one before it is
+    such a restart.
+    """
+    state = {"remaining": None, "restarts": 0}
+
+    def progress(status, remaining, total):
+        if state["remaining"] is not None and remaining >= state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > max_restarts:
+                raise TimeoutError(
+                    f"Backup of {db_path} restarted more than {max_restarts} times"
+                    " because the database kept changing; retry when writes are"
+                    " quieter or copy in one step with pages=-1"
+                )
+        state["remaining"] = remaining
+        if step_sleep:
+            time.sleep(step_sleep)
+
+    return progress
+
+
+def backup_database(
+    db_path,
+    dest_dir,
+    keep=BACKUP_KEEP,
+    pages=BACKUP_STEP_PAGES,
+    step_sleep=0.0,
+    max_restarts=BACKUP_MAX_RESTARTS,
+):
+    """Write a verified, gzip-compressed snapshot of db_path to dest_dir.
+
+    Returns (path, created).  When the database has not changed since the
+    newest backup nothing is written and that backup's path comes back with
+    created=False.  Only the newest keep backups are kept.  The copy runs
+    pages at a time and gives up with TimeoutError after max_restarts
+    restarts caused by concurrent writes.
+
+    Each backup is a full copy; "incremental" here means an unchanged
+    database is not stored again.  Page-level deltas would need a restore
+    tool that replays a chain, and a gzip of the whole file stays small.
+    """
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    snapshot = dest_dir / f".{BACKUP_PREFIX}{stamp}.sqlite.tmp"
+    try:
+        source = ahaki_db.connect(db_path, readonly=True)
+        target = sqlite3.connect(snapshot)
+        try:
+            source.backup(
+                target,
+                pages=pages,
+                progress=backup_progress(db_path, max_restarts, step_sleep),
+            )
+        finally:
+            target.close()
+            source.close()
+        check = sqlite3.connect(snapshot)
+        result = check.execute("PRAGMA integrity_check").fetchall()
+        check.close()
+        if result != [("ok",)]:
+            raise sqlite3.DatabaseError(
+                "Backup failed integrity_check: " + "; ".join(row[0] for row in result[:5])
+            )
+        digest = file_digest(snapshot)
+        backups = load_backup_manifest(dest_dir)
+        if backups and backups[-1]["sha256"] == digest:
+            return dest_dir / backups[-1]["file"], False
+        path = dest_dir / f"{BACKUP_PREFIX}{stamp}.sqlite.gz"
+        part = path.with_suffix(".gz.part")
+        with open(snapshot, "rb") as src, gzip.open(part, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(part, path)
+        backups.append(
+            {
+                "file": path.name,
+                "sha256": digest,
+                "bytes": snapshot.stat().st_size,
+                "compressed_bytes": path.stat().st_size,
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+            }
+        )
+        for entry in backups[:-keep] if keep > 0 else []:
+            (dest_dir / entry["file"]).unlink(missing_ok=True)
+        save_backup_manifest(dest_dir, backups[-keep:] if keep > 0 else backups)
+    finally:
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            Path(f"{snapshot}{suffix}").unlink(missing_ok=True)
+    return path, True
@@ -0,0 +1,1466 @@
+"""SQLite schema for ahaki.sqlite, its migrations, and connection handling.
+
+Every schema change is a numbered migration.  migrate() applies the ones a
+database has not seen yet and records them in schema_version, so the build,
+the admin server and the scripts all open the same schema.  The schema
+includes the trigger-maintained derived data: the search index, the
+annotation flags and coverage counters, and the change journal.
+
+connect() and get_connection() are the one place connections and their
+pragmas are set up.  write_lock(), WriteQueue and locked_batches()
+coordinate writers across threads and processes.
+
+Cold text compression lives in ahaki_text and online backups in
+ahaki_backup; this module only creates the tables they use.
+"""
+import argparse
+import functools
+import hashlib
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+import ahaki_text
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers fall back to busy_timeout alone.
+    fcntl = None
+
+CORE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS subjects (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS questions (
+        id INTEGER PRIMARY KEY,
+        serial TEXT NOT NULL UNIQUE,
+        exam_type_code TEXT NOT NULL,
+        exam_type TEXT NOT NULL,
+        exam_session INTEGER NOT NULL,
+        subject_id INTEGER,
+        case_text TEXT,
+        stem TEXT NOT NULL,
+        choices_json TEXT NOT NULL,
+        answer_index INTEGER,
+        answer_indices_json TEXT,
+        answer_none INTEGER DEFAULT 0,
+        answer_text TEXT,
+        raw_text TEXT NOT NULL,
+        FOREIGN KEY (subject_id) REFERENCES subjects(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS explanations (
+        id INTEGER PRIMARY KEY,
+        question_id INTEGER NOT NULL,
+        body TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 1,
+        source TEXT,
+        FOREIGN KEY (question_id) REFERENCES questions(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS explanation_update_log (
+        date TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY,
+        label TEXT NOT NULL UNIQUE,
+        type TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS question_tags (
+        question_id INTEGER NOT NULL,
+        tag_id INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        PRIMARY KEY (question_id, tag_id, source),
+        FOREIGN KEY (question_id) REFERENCES questions(id),
+        FOREIGN KEY (tag_id) REFERENCES tags(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS subtopics (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        parent_id INTEGER,
+        FOREIGN KEY (parent_id) REFERENCES subtopics(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS question_subtopics (
+        question_id INTEGER NOT NULL,
+        subtopic_id INTEGER NOT NULL,
+        PRIMARY KEY (question_id, subtopic_id),
+        FOREIGN KEY (question_id) REFERENCES questions(id),
+        FOREIGN KEY (subtopic_id) REFERENCES subtopics(id)
+    )
+    """,
+]
+
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def add_missing_columns(conn, table, columns):
+    existing = table_columns(conn, table)
+    for name, ddl in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+
+
+def migrate_core_tables(conn):
+    for sql in CORE_TABLES:
+        conn.execute(sql)
+    # Databases built before the answer columns existed.
+    add_missing_columns(
+        conn,
+        "questions",
+        [("answer_indices_json", "TEXT"), ("answer_none", "INTEGER DEFAULT 0")],
+    )
+
+
+def migrate_base_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_serial ON questions(serial)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_subject ON questions(subject_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_question_tags_tag ON question_tags(tag_id)")
+
+
+def migrate_feedback_reports(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS feedback_reports (
+            serial TEXT PRIMARY KEY,
+            explain INTEGER DEFAULT 0,
+            tag INTEGER DEFAULT 0,
+            subtopic INTEGER DEFAULT 0,
+            reported_at TEXT NOT NULL
+        )
+        """
+    )
+    add_missing_columns(
+        conn,
+        "feedback_reports",
+        [
+            ("explain", "INTEGER DEFAULT 0"),
+            ("tag", "INTEGER DEFAULT 0"),
+            ("subtopic", "INTEGER DEFAULT 0"),
+        ],
+    )
+
+
+def migrate_hot_path_indexes(conn):
+    # MAX(version) / latest-explanation lookups in every import path.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_explanations_question_version"
+        " ON explanations(question_id, version)"
+    )
+    # Subtopic filters and counts.  question_tags(question_id) needs no
+    # index of its own: it is the leading column of the primary key.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_question_subtopics_subtopic"
+        " ON question_subtopics(subtopic_id)"
+    )
+
+
+# One row per question, rowid = questions.id.  Trigram tokens make substring
+# search work for Japanese text, which has no word boundaries.  The FTS5
+# trigram tokenizer first shipped in SQLite 3.34.0.
+TRIGRAM_MIN_SQLITE = (3, 34, 0)
+SEARCH_COLUMNS = ["stem", "choices", "case_text", "explanation", "tags", "subtopics"]
+
+# The latest explanation is picked with one window pass over the targets'
+# explanations rather than a correlated subquery per question.
+SEARCH_ROW_SQL = """
+    WITH targets AS (
+        SELECT q.id FROM questions q WHERE {where}
+    ),
+    latest AS (
+        SELECT question_id, body FROM (
+            SELECT
+                e.question_id,
+                e.body,
+                row_number() OVER (
+                    PARTITION BY e.question_id ORDER BY e.version DESC, e.id DESC
+                ) AS rn
+            FROM explanations e
+            WHERE e.question_id IN (SELECT id FROM targets)
+        )
+        WHERE rn = 1
+    )
+    INSERT INTO question_search(rowid, stem, choices, case_text, explanation, tags, subtopics)
+    SELECT
+        q.id,
+        q.stem,
+        (SELECT group_concat(value, ' ') FROM json_each(q.choices_json)),
+        {case},
+        latest.body,
+        (
+            SELECT group_concat(t.label, ' ') FROM question_tags qt
+            JOIN tags t ON t.id = qt.tag_id
+            WHERE qt.question_id = q.id
+        ),
+        (
+            SELECT group_concat(st.name, ' ') FROM question_subtopics qs
+            JOIN subtopics st ON st.id = qs.subtopic_id
+            WHERE qs.question_id = q.id
+        )
+    FROM questions q
+    JOIN targets ON targets.id = q.id
+    LEFT JOIN latest ON latest.question_id = q.id
+"""
+
+# Triggers only queue the affected question ids.  Re-tokenizing a whole
+# row for every tag or explanation insert made imports ~10x slower, so
+# sync_search_index() refreshes each queued question once.
+SEARCH_PENDING_SQL = "INSERT OR IGNORE INTO question_search_pending(question_id) {select};"
+
+SEARCH_TRIGGERS = {
+    "trg_search_question_insert": ("AFTER INSERT ON questions", "SELECT NEW.id"),
+    "trg_search_question_update": (
+        "AFTER UPDATE OF stem, choices_json, case_text ON questions",
+        "SELECT NEW.id",
+    ),
+    "trg_search_question_delete": ("AFTER DELETE ON questions", "SELECT OLD.id"),
+    "trg_search_explanation_insert": ("AFTER INSERT ON explanations", "SELECT NEW.question_id"),
+    "trg_search_explanation_update": (
+        "AFTER UPDATE ON explanations",
+        "VALUES (OLD.question_id), (NEW.question_id)",
+    ),
+    "trg_search_explanation_delete": ("AFTER DELETE ON explanations", "SELECT OLD.question_id"),
+    "trg_search_tag_insert": ("AFTER INSERT ON question_tags", "SELECT NEW.question_id"),
+    "trg_search_tag_delete": ("AFTER DELETE ON question_tags", "SELECT OLD.question_id"),
+    "trg_search_tag_rename": (
+        "AFTER UPDATE OF label ON tags",
+        "SELECT question_id FROM question_tags WHERE tag_id = NEW.id",
+    ),
+    "trg_search_subtopic_insert": ("AFTER INSERT ON question_subtopics", "SELECT NEW.question_id"),
+    "trg_search_subtopic_delete": ("AFTER DELETE ON question_subtopics", "SELECT OLD.question_id"),
+    "trg_search_subtopic_rename": (
+        "AFTER UPDATE OF name ON subtopics",
+        "SELECT question_id FROM question_subtopics WHERE subtopic_id = NEW.id",
+    ),
+}
+
+
+def search_row_sql(conn, where):
+    # Databases that have not reached the cases migration keep the text inline.
+    if "case_id" in table_columns(conn, "questions"):
+        case = "(SELECT body FROM cases WHERE id = q.case_id)"
+    else:
+        case = "q.case_text"
+    return SEARCH_ROW_SQL.format(where=where, case=case)
+
+
+def create_search_index(conn):
+    """Create the FTS5 search table and its triggers; fill it when new."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'question_search'"
+    ).fetchone()
+    if not exists:
+        if sqlite3.sqlite_version_info < TRIGRAM_MIN_SQLITE:
+            raise sqlite3.NotSupportedError(
+                f"SQLite {sqlite3.sqlite_version} cannot create the search index:"
+                " the FTS5 trigram tokenizer needs SQLite"
+                f" {'.'.join(map(str, TRIGRAM_MIN_SQLITE))} or newer."
+                " Use a Python build linked against a newer SQLite."
+            )
+        conn.execute(
+            "CREATE VIRTUAL TABLE question_search USING fts5("
+            + ", ".join(SEARCH_COLUMNS)
+            + ", tokenize = 'trigram')"
+        )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS question_search_pending (question_id INTEGER PRIMARY KEY)"
+    )
+    for name, (event, select) in SEARCH_TRIGGERS.items():
+        body = SEARCH_PENDING_SQL.format(select=select)
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+    if not exists:
+        rebuild_search_index(conn)
+
+
+def sync_search_index(conn):
+    """Refresh the search rows of queued questions; return how many."""
+    pending = conn.execute("SELECT COUNT(*) FROM question_search_pending").fetchone()[0]
+    if not pending:
+        return 0
+    where = "q.id IN (SELECT question_id FROM question_search_pending)"
+    conn.execute(
+        "DELETE FROM question_search"
+        " WHERE rowid IN (SELECT question_id FROM question_search_pending)"
+    )
+    conn.execute(search_row_sql(conn, where))
+    fill_bigram_rows(conn, "rowid IN (SELECT question_id FROM question_search_pending)")
+    conn.execute("DELETE FROM question_search_pending")
+    return pending
+
+
+def rebuild_search_index(conn):
+    conn.execute("DELETE FROM question_search")
+    conn.execute(search_row_sql(conn, "1"))
+    fill_bigram_rows(conn, "1")
+    conn.execute("DELETE FROM question_search_pending")
+
+
+# Trigram tokens cannot match terms under three characters (肝臓, 腰痛),
+# which are common in this corpus.  question_search_bigram holds the same
+# columns as space-separated character bigrams, plus the last character
+# of each run, so a 2+ character term is a phrase of consecutive bigrams
+# and a single character is a prefix query; both rank with bm25.  It is
+# derived from question_search by the same pending-queue sync.
+SEARCH_RUN_RE = re.compile(r"[^\W_]+")
+
+
+def search_bigrams(text):
+    if not text:
+        return text
+    tokens = []
+    for run in SEARCH_RUN_RE.findall(text):
+        tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+        tokens.append(run[-1])
+    return " ".join(tokens)
+
+
+def bigram_match_expression(terms):
+    """FTS5 query for question_search_bigram; runs split as in search_bigrams()."""
+    phrases = []
+    for term in terms:
+        for run in SEARCH_RUN_RE.findall(term):
+            if len(run) == 1:
+                phrases.append(f'"{run}" *')
+            else:
+                phrases.append('"' + " ".join(run[i : i + 2] for i in range(len(run) - 1)) + '"')
+    return " AND ".join(phrases)
+
+
+def fill_bigram_rows(conn, where):
+    """Re-derive question_search_bigram rows from question_search rows matching where."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'question_search_bigram'"
+    ).fetchone()
+    if not exists:
+        # Databases below the bigram migration; it fills the table itself.
+        return
+    conn.create_function("search_bigrams", 1, search_bigrams, deterministic=True)
+    conn.execute(f"DELETE FROM question_search_bigram WHERE {where}")
+    conn.execute(
+        "INSERT INTO question_search_bigram(rowid, "
+        + ", ".join(SEARCH_COLUMNS)
+        + ") SELECT rowid, "
+        + ", ".join(f"search_bigrams({col})" for col in SEARCH_COLUMNS)
+        + f" FROM question_search WHERE {where}"
+    )
+
+
+def migrate_search_bigrams(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'question_search_bigram'"
+    ).fetchone()
+    if exists:
+        return
+    conn.execute(
+        "CREATE VIRTUAL TABLE question_search_bigram USING fts5("
+        + ", ".join(SEARCH_COLUMNS)
+        + ", tokenize = 'unicode61')"
+    )
+    fill_bigram_rows(conn, "1")
+
+
+# questions.annotation_flags bits, kept current by triggers on the child
+# tables so work-queue queries test a column instead of running NOT EXISTS
+# subqueries per row.
+FLAG_EXPLANATION = 1
+FLAG_TAGS = 2
+FLAG_SUBTOPICS = 4
+FLAG_REPORTED = 8
+ANNOTATION_FLAGS = {
+    "explanation": FLAG_EXPLANATION,
+    "tag": FLAG_TAGS,
+    "subtopic": FLAG_SUBTOPICS,
+}
+ANNOTATION_SOURCES = [
+    (FLAG_EXPLANATION, "explanations", "question_id"),
+    (FLAG_TAGS, "question_tags", "question_id"),
+    (FLAG_SUBTOPICS, "question_subtopics", "question_id"),
+]
+REPORTED_SQL = (
+    "EXISTS (SELECT 1 FROM feedback_reports f WHERE f.serial = {serial}"
+    " AND (f.explain OR f.tag OR f.subtopic))"
+)
+
+
+def annotation_flags_sql(qid, serial):
+    """SQL expression computing annotation_flags from scratch for one question."""
+    parts = [
+        f"(CASE WHEN EXISTS (SELECT 1 FROM {table} WHERE {column} = {qid}) THEN {bit} ELSE 0 END)"
+        for bit, table, column in ANNOTATION_SOURCES
+    ]
+    parts.append(f"(CASE WHEN {REPORTED_SQL.format(serial=serial)} THEN {FLAG_REPORTED} ELSE 0 END)")
+    return " | ".join(parts)
+
+
+def flag_triggers():
+    triggers = {}
+    for bit, table, column in ANNOTATION_SOURCES:
+        triggers[f"trg_flags_{table}_insert"] = (
+            f"AFTER INSERT ON {table}",
+            f"UPDATE questions SET annotation_flags = annotation_flags | {bit}"
+            f" WHERE id = NEW.{column} AND annotation_flags & {bit} = 0;",
+        )
+        triggers[f"trg_flags_{table}_delete"] = (
+            f"AFTER DELETE ON {table}",
+            f"UPDATE questions SET annotation_flags = annotation_flags & ~{bit}"
+            f" WHERE id = OLD.{column} AND annotation_flags & {bit} != 0"
+            f" AND NOT EXISTS (SELECT 1 FROM {table} WHERE {column} = OLD.{column});",
+        )
+    reported = (
+        "UPDATE questions SET annotation_flags = (annotation_flags & ~{bit})"
+        " | (CASE WHEN {exists} THEN {bit} ELSE 0 END) WHERE serial = {serial};"
+    )
+    triggers["trg_flags_feedback_insert"] = (
+        "AFTER INSERT ON feedback_reports",
+        reported.format(
+            bit=FLAG_REPORTED, exists=REPORTED_SQL.format(serial="NEW.serial"), serial="NEW.serial"
+        ),
+    )
+    triggers["trg_flags_feedback_update"] = (
+        "AFTER UPDATE ON feedback_reports",
+        reported.format(
+            bit=FLAG_REPORTED, exists=REPORTED_SQL.format(serial="NEW.serial"), serial="NEW.serial"
+        ),
+    )
+    triggers["trg_flags_feedback_delete"] = (
+        "AFTER DELETE ON feedback_reports",
+        reported.format(
+            bit=FLAG_REPORTED, exists=REPORTED_SQL.format(serial="OLD.serial"), serial="OLD.serial"
+        ),
+    )
+    # A question inserted after its annotations (e.g. a rebuilt database
+    # that keeps feedback rows) picks up its flags immediately.
+    triggers["trg_flags_question_insert"] = (
+        "AFTER INSERT ON questions",
+        "UPDATE questions SET annotation_flags = "
+        + annotation_flags_sql("NEW.id", "NEW.serial")
+        + " WHERE id = NEW.id;",
+    )
+    return triggers
+
+
+def migrate_annotation_flags(conn):
+    add_missing_columns(conn, "questions", [("annotation_flags", "INTEGER NOT NULL DEFAULT 0")])
+    for name, (event, body) in flag_triggers().items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+    rebuild_annotation_flags(conn)
+    # "Next N questions missing X (in subject Y)" becomes a range scan over
+    # only the rows still missing X, already in work-queue order.
+    for kind, bit in ANNOTATION_FLAGS.items():
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_questions_missing_{kind}"
+            " ON questions(subject_id, exam_session, serial)"
+            f" WHERE annotation_flags & {bit} = 0"
+        )
+
+
+def rebuild_annotation_flags(conn):
+    conn.execute(
+        "UPDATE questions SET annotation_flags = " + annotation_flags_sql("questions.id", "questions.serial")
+    )
+
+
+def missing_annotation_clauses(kinds, alias="q"):
+    """WHERE terms for questions missing every given kind.
+
+    Each term is written exactly as in the partial index definitions so the
+    planner can match them.
+    """
+    return [f"{alias}.annotation_flags & {ANNOTATION_FLAGS[kind]} = 0" for kind in kinds]
+
+
+# Per-subject coverage counters derived from annotation_flags.  Questions
+# without a subject are counted under subject_id 0 so the totals add up.
+COVERAGE_BITS = [
+    ("explained", FLAG_EXPLANATION),
+    ("tagged", FLAG_TAGS),
+    ("subtopic_assigned", FLAG_SUBTOPICS),
+]
+COVERAGE_FIELDS = ["total"] + [name for name, _ in COVERAGE_BITS]
+
+
+def coverage_delta_sql(row, sign):
+    values = [f"coalesce({row}.subject_id, 0)", sign]
+    values.extend(f"{sign} * (({row}.annotation_flags & {bit}) != 0)" for _, bit in COVERAGE_BITS)
+    updates = ", ".join(f"{name} = {name} + excluded.{name}" for name in COVERAGE_FIELDS)
+    return (
+        f"INSERT INTO subject_coverage(subject_id, {', '.join(COVERAGE_FIELDS)})"
+        f" VALUES ({', '.join(values)})"
+        f" ON CONFLICT(subject_id) DO UPDATE SET {updates};"
+    )
+
+
+COVERAGE_TRIGGERS = {
+    "trg_coverage_question_insert": ("AFTER INSERT ON questions", coverage_delta_sql("NEW", "1")),
+    "trg_coverage_question_delete": ("AFTER DELETE ON questions", coverage_delta_sql("OLD", "-1")),
+    "trg_coverage_question_update": (
+        "AFTER UPDATE OF subject_id, annotation_flags ON questions"
+        " WHEN OLD.subject_id IS NOT NEW.subject_id"
+        " OR (OLD.annotation_flags & 7) != (NEW.annotation_flags & 7)",
+        coverage_delta_sql("OLD", "-1") + " " + coverage_delta_sql("NEW", "1"),
+    ),
+}
+
+
+def migrate_subject_coverage(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS subject_coverage (
+            subject_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            explained INTEGER NOT NULL DEFAULT 0,
+            tagged INTEGER NOT NULL DEFAULT 0,
+            subtopic_assigned INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    for name, (event, body) in COVERAGE_TRIGGERS.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+    rebuild_subject_coverage(conn)
+
+
+def rebuild_subject_coverage(conn):
+    sums = ", ".join(f"SUM((annotation_flags & {bit}) != 0)" for _, bit in COVERAGE_BITS)
+    conn.execute("DELETE FROM subject_coverage")
+    conn.execute(
+        f"""
+        INSERT INTO subject_coverage(subject_id, {", ".join(COVERAGE_FIELDS)})
+        SELECT coalesce(subject_id, 0), COUNT(*), {sums}
+        FROM questions
+        GROUP BY coalesce(subject_id, 0)
+        """
+    )
+
+
+def load_progress(conn):
+    """Progress totals and per-subject rows, read from subject_coverage."""
+    totals = conn.execute(
+        "SELECT " + ", ".join(f"coalesce(SUM({name}), 0)" for name in COVERAGE_FIELDS)
+        + " FROM subject_coverage"
+    ).fetchone()
+    rows = conn.execute(
+        "SELECT s.name, "
+        + ", ".join(f"coalesce(c.{name}, 0)" for name in COVERAGE_FIELDS)
+        + """
+        FROM subjects s
+        LEFT JOIN subject_coverage c ON c.subject_id = s.id
+        ORDER BY s.name
+        """
+    ).fetchall()
+    return {
+        "total_questions": totals[0],
+        "explained": totals[1],
+        "tagged": totals[2],
+        "subtopic_assigned": totals[3],
+        "by_subject": [
+            {
+                "subject": row[0],
+                "total_questions": row[1],
+                "explained": row[2],
+                "tagged": row[3],
+                "subtopic_assigned": row[4],
+            }
+            for row in rows
+        ],
+    }
+
+
+def count_coverage(conn):
+    """Coverage recomputed from the child tables, ignoring flags and counters."""
+    rows = conn.execute(
+        """
+        SELECT
+            coalesce(q.subject_id, 0),
+            COUNT(*),
+            SUM(EXISTS (SELECT 1 FROM explanations e WHERE e.question_id = q.id)),
+            SUM(EXISTS (SELECT 1 FROM question_tags qt WHERE qt.question_id = q.id)),
+            SUM(EXISTS (SELECT 1 FROM question_subtopics qs WHERE qs.question_id = q.id))
+        FROM questions q
+        GROUP BY coalesce(q.subject_id, 0)
+        """
+    ).fetchall()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def check_coverage(conn):
+    """Return (subject_id, stored, expected) for every subject that disagrees."""
+    stored = {
+        row[0]: tuple(row[1:])
+        for row in conn.execute(
+            f"SELECT subject_id, {', '.join(COVERAGE_FIELDS)} FROM subject_coverage"
+        )
+        if any(row[1:])
+    }
+    expected = count_coverage(conn)
+    return [
+        (subject_id, stored.get(subject_id), expected.get(subject_id))
+        for subject_id in sorted(set(stored) | set(expected))
+        if stored.get(subject_id) != expected.get(subject_id)
+    ]
+
+
+# A case (症例) text is stored once in cases and referenced by every question
+# it introduces, instead of being copied into each question's case_text.
+# digest is the UNIQUE key so the text itself is not duplicated in an index.
+CASE_LOOKUP_BATCH = 500
+
+CASE_SEARCH_TRIGGERS = {
+    "trg_search_question_case": ("AFTER UPDATE OF case_id ON questions", "SELECT NEW.id"),
+    "trg_search_case_update": (
+        "AFTER UPDATE OF body ON cases",
+        "SELECT id FROM questions WHERE case_id = NEW.id",
+    ),
+}
+
+
+def migrate_cases(conn):
+    """Create cases and questions.case_id and move case_text into them.
+
+    Safe to run more than once: cold builds call it before loading rows so
+    they can write case_id, and the numbered migration then only adds the
+    search triggers.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cases (
+            id INTEGER PRIMARY KEY,
+            digest TEXT NOT NULL UNIQUE,
+            body TEXT NOT NULL
+        )
+        """
+    )
+    add_missing_columns(conn, "questions", [("case_id", "INTEGER REFERENCES cases(id)")])
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_questions_case"
+        " ON questions(case_id) WHERE case_id IS NOT NULL"
+    )
+    search_pending = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'question_search_pending'"
+    ).fetchone()
+    if search_pending:
+        for name, (event, select) in CASE_SEARCH_TRIGGERS.items():
+            body = SEARCH_PENDING_SQL.format(select=select)
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+    rows = conn.execute(
+        "SELECT id, case_text FROM questions WHERE case_text IS NOT NULL"
+    ).fetchall()
+    if rows:
+        case_ids = resolve_case_ids(conn, [text for _, text in rows], {})
+        conn.executemany(
+            "UPDATE questions SET case_id = ?, case_text = NULL WHERE id = ?",
+            [(case_ids[text], question_id) for question_id, text in rows],
+        )
+
+
+def case_digest(body):
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def resolve_case_ids(conn, bodies, case_cache):
+    """Add unseen case texts to cases; return case_cache updated to {body: id}."""
+    missing = {
+        case_digest(body): body
+        for body in dict.fromkeys(bodies)
+        if body is not None and body not in case_cache
+    }
+    if not missing:
+        return case_cache
+    conn.executemany(
+        "INSERT OR IGNORE INTO cases(digest, body) VALUES (?, ?)",
+        list(missing.items()),
+    )
+    digests = list(missing)
+    for start in range(0, len(digests), CASE_LOOKUP_BATCH):
+        batch = digests[start : start + CASE_LOOKUP_BATCH]
+        placeholders = ",".join("?" for _ in batch)
+        for case_id, digest in conn.execute(
+            f"SELECT id, digest FROM cases WHERE digest IN ({placeholders})", batch
+        ):
+            case_cache[missing[digest]] = case_id
+    return case_cache
+
+
+def load_cases(conn, case_ids=None):
+    """Return {case id: text}, for case_ids or every case.
+
+    Readers select questions.case_id and look the text up here, so a
+    question query never joins the case bodies into each of its rows.
+    """
+    if case_ids is None:
+        return dict(conn.execute("SELECT id, body FROM cases"))
+    ids = sorted({case_id for case_id in case_ids if case_id is not None})
+    cases = {}
+    for start in range(0, len(ids), CASE_LOOKUP_BATCH):
+        batch = ids[start : start + CASE_LOOKUP_BATCH]
+        placeholders = ",".join("?" for _ in batch)
+        cases.update(
+            conn.execute(f"SELECT id, body FROM cases WHERE id IN ({placeholders})", batch)
+        )
+    return cases
+
+
+def prune_cases(conn):
+    """Delete cases no question references any more; return how many."""
+    return conn.execute(
+        "DELETE FROM cases WHERE id NOT IN"
+        " (SELECT case_id FROM questions WHERE case_id IS NOT NULL)"
+    ).rowcount
+
+
+def case_fields(serial, case_id, cases, carried):
+    """Case keys for one exported row in a payload that carries each case once.
+
+    The first row of a case gets its case_text; later rows get case_ref, the
+    serial of that first row.  carried maps case id -> that serial.
+    """
+    if case_id is None:
+        return {"case_text": None}
+    if case_id in carried:
+        return {"case_ref": carried[case_id]}
+    carried[case_id] = serial
+    return {"case_text": cases.get(case_id)}
+
+
+# Tables behind cold text compression (ahaki_text): text_dictionaries holds
+# the shared zlib dictionaries, and the triggers queue questions whose
+# explanation history changed so commit() repacks only those.
+COLD_TEXT_TRIGGERS = {
+    "trg_cold_text_explanation_insert": ("AFTER INSERT ON explanations", "NEW.question_id"),
+    "trg_cold_text_explanation_delete": ("AFTER DELETE ON explanations", "OLD.question_id"),
+}
+
+
+def migrate_text_compression(conn):
+    """Create the dictionary table and the queue of questions to compact.
+
+    Safe to run more than once; cold builds call it before loading rows so
+    a snapshot can carry dictionaries over with the explanations.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS text_dictionaries (
+            id INTEGER PRIMARY KEY,
+            key INTEGER NOT NULL UNIQUE,
+            data BLOB NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS cold_text_pending (question_id INTEGER PRIMARY KEY)")
+    for name, (event, value) in COLD_TEXT_TRIGGERS.items():
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN"
+            f" INSERT OR IGNORE INTO cold_text_pending(question_id) VALUES ({value}); END"
+        )
+    conn.execute(
+        "INSERT OR IGNORE INTO cold_text_pending(question_id)"
+        " SELECT question_id FROM explanations GROUP BY question_id HAVING COUNT(*) > 1"
+    )
+
+
+# Change journal for exports.  Triggers record each changed question once
+# under a fresh sequence number (REPLACE moves it to the end), so a consumer
+# that remembers the last sequence it applied re-renders only the questions
+# after it.  The epoch is new for every database file built from scratch,
+# which tells a consumer that its remembered sequence belongs elsewhere.
+CHANGE_JOURNAL_SQL = "INSERT OR REPLACE INTO question_changes(question_id) {select};"
+
+CHANGE_TRIGGERS = {
+    "trg_changes_question_insert": ("AFTER INSERT ON questions", "SELECT NEW.id"),
+    "trg_changes_question_update": (
+        "AFTER UPDATE OF serial, exam_type, exam_session, subject_id, case_id, stem,"
+        " choices_json, answer_index, answer_indices_json, answer_none, answer_text"
+        " ON questions",
+        "SELECT NEW.id",
+    ),
+    "trg_changes_question_delete": ("AFTER DELETE ON questions", "SELECT OLD.id"),
+    "trg_changes_explanation_insert": ("AFTER INSERT ON explanations", "SELECT NEW.question_id"),
+    # Packing history only changes a body's storage class, not its text.
+    "trg_changes_explanation_update": (
+        "AFTER UPDATE ON explanations WHEN typeof(OLD.body) = typeof(NEW.body)"
+        " OR OLD.version IS NOT NEW.version OR OLD.source IS NOT NEW.source"
+        " OR OLD.question_id IS NOT NEW.question_id",
+        "VALUES (OLD.question_id), (NEW.question_id)",
+    ),
+    "trg_changes_explanation_delete": ("AFTER DELETE ON explanations", "SELECT OLD.question_id"),
+    "trg_changes_tag_insert": ("AFTER INSERT ON question_tags", "SELECT NEW.question_id"),
+    "trg_changes_tag_delete": ("AFTER DELETE ON question_tags", "SELECT OLD.question_id"),
+    "trg_changes_tag_rename": (
+        "AFTER UPDATE OF label ON tags",
+        "SELECT question_id FROM question_tags WHERE tag_id = NEW.id",
+    ),
+    "trg_changes_subtopic_insert": ("AFTER INSERT ON question_subtopics", "SELECT NEW.question_id"),
+    "trg_changes_subtopic_delete": ("AFTER DELETE ON question_subtopics", "SELECT OLD.question_id"),
+    "trg_changes_subtopic_rename": (
+        "AFTER UPDATE OF name ON subtopics",
+        "SELECT question_id FROM question_subtopics WHERE subtopic_id = NEW.id",
+    ),
+    "trg_changes_subject_rename": (
+        "AFTER UPDATE OF name ON subjects",
+        "SELECT id FROM questions WHERE subject_id = NEW.id",
+    ),
+    "trg_changes_case_update": (
+        "AFTER UPDATE OF body ON cases",
+        "SELECT id FROM questions WHERE case_id = NEW.id",
+    ),
+}
+
+
+def migrate_change_journal(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS question_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            question_id INTEGER NOT NULL UNIQUE
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS change_epoch (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            epoch TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO change_epoch(id, epoch) VALUES (1, lower(hex(randomblob(8))))"
+    )
+    for name, (event, select) in CHANGE_TRIGGERS.items():
+        body = CHANGE_JOURNAL_SQL.format(select=select)
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+
+def change_position(conn):
+    """Return (epoch, last sequence) of the change journal, or None without one."""
+    try:
+        epoch = conn.execute("SELECT epoch FROM change_epoch WHERE id = 1").fetchone()
+        seq = conn.execute("SELECT MAX(seq) FROM question_changes").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+    if epoch is None:
+        return None
+    return epoch[0], seq or 0
+
+
+# Append only: never renumber or edit a released migration.  Every step must
+# also be safe on databases created before schema_version existed.
+MIGRATIONS = [
+    (1, "core tables", migrate_core_tables),
+    (2, "base indexes", migrate_base_indexes),
+    (3, "feedback_reports", migrate_feedback_reports),
+    (4, "question_search FTS5 index", create_search_index),
+    (5, "hot-path indexes", migrate_hot_path_indexes),
+    (6, "annotation_flags with partial indexes", migrate_annotation_flags),
+    (7, "subject_coverage counters", migrate_subject_coverage),
+    (8, "cases table shared by linked questions", migrate_cases),
+    (9, "compressed cold text", migrate_text_compression),
+    (10, "question change journal", migrate_change_journal),
+    (11, "question_search_bigram index for short terms", migrate_search_bigrams),
+]
+# Cold bulk builds load rows at this version and migrate the rest afterwards,
+# so indexes and the search table are built once over the full data.
+TABLES_VERSION = 1
+# Snapshot rebuilds copy annotations in at this version (every annotation
+# table exists, no triggers yet) and derive flags, coverage and search after.
+ANNOTATIONS_VERSION = 3
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not exists:
+        return 0
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to target (default: all); return their versions.
+
+    Each migration runs in its own savepoint together with its
+    schema_version row.  The caller commits, as with any other write.
+    """
+    target = LATEST_VERSION if target is None else target
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+        """
+    )
+    version = current_version(conn)
+    applied = []
+    for number, description, step in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        conn.execute("SAVEPOINT migration")
+        try:
+            step(conn)
+            conn.execute(
+                "INSERT INTO schema_version(version, description, applied_at) VALUES (?, ?, ?)",
+                (number, description, datetime.now().isoformat(timespec="seconds")),
+            )
+        except Exception:
+            conn.execute("ROLLBACK TO migration")
+            conn.execute("RELEASE migration")
+            raise
+        conn.execute("RELEASE migration")
+        applied.append(number)
+    return applied
+
+
+def ensure_schema(db_path):
+    conn = connect(db_path, timeout=BUSY_TIMEOUTS["batch"])
+    with write_lock(db_path):
+        applied = migrate(conn)
+        conn.commit()
+    conn.close()
+    return applied
+
+
+# Annotations a snapshot rebuild carries over from the live database, in
+# insert order.  Rows follow their question by serial, so annotations of
+# serials the new build no longer has are dropped.  Text dictionaries come
+# first so packed explanation history stays readable.
+ANNOTATION_COPY_SQL = [
+    (
+        "text_dictionaries",
+        "INSERT OR IGNORE INTO text_dictionaries(key, data, created_at)"
+        " SELECT key, data, created_at FROM {src}.text_dictionaries ORDER BY id",
+    ),
+    ("tags", "INSERT INTO tags(id, label, type) SELECT id, label, type FROM {src}.tags"),
+    (
+        "subtopics",
+        "INSERT INTO subtopics(id, name, parent_id) SELECT id, name, parent_id FROM {src}.subtopics",
+    ),
+    (
+        "explanations",
+        """
+        INSERT INTO explanations(id, question_id, body, version, source)
+        SELECT e.id, q.id, e.body, e.version, e.source
+        FROM {src}.explanations e
+        JOIN {src}.questions lq ON lq.id = e.question_id
+        JOIN questions q ON q.serial = lq.serial
+        """,
+    ),
+    (
+        "question_tags",
+        """
+        INSERT INTO question_tags(question_id, tag_id, source)
+        SELECT q.id, qt.tag_id, qt.source
+        FROM {src}.question_tags qt
+        JOIN {src}.questions lq ON lq.id = qt.question_id
+        JOIN questions q ON q.serial = lq.serial
+        """,
+    ),
+    (
+        "question_subtopics",
+        """
+        INSERT INTO question_subtopics(question_id, subtopic_id)
+        SELECT q.id, qs.subtopic_id
+        FROM {src}.question_subtopics qs
+        JOIN {src}.questions lq ON lq.id = qs.question_id
+        JOIN questions q ON q.serial = lq.serial
+        """,
+    ),
+    (
+        "feedback_reports",
+        "INSERT INTO feedback_reports(serial, explain, tag, subtopic, reported_at)"
+        " SELECT serial, explain, tag, subtopic, reported_at FROM {src}.feedback_reports",
+    ),
+    (
+        "explanation_update_log",
+        "INSERT INTO explanation_update_log(date, count) SELECT date, count FROM {src}.explanation_update_log",
+    ),
+]
+
+
+def copy_annotations(conn, src):
+    """Copy annotations from attached schema src; return {table: (copied, in source)}."""
+    present = {
+        row[0]
+        for row in conn.execute(f"SELECT name FROM {src}.sqlite_master WHERE type = 'table'")
+    }
+    counts = {}
+    for table, sql in ANNOTATION_COPY_SQL:
+        if table not in present:
+            continue
+        copied = conn.execute(sql.format(src=src)).rowcount
+        total = conn.execute(f"SELECT COUNT(*) FROM {src}.{table}").fetchone()[0]
+        counts[table] = (copied, total)
+    return counts
+
+
+def clear_annotations(conn):
+    # Dictionaries stay: the snapshot's own packed raw_text may refer to them.
+    for table, _ in reversed(ANNOTATION_COPY_SQL):
+        if table != "text_dictionaries":
+            conn.execute(f"DELETE FROM {table}")
+
+
+# Pragma profiles.  "read" and "write" keep a large page cache and map the
+# file into memory so repeated requests on a pooled connection stay warm;
+# "build" is for cold bulk loads that touch every page once.
+PRAGMA_PROFILES = {
+    "read": [
+        "PRAGMA cache_size = -65536",
+        "PRAGMA mmap_size = 268435456",
+        "PRAGMA temp_store = MEMORY",
+    ],
+    "write": [
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -65536",
+        "PRAGMA mmap_size = 268435456",
+        "PRAGMA temp_store = MEMORY",
+    ],
+    "build": [
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -65536",
+        "PRAGMA temp_store = MEMORY",
+    ],
+}
+# Prepared statements kept per connection (sqlite3 defaults to 128).
+CACHED_STATEMENTS = 512
+# Busy-timeout policy in seconds.  The admin server answers a teacher, so it
+# gives up early and reports the error; batch tools wait out other writers.
+BUSY_TIMEOUTS = {"interactive": 10.0, "batch": 120.0}
+# Write jobs the admin server's queue commits in one transaction.
+WRITE_BATCH_SIZE = 32
+# Records a CLI import commits per hold of the writer lock.
+IMPORT_BATCH_SIZE = 200
+LOCK_POLL_SECONDS = 0.05
+
+_pool = threading.local()
+
+
+def apply_pragmas(conn, profile):
+    for statement in PRAGMA_PROFILES[profile]:
+        conn.execute(statement)
+
+
+def connect(db_path, readonly=False, profile=None, timeout=BUSY_TIMEOUTS["interactive"]):
+    """Open a new connection with the pragma profile for its use.
+
+    Read-only connections open the file with mode=ro, so a GET handler
+    cannot write even by mistake.
+    """
+    if readonly:
+        uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(
+            uri, uri=True, timeout=timeout, cached_statements=CACHED_STATEMENTS
+        )
+    else:
+        conn = sqlite3.connect(db_path, timeout=timeout, cached_statements=CACHED_STATEMENTS)
+    apply_pragmas(conn, profile or ("read" if readonly else "write"))
+    return conn
+
+
+def get_connection(db_path, readonly=False):
+    """Return this thread's pooled connection to db_path; do not close it.
+
+    The connection stays open across calls, so its page cache and prepared
+    statements are reused.  Callers commit their writes as before; anything
+    left uncommitted is rolled back by release_connections().
+    """
+    conns = getattr(_pool, "conns", None)
+    if conns is None:
+        conns = _pool.conns = {}
+    key = (os.path.abspath(db_path), readonly)
+    conn = conns.get(key)
+    if conn is None:
+        conn = conns[key] = connect(db_path, readonly)
+    return conn
+
+
+def release_connections():
+    """Roll back transactions left open on this thread's pooled connections."""
+    for conn in getattr(_pool, "conns", {}).values():
+        if conn.in_transaction:
+            conn.rollback()
+
+
+def close_connections(db_path=None):
+    """Close this thread's pooled connections (all, or only those to db_path)."""
+    conns = getattr(_pool, "conns", {})
+    target = os.path.abspath(db_path) if db_path is not None else None
+    for key in list(conns):
+        if target is None or key[0] == target:
+            conns.pop(key).close()
+
+
+# Write coordination.  Every process that writes takes the writer lock
+# (a flock on <db>.lock) around its transaction, so writers queue up instead
+# of failing with "database is locked".  Inside the admin server a single
+# writer thread owns the write connection and commits queued jobs together.
+_writers = {}
+
+
+def lock_path(db_path):
+    return Path(f"{db_path}.lock")
+
+
+@contextmanager
+def write_lock(db_path, timeout=BUSY_TIMEOUTS["batch"]):
+    """Hold the cross-process writer lock on db_path; re-entrant per thread."""
+    held = getattr(_pool, "locks", None)
+    if held is None:
+        held = _pool.locks = set()
+    key = os.path.abspath(db_path)
+    if fcntl is None or key in held:
+        yield
+        return
+    with open(lock_path(db_path), "a") as handle:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timed out waiting for the write lock: {lock_path(db_path)}")
+                time.sleep(LOCK_POLL_SECONDS)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def commit(conn):
+    """Commit a write helper's changes unless the write queue is batching them."""
+    if not getattr(_pool, "batching", False):
+        ahaki_text.compress_cold_text(conn)
+        conn.commit()
+
+
+def locked_batches(db_path, conn, items, size=IMPORT_BATCH_SIZE):
+    """Yield items, committing and releasing the writer lock every size items.
+
+    Long imports loop over this instead of holding the lock for the whole
+    run, so the admin server's queued edits get in between batches.  If the
+    loop stops early the unfinished batch is rolled back.  Inside a write
+    queue job the items pass straight through; the queue commits.
+    """
+    if getattr(_pool, "batching", False):
+        yield from items
+        return
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        with write_lock(db_path):
+            try:
+                yield from chunk
+            except GeneratorExit:
+                conn.rollback()
+                raise
+            commit(conn)
+        chunk = list(islice(items, size))
+        if chunk:
+            # Stay off the lock for a full poll so a waiting writer gets it.
+            time.sleep(2 * LOCK_POLL_SECONDS)
+
+
+class WriteQueue:
+    """Single writer thread for one database inside the admin server.
+
+    Request threads submit() write jobs and wait for their result.  The
+    writer takes everything queued (up to batch_size jobs) and runs it in one
+    transaction under the writer lock, each job in its own savepoint, so a
+    burst of small edits costs one commit and a failing job only undoes
+    itself.
+    """
+
+    def __init__(self, db_path, batch_size=WRITE_BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="ahaki-writer", daemon=True)
+
+    def start(self):
+        _writers[os.path.abspath(self.db_path)] = self
+        self.thread.start()
+        return self
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.jobs.put((future, fn, args, kwargs))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        outcomes = []
+        conn = get_connection(self.db_path)
+        try:
+            with write_lock(self.db_path, BUSY_TIMEOUTS["interactive"]):
+                conn.execute("BEGIN IMMEDIATE")
+                _pool.batching = True
+                try:
+                    for future, fn, args, kwargs in batch:
+                        conn.execute("SAVEPOINT write_job")
+                        try:
+                            outcomes.append((future, fn(*args, **kwargs), None))
+                        except Exception as exc:
+                            conn.execute("ROLLBACK TO write_job")
+                            outcomes.append((future, None, exc))
+                        conn.execute("RELEASE write_job")
+                finally:
+                    _pool.batching = False
+                ahaki_text.compress_cold_text(conn)
+                conn.commit()
+        except Exception as exc:
+            release_connections()
+            for future, *_ in batch:
+                future.set_exception(exc)
+            return
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+def run_write(db_path, fn, *args, **kwargs):
+    """Run a write helper through db_path's write queue, or under the writer lock."""
+    writer = _writers.get(os.path.abspath(db_path))
+    if writer is None:
+        with write_lock(db_path):
+            return fn(*args, **kwargs)
+    if threading.current_thread() is writer.thread:
+        return fn(*args, **kwargs)
+    return writer.submit(fn, *args, **kwargs)
+
+
+def serialized_write(fn):
+    """Decorator for write helpers whose first argument is db_path."""
+
+    @functools.wraps(fn)
+    def wrapper(db_path, *args, **kwargs):
+        return run_write(db_path, fn, db_path, *args, **kwargs)
+
+    return wrapper
+
+
+def batched_write(fn):
+    """Decorator for write helpers that loop over locked_batches().
+
+    Inside the admin server the call is still one queued job.  Elsewhere it
+    runs without an outer lock, so it commits and takes the lock per batch.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(db_path, *args, **kwargs):
+        writer = _writers.get(os.path.abspath(db_path))
+        if writer is None or threading.current_thread() is writer.thread:
+            return fn(db_path, *args, **kwargs)
+        return writer.submit(fn, db_path, *args, **kwargs)
+
+    return wrapper
+
+
+# Hot queries and the index each must use.  check_query_plans() is the guard
+# against a schema change silently turning one back into a table scan.
+HOT_QUERIES = [
+    (
+        "latest explanation version",
+        "SELECT MAX(version) FROM explanations WHERE question_id = ?",
+        "idx_explanations_question_version",
+    ),
+    (
+        "explanations of a question",
+        "SELECT body, version FROM explanations WHERE question_id = ?"
+        " ORDER BY version DESC, id DESC LIMIT 3",
+        "idx_explanations_question_version",
+    ),
+    (
+        "tags of a question",
+        "SELECT tag_id FROM question_tags WHERE question_id = ?",
+        "sqlite_autoindex_question_tags_1",
+    ),
+    (
+        "questions of a subtopic",
+        "SELECT question_id FROM question_subtopics WHERE subtopic_id = ?",
+        "idx_question_subtopics_subtopic",
+    ),
+    (
+        "next questions missing an explanation in a subject",
+        "SELECT id FROM questions q WHERE q.subject_id = ?"
+        " AND q.annotation_flags & 1 = 0"
+        " ORDER BY q.exam_session DESC, q.serial DESC LIMIT 20",
+        "idx_questions_missing_explanation",
+    ),
+    (
+        "questions of a case",
+        "SELECT id FROM questions WHERE case_id = ?",
+        "idx_questions_case",
+    ),
+    (
+        "question by serial",
+        "SELECT id FROM questions WHERE serial = ?",
+        "sqlite_autoindex_questions_1",
+    ),
+    (
+        "questions changed after a sequence",
+        "SELECT question_id FROM question_changes WHERE seq > ?",
+        "INTEGER PRIMARY KEY",
+    ),
+]
+
+
+def check_query_plans(conn):
+    """Return (label, plan) for each hot query whose plan misses its index."""
+    failures = []
+    for label, sql, index_name in HOT_QUERIES:
+        params = [None] * sql.count("?")
+        plan = " / ".join(
+            row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        )
+        if index_name not in plan:
+            failures.append((label, plan))
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Apply schema migrations to the SQLite database."
+    )
+    parser.add_argument(
+        "--db",
+        default="output/ahaki.sqlite",
+        help="Path to SQLite database.",
+    )
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="Show applied and pending migrations without changing anything.",
+    )
+    parser.add_argument(
+        "--check-coverage",
+        action="store_true",
+        help="Compare subject_coverage with counts from the child tables (exit 1 on mismatch).",
+    )
+    parser.add_argument(
+        "--rebuild-coverage",
+        action="store_true",
+        help="Recompute annotation_flags and subject_coverage from scratch.",
+    )
+    parser.add_argument(
+        "--check-plans",
+        action="store_true",
+        help="Exit with status 1 if a hot query does not use its index.",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Compress raw_text and older explanation versions, then VACUUM.",
+    )
+    parser.add_argument(
+        "--retrain-dictionary",
+        action="store_true",
+        help="Train a new compression dictionary from the current text and repack with it.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_path = Path(args.db)
+    if args.status:
+        conn = sqlite3.connect(db_path)
+        version = current_version(conn)
+        conn.close()
+        for number, description, _ in MIGRATIONS:
+            state = "applied" if number <= version else "pending"
+            print(f"{number:>3} {state:<8} {description}")
+        return
+
+    applied = ensure_schema(db_path)
+    print(f"Applied migrations: {applied or 'none'} (schema version {LATEST_VERSION})")
+    if args.check_plans:
+        conn = sqlite3.connect(db_path)
+        failures = check_query_plans(conn)
+        conn.close()
+        for label, plan in failures:
+            print(f"Index not used: {label}: {plan}")
+        if failures:
+            raise SystemExit(1)
+        print(f"All {len(HOT_QUERIES)} hot queries use their indexes.")
+    if args.rebuild_coverage:
+        conn = connect(db_path, timeout=BUSY_TIMEOUTS["batch"])
+        with write_lock(db_path):
+            rebuild_annotation_flags(conn)
+            rebuild_subject_coverage(conn)
+            conn.commit()
+        conn.close()
+        print("Rebuilt annotation_flags and subject_coverage.")
+    if args.check_coverage:
+        conn = sqlite3.connect(db_path)
+        mismatches = check_coverage(conn)
+        conn.close()
+        for subject_id, stored, expected in mismatches:
+            print(f"subject_id {subject_id}: stored {stored} / expected {expected}")
+        if mismatches:
+            print("Run with --rebuild-coverage to repair.")
+            raise SystemExit(1)
+        print("subject_coverage is consistent.")
+    if args.compress or args.retrain_dictionary:
+        size_before = db_path.stat().st_size
+        conn = connect(db_path, timeout=BUSY_TIMEOUTS["batch"])
+        with write_lock(db_path):
+            if args.retrain_dictionary:
+                changed = ahaki_text.retrain_dictionary(conn)
+            else:
+                conn.execute(
+                    "INSERT OR IGNORE INTO cold_text_pending(question_id) SELECT id FROM questions"
+                )
+                changed = ahaki_text.compress_cold_text(conn, raw_text=True)
+            conn.commit()
+            conn.execute("VACUUM")
+        conn.close()
+        print(
+            f"Packed {changed} values: {size_before:,} -> {db_path.stat().st_size:,} bytes"
+        )
+
+
+if __name__ == "__main__":
+    main()
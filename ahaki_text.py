@@ -0,0 +1,204 @@
+"""Compression of cold text in ahaki.sqlite.
+
+questions.raw_text and every explanation version but the latest (version
+DESC, id DESC) are stored as BLOBs compressed with a shared zlib
+dictionary; hot text stays plain so SQL and the search index can read it.
+A packed value is TEXT_HEADER (format, dictionary key) + raw deflate data.
+The key is a digest of the dictionary, so cached dictionaries stay valid
+across databases and dictionaries that a snapshot carries over.  The
+tables and triggers behind this are ahaki_db migrations.
+"""
+import hashlib
+import re
+import sqlite3
+import struct
+import zlib
+from collections import Counter
+from datetime import datetime
+
+TEXT_PACKED = 1
+TEXT_HEADER = struct.Struct(">BI")
+TEXT_LEVEL = 9
+DICTIONARY_SIZE = 32 * 1024
+DICTIONARY_SAMPLE_ROWS = 2000
+DICTIONARY_MIN_SAMPLE = 16 * 1024
+FRAGMENT_RE = re.compile(r"[^、。，．\n]+[、。，．\n]?")
+
+_dictionaries = {}
+
+# Explanation rows of queued questions with their rank; rank 1 is the latest.
+COLD_EXPLANATIONS_SQL = """
+    SELECT id, body, row_number() OVER (
+        PARTITION BY question_id ORDER BY version DESC, id DESC
+    )
+    FROM explanations
+    WHERE question_id IN (SELECT question_id FROM cold_text_pending)
+"""
+
+
+def dictionary_key(data):
+    return int.from_bytes(hashlib.sha1(data).digest()[:4], "big")
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    """Build a zlib preset dictionary from sample texts.
+
+    zlib has no trainer like zstd's, so this keeps the fragments (split at
+    Japanese punctuation and line breaks) that recur most, weighted by the
+    bytes each saves.  The most valuable go last, where deflate reaches them
+    with the shortest distances.
+    """
+    counts = Counter()
+    for text in samples:
+        counts.update(FRAGMENT_RE.findall(text))
+    scored = sorted(
+        ((count - 1) * len(fragment.encode("utf-8")), fragment)
+        for fragment, count in counts.items()
+        if count > 1
+    )
+    picked = []
+    total = 0
+    for _, fragment in reversed(scored):
+        data = fragment.encode("utf-8")
+        if total + len(data) > size:
+            continue
+        picked.append(data)
+        total += len(data)
+    return b"".join(reversed(picked))
+
+
+def sample_cold_text(conn, rows=DICTIONARY_SAMPLE_ROWS):
+    samples = []
+    for sql in (
+        "SELECT raw_text FROM questions WHERE typeof(raw_text) = 'text' ORDER BY random() LIMIT ?",
+        "SELECT body FROM explanations WHERE typeof(body) = 'text' ORDER BY random() LIMIT ?",
+    ):
+        samples.extend(row[0] for row in conn.execute(sql, (rows,)))
+    return samples
+
+
+def store_dictionary(conn, data):
+    key = dictionary_key(data)
+    conn.execute(
+        "INSERT OR IGNORE INTO text_dictionaries(key, data, created_at) VALUES (?, ?, ?)",
+        (key, data, datetime.now().isoformat(timespec="seconds")),
+    )
+    _dictionaries[key] = data
+    return key
+
+
+def load_dictionary(conn, key):
+    data = _dictionaries.get(key)
+    if data is None:
+        row = conn.execute("SELECT data FROM text_dictionaries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise LookupError(f"text dictionary {key:08x} is missing")
+        data = _dictionaries[key] = bytes(row[0])
+    return data
+
+
+def text_packer(conn, train=False):
+    """Return a function packing text with the newest dictionary, or None.
+
+    With train=True a first dictionary is trained from the stored text when
+    there is none yet and enough text to learn from.
+    """
+    row = conn.execute("SELECT key, data FROM text_dictionaries ORDER BY id DESC LIMIT 1").fetchone()
+    if row is None:
+        if not train:
+            return None
+        samples = sample_cold_text(conn)
+        if sum(len(text.encode("utf-8")) for text in samples) < DICTIONARY_MIN_SAMPLE:
+            return None
+        data = train_dictionary(samples)
+        row = (store_dictionary(conn, data), data)
+    key, data = row
+    _dictionaries[key] = data = bytes(data)
+    # Priming once and copying skips re-reading the dictionary for every value.
+    primed = zlib.compressobj(TEXT_LEVEL, zlib.DEFLATED, -15, 4, zlib.Z_DEFAULT_STRATEGY, data)
+    header = TEXT_HEADER.pack(TEXT_PACKED, key)
+
+    def pack(text):
+        raw = text.encode("utf-8")
+        compressor = primed.copy()
+        packed = header + compressor.compress(raw) + compressor.flush()
+        return packed if len(packed) < len(raw) else text
+
+    return pack
+
+
+def unpack_text(conn, value):
+    """Return stored text as str, decompressing it only if it is packed.
+
+    Readers fetch raw_text / explanation bodies as stored and call this for
+    the values they actually use; dictionaries are loaded on first use.
+    """
+    if not isinstance(value, bytes):
+        return value
+    fmt, key = TEXT_HEADER.unpack_from(value)
+    if fmt != TEXT_PACKED:
+        raise ValueError(f"unknown packed text format {fmt}")
+    decompressor = zlib.decompressobj(-15, zdict=load_dictionary(conn, key))
+    data = decompressor.decompress(value[TEXT_HEADER.size :]) + decompressor.flush()
+    return data.decode("utf-8")
+
+
+def compress_cold_text(conn, raw_text=False):
+    """Pack queued explanation history, and raw_text if asked; return rows changed.
+
+    The latest version of each queued question is kept (or made) plain
+    again, e.g. after the newest version was deleted.  Runs inside commit()
+    so every write path leaves its history compressed.
+    """
+    try:
+        pending = conn.execute("SELECT 1 FROM cold_text_pending LIMIT 1").fetchone()
+    except sqlite3.OperationalError:
+        return 0  # schema older than the compression migration
+    if not pending and not raw_text:
+        return 0
+    pack = text_packer(conn, train=True)
+    updates = []
+    for explanation_id, body, rank in conn.execute(COLD_EXPLANATIONS_SQL).fetchall():
+        if rank == 1 and isinstance(body, bytes):
+            updates.append((unpack_text(conn, body), explanation_id))
+        elif rank > 1 and isinstance(body, str) and pack is not None:
+            packed = pack(body)
+            if packed is not body:
+                updates.append((packed, explanation_id))
+    conn.executemany("UPDATE explanations SET body = ? WHERE id = ?", updates)
+    conn.execute("DELETE FROM cold_text_pending")
+    changed = len(updates)
+    if raw_text and pack is not None:
+        rows = conn.execute(
+            "SELECT id, raw_text FROM questions WHERE typeof(raw_text) = 'text'"
+        ).fetchall()
+        packed_rows = [(pack(text), question_id) for question_id, text in rows]
+        packed_rows = [(value, qid) for value, qid in packed_rows if isinstance(value, bytes)]
+        conn.executemany("UPDATE questions SET raw_text = ? WHERE id = ?", packed_rows)
+        changed += len(packed_rows)
+    return changed
+
+
+def retrain_dictionary(conn):
+    """Train a new dictionary from the current text and repack cold text with it.
+
+    Returns the number of values packed.  Older dictionaries are dropped
+    once nothing refers to them.
+    """
+    samples = []
+    for sql in ("SELECT raw_text FROM questions", "SELECT body FROM explanations"):
+        rows = conn.execute(f"{sql} ORDER BY random() LIMIT ?", (DICTIONARY_SAMPLE_ROWS,))
+        samples.extend(unpack_text(conn, row[0]) for row in rows)
+    data = train_dictionary(samples)
+    for table, column in (("questions", "raw_text"), ("explanations", "body")):
+        rows = conn.execute(
+            f"SELECT id, {column} FROM {table} WHERE typeof({column}) = 'blob'"
+        ).fetchall()
+        conn.executemany(
+            f"UPDATE {table} SET {column} = ? WHERE id = ?",
+            [(unpack_text(conn, value), row_id) for row_id, value in rows],
+        )
+    conn.execute("DELETE FROM text_dictionaries")
+    store_dictionary(conn, data)
+    conn.execute("INSERT OR IGNORE INTO cold_text_pending(question_id) SELECT id FROM questions")
+    return compress_cold_text(conn, raw_text=True)
@@ -1,36 +1,177 @@
+import argparse
+import hashlib
 import json
 import os
 import re
 import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import pandas as pd
+import ahaki_db
+import ahaki_text
 
-from convert_ahaki_to_json import (
-    add_subject_to_questions_and_rearrange_columns,
-    clean_subject_names,
-    generate_question_number,
-    process_questions,
-    remove_serial_number_from_questions,
-    replace_question_with_serial,
-    store_case_details_next_to_questions,
-)
+# Bump whenever parse_exam_file output changes so the build manifest
+# invalidates every file.
+PARSER_VERSION = 2
+BATCH_SIZE = 500
+PACK_INDEX_NAME = "index.json"
+PACK_NDJSON_NAME = "questions.ndjson"
+CASES_JSON_NAME = "cases.json"
 
 FULLWIDTH_TO_ASCII = str.maketrans("０１２３４５６７８９", "0123456789")
 
+EXAM_TYPES = {"A": "あん摩マッサージ指圧師", "B": "はり師・きゆう師"}
+SUBJECT_ALIASES = {"衛生学／公衆衛生学": "衛生学・公衆衛生学"}
+
+SESSION_RE = re.compile(r"第([０-９0-9]+)回")
+QUESTION_NUMBER_RE = re.compile(r"問題(\d+)")
+QUESTION_REF_RE = re.compile(r"問題([０-９0-9]+)")
+QUESTION_ROW_RE = re.compile(r"^[AB]\d{2}-\d{3}")
+SUBJECT_RE = re.compile(r"《([^》]+)》")
+SERIAL_RE = re.compile(r"[AB]\d{2}-\d{3,}")
+GROUPED_SERIAL_RE = re.compile(r"([AB]\d{2})-(\d{3,})(?:[、,](\d{1,3}))+")
+GROUPED_NUMBER_RE = re.compile(r"\d{1,3}")
+CASE_INTRO_RE = re.compile(r"(次の.*症例|症例について)")
+LEADING_SERIAL_RE = re.compile(r"\b[AB]\d{2}-\d{3,}\s+")
+CHOICE_RE = re.compile(r"^[ 　]*([0-9０-９]+)[\.．]\s*(.*)$")
+ANSWER_DIGIT_RE = re.compile(r"[1-4]")
+
 
 def normalize_digits(value):
     return value.translate(FULLWIDTH_TO_ASCII)
 
 
-def add_exam_type_and_session(df):
-    df["Exam Type"] = df["Serial Number"].str[0].map(
-        {"A": "あん摩マッサージ指圧師", "B": "はり師・きゆう師"}
-    )
-    df["Exam Session"] = (
-        df["Serial Number"].str.extract(r"[AB](\d{2})-").astype(float).astype("Int64")
-    )
-    return df
+def read_blocks(txt_path):
+    """Yield question blocks (問題… through 解答…) and stray lines of a TXT file."""
+    current, in_q = [], False
+    with open(txt_path, "r", encoding="utf-16") as f:
+        for ln in f:
+            ln = ln.strip()
+            if not ln:
+                continue
+            if ln.startswith("問題"):
+                if current:
+                    yield "\n".join(current)
+                current, in_q = [ln], True
+                continue
+            if in_q:
+                current.append(ln)
+                if ln.startswith("解答"):
+                    yield "\n".join(current)
+                    current, in_q = [], False
+                continue
+            yield ln
+    if current:
+        yield "\n".join(current)
+
+
+def serial_prefix(header):
+    if "あん摩マッサージ指圧師試験" in header:
+        exam_type_code = "A"
+    elif "はり師・きゆう師試験" in header:
+        exam_type_code = "B"
+    else:
+        return None
+    match = SESSION_RE.search(header)
+    if not match:
+        return None
+    return f"{exam_type_code}{int(normalize_digits(match.group(1))):02}-"
+
+
+def extract_case_serials(text):
+    serials = set(SERIAL_RE.findall(text))
+    for match in GROUPED_SERIAL_RE.finditer(text):
+        prefix = match.group(1)
+        for num in GROUPED_NUMBER_RE.findall(match.group(0)):
+            serials.add(f"{prefix}-{int(num):03}")
+    return sorted(serials)
+
+
+def parse_exam_file(txt_path):
+    """Yield one finished question record per question in a UTF-16 exam file.
+
+    Equivalent to the convert_ahaki_to_json pandas pipeline, but only the
+    current file is held in memory and no DataFrame is built.
+    """
+    blocks = []
+    numbers = set()
+    for block in read_blocks(txt_path):
+        serial_num = None
+        if block.startswith("問題"):
+            match = QUESTION_NUMBER_RE.search(block)
+            if match:
+                serial_num = f"{int(match.group(1)):03}"
+                numbers.add(serial_num)
+        blocks.append((block, serial_num))
+    if not blocks:
+        return
+
+    prefix = serial_prefix(blocks[0][0])
+    if prefix is None:
+        raise ValueError("exam header not recognized")
+
+    def to_serial(match):
+        num = f"{int(normalize_digits(match.group(1))):03}"
+        return prefix + num if num in numbers else match.group(0)
+
+    # Case intros are linked to every serial they mention; the case text runs
+    # from the intro up to the next question.  Later intros win.
+    questions = []
+    case_by_serial = {}
+    open_cases = []
+    subject = None
+    for block, serial_num in blocks:
+        text = QUESTION_REF_RE.sub(to_serial, block)
+        match = SUBJECT_RE.search(text)
+        if match:
+            subject = match.group(1)
+            continue
+        if QUESTION_ROW_RE.match(text):
+            for serials, lines in open_cases:
+                combined = "\n".join(lines)
+                for sn in serials:
+                    case_by_serial[sn] = combined
+            open_cases = []
+            if serial_num is not None:
+                questions.append((prefix + serial_num, subject, text))
+            continue
+        for _, lines in open_cases:
+            lines.append(text)
+        if "症例" in text and CASE_INTRO_RE.search(text):
+            serials = extract_case_serials(text)
+            if serials:
+                open_cases.append((serials, [text]))
+    for serials, lines in open_cases:
+        combined = "\n".join(lines)
+        for sn in serials:
+            case_by_serial[sn] = combined
+
+    exam_type_code = prefix[0]
+    exam_session = int(prefix[1:-1])
+    for serial, subject_name, raw_text in questions:
+        if subject_name is not None:
+            subject_name = subject_name.strip()
+            subject_name = SUBJECT_ALIASES.get(subject_name, subject_name)
+        stem, choices, answer_index, answer_indices, answer_none, answer_text = parse_question_content(
+            LEADING_SERIAL_RE.sub("", raw_text)
+        )
+        yield {
+            "serial": serial,
+            "exam_type_code": exam_type_code,
+            "exam_type": EXAM_TYPES[exam_type_code],
+            "exam_session": exam_session,
+            "subject": subject_name,
+            "case_text": case_by_serial.get(serial),
+            "stem": stem,
+            "choices": choices,
+            "answer_index": answer_index,
+            "answer_indices": answer_indices,
+            "answer_none": answer_none,
+            "answer_text": answer_text,
+            "raw_text": raw_text,
+        }
 
 
 def parse_question_content(question_text):
@@ -43,12 +184,11 @@ def parse_question_content(question_text):
         else:
             content_lines.append(ln)
 
-    choice_re = re.compile(r"^[ 　]*([0-9０-９]+)[\.．]\s*(.*)$")
     choices = []
     stem_lines = []
     in_choices = False
     for ln in content_lines:
-        match = choice_re.match(ln)
+        match = CHOICE_RE.match(ln)
         if match:
             in_choices = True
             choices.append(match.group(2).strip())
@@ -72,7 +212,7 @@ def parse_question_content(question_text):
         elif "すべて" in normalized:
             answer_indices = [1, 2, 3, 4]
         else:
-            digits = re.findall(r"[1-4]", normalized)
+            digits = ANSWER_DIGIT_RE.findall(normalized)
             answer_indices = sorted({int(d) for d in digits})
         if len(answer_indices) == 1:
             answer_index = answer_indices[0]
@@ -80,112 +220,27 @@ def parse_question_content(question_text):
     return stem, choices, answer_index, answer_indices, answer_none, answer_line
 
 
-def build_dataframe(txt_path):
-    df = (
-        process_questions(txt_path)
-        .pipe(generate_question_number)
-        .pipe(replace_question_with_serial)
-        .pipe(add_subject_to_questions_and_rearrange_columns)
-        .pipe(store_case_details_next_to_questions)
-    )
+def init_db(conn, with_indexes=True):
+    conn.execute("PRAGMA foreign_keys = ON")
+    ahaki_db.migrate(conn, None if with_indexes else ahaki_db.TABLES_VERSION)
+    # Rows are written with case_id, and a snapshot carries text dictionaries
+    # over with the explanations, so a staged build needs both tables up front.
+    ahaki_db.migrate_cases(conn)
+    ahaki_db.migrate_text_compression(conn)
 
-    df["Raw Text"] = df["Question"]
 
-    df = (
-        df.pipe(remove_serial_number_from_questions)
-        .pipe(clean_subject_names)
-        .pipe(add_exam_type_and_session)
-    )
-
-    return df
-
-
-def init_db(conn):
-    conn.executescript(
-        """
-        PRAGMA foreign_keys = ON;
-
-        CREATE TABLE IF NOT EXISTS subjects (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL UNIQUE
-        );
-
-        CREATE TABLE IF NOT EXISTS questions (
-            id INTEGER PRIMARY KEY,
-            serial TEXT NOT NULL UNIQUE,
-            exam_type_code TEXT NOT NULL,
-            exam_type TEXT NOT NULL,
-            exam_session INTEGER NOT NULL,
-            subject_id INTEGER,
-            case_text TEXT,
-            stem TEXT NOT NULL,
-            choices_json TEXT NOT NULL,
-            answer_index INTEGER,
-            answer_indices_json TEXT,
-            answer_none INTEGER DEFAULT 0,
-            answer_text TEXT,
-            raw_text TEXT NOT NULL,
-            FOREIGN KEY (subject_id) REFERENCES subjects(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS explanations (
-            id INTEGER PRIMARY KEY,
-            question_id INTEGER NOT NULL,
-            body TEXT NOT NULL,
-            version INTEGER NOT NULL DEFAULT 1,
-            source TEXT,
-            FOREIGN KEY (question_id) REFERENCES questions(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS explanation_update_log (
-            date TEXT PRIMARY KEY,
-            count INTEGER NOT NULL DEFAULT 0
-        );
-
-        CREATE TABLE IF NOT EXISTS tags (
-            id INTEGER PRIMARY KEY,
-            label TEXT NOT NULL UNIQUE,
-            type TEXT
-        );
-
-        CREATE TABLE IF NOT EXISTS question_tags (
-            question_id INTEGER NOT NULL,
-            tag_id INTEGER NOT NULL,
-            source TEXT NOT NULL,
-            PRIMARY KEY (question_id, tag_id, source),
-            FOREIGN KEY (question_id) REFERENCES questions(id),
-            FOREIGN KEY (tag_id) REFERENCES tags(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS subtopics (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL UNIQUE,
-            parent_id INTEGER,
-            FOREIGN KEY (parent_id) REFERENCES subtopics(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS question_subtopics (
-            question_id INTEGER NOT NULL,
-            subtopic_id INTEGER NOT NULL,
-            PRIMARY KEY (question_id, subtopic_id),
-            FOREIGN KEY (question_id) REFERENCES questions(id),
-            FOREIGN KEY (subtopic_id) REFERENCES subtopics(id)
-        );
-
-        CREATE INDEX IF NOT EXISTS idx_questions_serial ON questions(serial);
-        CREATE INDEX IF NOT EXISTS idx_questions_subject ON questions(subject_id);
-        CREATE INDEX IF NOT EXISTS idx_question_tags_tag ON question_tags(tag_id);
-        """
-    )
+def create_indexes(conn):
+    ahaki_db.migrate(conn)
 
 
-def build_question_json(record):
+def build_question_json(record, case_cache):
+    # The case text itself goes to cases.json once, keyed by case_id.
     return {
         "serial": record["serial"],
         "exam_type": record["exam_type"],
         "exam_session": record["exam_session"],
         "subject": record["subject"],
-        "case_text": record["case_text"],
+        "case_id": case_cache.get(record["case_text"]),
         "stem": record["stem"],
         "choices": record["choices"],
         "answer_index": record["answer_index"],
@@ -197,15 +252,566 @@ def build_question_json(record):
     }
 
 
+QUESTION_UPSERT_SQL = """
+    INSERT INTO questions(
+        serial,
+        exam_type_code,
+        exam_type,
+        exam_session,
+        subject_id,
+        case_id,
+        stem,
+        choices_json,
+        answer_index,
+        answer_indices_json,
+        answer_none,
+        answer_text,
+        raw_text
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(serial) DO UPDATE SET
+        exam_type_code = excluded.exam_type_code,
+        exam_type = excluded.exam_type,
+        exam_session = excluded.exam_session,
+        subject_id = excluded.subject_id,
+        case_id = excluded.case_id,
+        stem = excluded.stem,
+        choices_json = excluded.choices_json,
+        answer_index = excluded.answer_index,
+        answer_indices_json = excluded.answer_indices_json,
+        answer_none = excluded.answer_none,
+        answer_text = excluded.answer_text,
+        raw_text = excluded.raw_text
+    WHERE questions.exam_type_code IS NOT excluded.exam_type_code
+        OR questions.exam_type IS NOT excluded.exam_type
+        OR questions.exam_session IS NOT excluded.exam_session
+        OR questions.subject_id IS NOT excluded.subject_id
+        OR questions.case_id IS NOT excluded.case_id
+        OR questions.stem IS NOT excluded.stem
+        OR questions.choices_json IS NOT excluded.choices_json
+        OR questions.answer_index IS NOT excluded.answer_index
+        OR questions.answer_indices_json IS NOT excluded.answer_indices_json
+        OR questions.answer_none IS NOT excluded.answer_none
+        OR questions.answer_text IS NOT excluded.answer_text
+        OR questions.raw_text IS NOT excluded.raw_text
+"""
+
+
+def question_params(record, subject_id, case_id, pack_raw=None):
+    return (
+        record["serial"],
+        record["exam_type_code"],
+        record["exam_type"],
+        record["exam_session"],
+        subject_id,
+        case_id,
+        record["stem"],
+        json.dumps(record["choices"], ensure_ascii=False),
+        record["answer_index"],
+        json.dumps(record["answer_indices"], ensure_ascii=False),
+        1 if record["answer_none"] else 0,
+        record["answer_text"],
+        # Packed with the same dictionary as the stored value so unchanged
+        # rows compare equal in the upsert.
+        pack_raw(record["raw_text"]) if pack_raw else record["raw_text"],
+    )
+
+
+def write_question_json(record, case_cache, json_dir):
+    json_path = json_dir / f"{record['serial']}.json"
+    json_text = json.dumps(build_question_json(record, case_cache), ensure_ascii=False, indent=2)
+    if not json_path.exists() or json_path.read_text(encoding="utf-8") != json_text:
+        json_path.write_text(json_text, encoding="utf-8")
+
+
+def write_question(conn, record, subject_cache, case_cache, json_dir, pack_raw=None):
+    """Row-at-a-time write path: one upsert and one subject lookup per miss."""
+    subject_name = record["subject"]
+    if subject_name not in subject_cache:
+        conn.execute(
+            "INSERT OR IGNORE INTO subjects(name) VALUES (?)",
+            (subject_name,),
+        )
+        subject_id = conn.execute(
+            "SELECT id FROM subjects WHERE name = ?",
+            (subject_name,),
+        ).fetchone()[0]
+        subject_cache[subject_name] = subject_id
+    subject_id = subject_cache[subject_name]
+    ahaki_db.resolve_case_ids(conn, [record["case_text"]], case_cache)
+
+    cursor = conn.execute(
+        QUESTION_UPSERT_SQL,
+        question_params(record, subject_id, case_cache.get(record["case_text"]), pack_raw),
+    )
+    if json_dir is not None:
+        write_question_json(record, case_cache, json_dir)
+    return cursor.rowcount
+
+
+def resolve_subject_ids(conn, names, subject_cache):
+    missing = [(name,) for name in names if name not in subject_cache]
+    if not missing:
+        return
+    conn.executemany("INSERT OR IGNORE INTO subjects(name) VALUES (?)", missing)
+    for subject_id, name in conn.execute("SELECT id, name FROM subjects"):
+        subject_cache[name] = subject_id
+
+
+def write_questions_bulk(
+    conn, records, subject_cache, case_cache, json_dir, batch_size=BATCH_SIZE, pack_raw=None
+):
+    """Batched write path: subjects and cases resolved up front, executemany per batch."""
+    updated = 0
+    for start in range(0, len(records), batch_size):
+        batch = records[start : start + batch_size]
+        # dict.fromkeys keeps first-seen order so subject ids match the row path.
+        names = dict.fromkeys(r["subject"] for r in batch)
+        resolve_subject_ids(conn, names, subject_cache)
+        ahaki_db.resolve_case_ids(conn, [r["case_text"] for r in batch], case_cache)
+        cursor = conn.executemany(
+            QUESTION_UPSERT_SQL,
+            [
+                question_params(
+                    r, subject_cache.get(r["subject"]), case_cache.get(r["case_text"]), pack_raw
+                )
+                for r in batch
+            ],
+        )
+        updated += cursor.rowcount
+        if json_dir is not None:
+            for record in batch:
+                write_question_json(record, case_cache, json_dir)
+    return updated
+
+
+def write_questions(
+    conn, records, subject_cache, case_cache, json_dir, write_mode, pack_raw=None
+):
+    if write_mode == "row":
+        return sum(
+            write_question(conn, record, subject_cache, case_cache, json_dir, pack_raw)
+            for record in records
+        )
+    return write_questions_bulk(
+        conn, records, subject_cache, case_cache, json_dir, pack_raw=pack_raw
+    )
+
+
+def vanished_serials(previous, current, failed, retained=()):
+    """Serials the previous manifest knew that no parsed file yields any more.
+
+    retained lists earlier vanished serials kept for their annotations, so
+    they are checked again.  Files that failed to parse in this run keep
+    their previous serials.
+    """
+    kept = {serial for entry in current.values() for serial in entry.get("serials", [])}
+    for name in failed:
+        kept.update(previous.get(name, {}).get("serials", []))
+    known = {serial for entry in previous.values() for serial in entry.get("serials", [])}
+    return sorted((known | set(retained)) - kept)
+
+
+def prune_questions(conn, serials, batch_size=BATCH_SIZE):
+    """Delete vanished questions without annotations; return (deleted, kept) serials.
+
+    Questions that have explanations, tags, subtopics or reports stay so no
+    annotation is lost; a --snapshot rebuild drops them with a count.
+    """
+    deleted = []
+    kept = []
+    for start in range(0, len(serials), batch_size):
+        batch = serials[start : start + batch_size]
+        placeholders = ",".join("?" for _ in batch)
+        rows = conn.execute(
+            f"SELECT serial, annotation_flags FROM questions WHERE serial IN ({placeholders})",
+            batch,
+        ).fetchall()
+        for serial, flags in rows:
+            (kept if flags else deleted).append(serial)
+    for start in range(0, len(deleted), batch_size):
+        batch = deleted[start : start + batch_size]
+        placeholders = ",".join("?" for _ in batch)
+        conn.execute(f"DELETE FROM questions WHERE serial IN ({placeholders})", batch)
+    return sorted(deleted), sorted(kept)
+
+
+def apply_build_pragmas(conn):
+    """Pragma profile for bulk loading; WAL lets readers continue meanwhile."""
+    ahaki_db.apply_pragmas(conn, "build")
+
+
+def compare_write_paths(records, batch_size=BATCH_SIZE):
+    """Time the row and bulk write paths on throwaway databases."""
+    timings = {}
+    for write_mode in ("row", "bulk"):
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(Path(tmp) / "compare.sqlite")
+            if write_mode == "bulk":
+                apply_build_pragmas(conn)
+                init_db(conn, with_indexes=False)
+            else:
+                init_db(conn)
+            started = time.perf_counter()
+            if write_mode == "bulk":
+                write_questions_bulk(conn, records, {}, {}, None, batch_size)
+                create_indexes(conn)
+            else:
+                write_questions(conn, records, {}, {}, None, write_mode)
+            ahaki_db.sync_search_index(conn)
+            conn.commit()
+            timings[write_mode] = time.perf_counter() - started
+            conn.close()
+    return timings
+
+
+def snapshot_path(db_path):
+    return db_path.with_name(db_path.name + ".next")
+
+
+def remove_db_files(path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+
+def data_version(conn):
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def carry_over_annotations(conn, live_path):
+    conn.execute("ATTACH DATABASE ? AS live", (str(live_path),))
+    counts = ahaki_db.copy_annotations(conn, "live")
+    conn.commit()
+    conn.execute("DETACH DATABASE live")
+    return counts
+
+
+def verify_snapshot(conn):
+    """Return the problems that keep a snapshot from replacing the live DB."""
+    problems = [
+        f"integrity_check: {row[0]}"
+        for row in conn.execute("PRAGMA integrity_check").fetchall()
+        if row[0] != "ok"
+    ]
+    for table, rowid, parent, _ in conn.execute("PRAGMA foreign_key_check").fetchall():
+        problems.append(f"foreign key: {table} rowid {rowid} -> {parent}")
+    for subject_id, stored, expected in ahaki_db.check_coverage(conn):
+        problems.append(f"subject_coverage {subject_id}: {stored} != {expected}")
+    if not conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]:
+        problems.append("no questions")
+    return problems
+
+
+def swap_snapshot(conn, snapshot, live_path, monitor, seen_version):
+    """Verify the snapshot, then replace the live database with it in one step.
+
+    The live file is overwritten through the backup API rather than renamed:
+    connections already open on a WAL database would otherwise keep the old
+    inode and could delete the new file's WAL when they close.  Readers keep
+    their snapshot until the copy commits and see the new data on their next
+    read; writers wait on the writer lock only for the copy itself.
+    """
+    problems = verify_snapshot(conn)
+    if not problems and monitor is not None:
+        with ahaki_db.write_lock(live_path):
+            if data_version(monitor) != seen_version:
+                # Someone edited the live DB during the build; copy the
+                # annotations again while writers are held off.
+                ahaki_db.clear_annotations(conn)
+                carry_over_annotations(conn, live_path)
+                ahaki_text.compress_cold_text(conn, raw_text=True)
+                ahaki_db.sync_search_index(conn)
+                conn.commit()
+                problems = verify_snapshot(conn)
+            if not problems:
+                live = ahaki_db.connect(live_path, timeout=ahaki_db.BUSY_TIMEOUTS["batch"])
+                conn.backup(live)
+                live.close()
+        monitor.close()
+    if problems:
+        conn.close()
+        for problem in problems[:20]:
+            print(f"Snapshot check failed: {problem}")
+        raise SystemExit(f"Live database left unchanged; snapshot kept at {snapshot}")
+    if monitor is None:
+        # Nothing is serving the old file yet, so a plain rename is safe.
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+        os.replace(snapshot, live_path)
+        return
+    conn.close()
+    remove_db_files(snapshot)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path, json_layout):
+    """Return (files, retained serials) from the build manifest."""
+    if not path.exists():
+        return {}, []
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        return {}, []
+    if not isinstance(data, dict) or data.get("parser_version") != PARSER_VERSION:
+        return {}, []
+    if data.get("json_layout", "per-question") != json_layout:
+        return {}, []
+    files = data.get("files")
+    retained = data.get("retained")
+    return (
+        files if isinstance(files, dict) else {},
+        retained if isinstance(retained, list) else [],
+    )
+
+
+def save_manifest(path, files, json_layout, retained=()):
+    path.write_text(
+        json.dumps(
+            {
+                "parser_version": PARSER_VERSION,
+                "json_layout": json_layout,
+                "files": files,
+                "retained": list(retained),
+            },
+            ensure_ascii=False,
+            indent=2,
+        )
+        + "\n",
+        encoding="utf-8",
+    )
+
+
+def pack_shard_name(serial):
+    return serial.split("-", 1)[0]
+
+
+def load_pack_index(pack_dir):
+    path = pack_dir / PACK_INDEX_NAME
+    if not path.exists():
+        return {"files": {}, "serials": {}}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        return {"files": {}, "serials": {}}
+    data.setdefault("files", {})
+    data.setdefault("serials", {})
+    return data
+
+
+def read_pack_lines(pack_dir, index, filename):
+    """Return {serial: line} for one pack file, using the offset index."""
+    path = pack_dir / filename
+    if not path.exists():
+        return {}
+    data = path.read_bytes()
+    lines = {}
+    for serial, (name, offset, length) in index["serials"].items():
+        if name == filename:
+            lines[serial] = data[offset : offset + length].decode("utf-8")
+    return lines
+
+
+def write_pack_file(path, lines):
+    """Write an NDJSON pack unless its content hash is unchanged."""
+    data = "".join(lines).encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    if path.exists() and file_sha256(path) == digest:
+        return digest, False
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return digest, True
+
+
+def write_question_pack(pack_dir, json_layout, groups, case_cache, removed=()):
+    """Write packed question JSON for the shards parsed in this run.
+
+    groups maps a shard name (serial prefix such as "A25") to its records.
+    "shards" writes one NDJSON file per shard; "ndjson" merges every shard
+    into questions.ndjson.  index.json maps each serial to
+    [file, byte offset, byte length] for random access.  Records carry
+    case_id; the case texts are written once to cases.json by the caller.
+    Serials in removed are dropped from shards that were not reparsed.
+    """
+    pack_dir.mkdir(parents=True, exist_ok=True)
+    index = load_pack_index(pack_dir)
+    removed = set(removed)
+    previous_files = set(index["files"])
+    lines_by_shard = {
+        name: [
+            (
+                record["serial"],
+                json.dumps(build_question_json(record, case_cache), ensure_ascii=False) + "\n",
+            )
+            for record in records
+        ]
+        for name, records in groups.items()
+    }
+
+    if json_layout == "ndjson":
+        for serial, line in read_pack_lines(pack_dir, index, PACK_NDJSON_NAME).items():
+            name = pack_shard_name(serial)
+            if name not in groups and serial not in removed:
+                lines_by_shard.setdefault(name, []).append((serial, line))
+        targets = {
+            PACK_NDJSON_NAME: [
+                item for name in sorted(lines_by_shard) for item in lines_by_shard[name]
+            ]
+        }
+        index = {"files": {}, "serials": {}}
+    else:
+        stale = {index["serials"][serial][0] for serial in removed if serial in index["serials"]}
+        for filename in stale:
+            name = filename.rsplit(".", 1)[0]
+            if name not in groups:
+                lines_by_shard[name] = [
+                    (serial, line)
+                    for serial, line in read_pack_lines(pack_dir, index, filename).items()
+                    if serial not in removed
+                ]
+        targets = {f"{name}.ndjson": items for name, items in lines_by_shard.items()}
+
+    written = 0
+    for filename, items in targets.items():
+        digest, changed = write_pack_file(pack_dir / filename, [line for _, line in items])
+        written += 1 if changed else 0
+        index["serials"] = {
+            serial: entry
+            for serial, entry in index["serials"].items()
+            if entry[0] != filename
+        }
+        offset = 0
+        for serial, line in items:
+            length = len(line.encode("utf-8"))
+            index["serials"][serial] = [filename, offset, length]
+            offset += length
+        index["files"][filename] = {"sha256": digest, "count": len(items)}
+
+    # Drop files no serial points at any more, e.g. after switching layouts.
+    referenced = {entry[0] for entry in index["serials"].values()}
+    for filename in (previous_files | set(index["files"])) - referenced:
+        (pack_dir / filename).unlink(missing_ok=True)
+        index["files"].pop(filename, None)
+
+    index["serials"] = dict(sorted(index["serials"].items()))
+    index["files"] = dict(sorted(index["files"].items()))
+    (pack_dir / PACK_INDEX_NAME).write_text(
+        json.dumps(index, ensure_ascii=False) + "\n",
+        encoding="utf-8",
+    )
+    return written
+
+
+def write_cases_json(path, cases):
+    """Write {case_id: text} next to the question JSON unless it is unchanged."""
+    text = json.dumps(
+        {str(case_id): body for case_id, body in sorted(cases.items())},
+        ensure_ascii=False,
+        indent=2,
+    ) + "\n"
+    if path.exists() and path.read_text(encoding="utf-8") == text:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return True
+
+
+def parse_file(txt_path):
+    """Parse one TXT file in a worker process; returns (records, error)."""
+    try:
+        return list(parse_exam_file(txt_path)), None
+    except Exception as exc:
+        return [], str(exc)
+
+
+def iter_parsed_files(txt_files, jobs):
+    if jobs <= 1:
+        for txt_path in txt_files:
+            yield txt_path, parse_file(txt_path)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # map() keeps input order, so the writer sees files in the same
+        # order as the serial run.
+        yield from zip(txt_files, executor.map(parse_file, txt_files))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build SQLite and per-question JSON from kokushitxt/*.txt."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of parser processes (0 = CPU count).",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the build manifest and reparse every file.",
+    )
+    parser.add_argument(
+        "--write-mode",
+        choices=["bulk", "row"],
+        default="bulk",
+        help="bulk: batched executemany with build pragmas; row: one upsert per question.",
+    )
+    parser.add_argument(
+        "--json-layout",
+        choices=["shards", "ndjson", "per-question"],
+        default="shards",
+        help=(
+            "shards: one NDJSON per session in output/questions_pack/; "
+            "ndjson: a single questions.ndjson; "
+            "per-question: one JSON file per serial in output/questions_json/."
+        ),
+    )
+    parser.add_argument(
+        "--input-dir",
+        default=None,
+        help="Directory with exam TXT files (default: kokushitxt/ next to this script).",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Directory for SQLite, JSON and the manifest (default: output/ next to this script).",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help=(
+            "Rebuild into a fresh database, carry over explanations/tags/subtopics/"
+            "feedback from the live one, verify it and swap it in (implies --full)."
+        ),
+    )
+    parser.add_argument(
+        "--compare-write",
+        action="store_true",
+        help="Time both write paths on temporary databases and exit.",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
     base_dir = Path(__file__).resolve().parent
-    input_dir = base_dir / "kokushitxt"
-    output_dir = base_dir / "output"
+    input_dir = Path(args.input_dir) if args.input_dir else base_dir / "kokushitxt"
+    output_dir = Path(args.output_dir) if args.output_dir else base_dir / "output"
     output_dir.mkdir(parents=True, exist_ok=True)
 
     db_path = output_dir / "ahaki.sqlite"
-    json_dir = output_dir / "questions_json"
-    json_dir.mkdir(parents=True, exist_ok=True)
+    json_dir = None
+    pack_dir = output_dir / "questions_pack"
+    if args.json_layout == "per-question":
+        json_dir = output_dir / "questions_json"
+        json_dir.mkdir(parents=True, exist_ok=True)
 
     txt_files = sorted(
         [p for p in input_dir.iterdir() if p.suffix.lower() == ".txt"]
@@ -213,117 +819,135 @@ def main():
     if not txt_files:
         raise FileNotFoundError(f"No .txt files found in {input_dir}")
 
-    conn = sqlite3.connect(db_path)
-    init_db(conn)
+    if args.compare_write:
+        records = []
+        for txt_path, (file_records, error) in iter_parsed_files(txt_files, jobs):
+            if error:
+                print(f"Error processing {txt_path.name}: {error}")
+                continue
+            records.extend(file_records)
+        timings = compare_write_paths(records)
+        print(f"Write timing for {len(records)} questions (SQLite only):")
+        for write_mode, seconds in timings.items():
+            print(f"  {write_mode:<4} {seconds:8.3f}s")
+        if timings["bulk"] > 0:
+            print(f"  speedup x{timings['row'] / timings['bulk']:.1f}")
+        return
+
+    manifest_path = output_dir / "build_manifest.json"
+    # --full still diffs against the previous serial lists; a snapshot
+    # starts from an empty database, so nothing in it can be stale.
+    previous_manifest, retained = {}, []
+    if db_path.exists() and not args.snapshot:
+        previous_manifest, retained = load_manifest(manifest_path, args.json_layout)
+    manifest = {} if args.full else previous_manifest
+    live_path = db_path
+    if args.snapshot:
+        db_path = snapshot_path(live_path)
+        remove_db_files(db_path)
+
+    file_hashes = {p.name: file_sha256(p) for p in txt_files}
+    pending = [
+        p
+        for p in txt_files
+        if manifest.get(p.name, {}).get("sha256") != file_hashes[p.name]
+    ]
+    print(f"{len(txt_files) - len(pending)} unchanged / {len(pending)} to parse")
+
+    cold_build = not db_path.exists()
+    conn = sqlite3.connect(db_path, timeout=ahaki_db.BUSY_TIMEOUTS["batch"])
+    bulk = args.write_mode == "bulk"
+    if bulk or args.snapshot:
+        apply_build_pragmas(conn)
+    staged = cold_build and (bulk or args.snapshot)
+    init_db(conn, with_indexes=not staged)
 
     subject_cache = {}
-
-    for txt_path in txt_files:
-        try:
-            df = build_dataframe(str(txt_path))
-        except Exception as exc:
-            print(f"Error processing {txt_path.name}: {exc}")
+    case_cache = {}
+    pack_raw = ahaki_text.text_packer(conn)
+    next_manifest = {
+        name: entry for name, entry in manifest.items() if name in file_hashes
+    }
+    pack_groups = {}
+    failed = []
+    updated = 0
+    write_seconds = 0.0
+    started = time.perf_counter()
+
+    for txt_path, (records, error) in iter_parsed_files(pending, jobs):
+        if error:
+            print(f"Error processing {txt_path.name}: {error}")
+            next_manifest.pop(txt_path.name, None)
+            failed.append(txt_path.name)
             continue
-
-        for _, row in df.iterrows():
-            serial = row["Serial Number"]
-            subject_name = row["Subject"]
-            case_text = row["Case Details"]
-            question_text = row["Question"]
-            raw_text = row["Raw Text"]
-            exam_type = row["Exam Type"]
-            exam_session = int(row["Exam Session"])
-            exam_type_code = serial[0]
-
-            if subject_name not in subject_cache:
-                conn.execute(
-                    "INSERT OR IGNORE INTO subjects(name) VALUES (?)",
-                    (subject_name,),
-                )
-                subject_id = conn.execute(
-                    "SELECT id FROM subjects WHERE name = ?",
-                    (subject_name,),
-                ).fetchone()[0]
-                subject_cache[subject_name] = subject_id
-            subject_id = subject_cache[subject_name]
-
-            stem, choices, answer_index, answer_indices, answer_none, answer_text = parse_question_content(
-                question_text
-            )
-
-            conn.execute(
-                """
-                INSERT INTO questions(
-                    serial,
-                    exam_type_code,
-                    exam_type,
-                    exam_session,
-                    subject_id,
-                    case_text,
-                    stem,
-                    choices_json,
-                    answer_index,
-                    answer_indices_json,
-                    answer_none,
-                    answer_text,
-                    raw_text
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(serial) DO UPDATE SET
-                    exam_type_code = excluded.exam_type_code,
-                    exam_type = excluded.exam_type,
-                    exam_session = excluded.exam_session,
-                    subject_id = excluded.subject_id,
-                    case_text = excluded.case_text,
-                    stem = excluded.stem,
-                    choices_json = excluded.choices_json,
-                    answer_index = excluded.answer_index,
-                    answer_indices_json = excluded.answer_indices_json,
-                    answer_none = excluded.answer_none,
-                    answer_text = excluded.answer_text,
-                    raw_text = excluded.raw_text
-                """,
-                (
-                    serial,
-                    exam_type_code,
-                    exam_type,
-                    exam_session,
-                    subject_id,
-                    case_text,
-                    stem,
-                    json.dumps(choices, ensure_ascii=False),
-                    answer_index,
-                    json.dumps(answer_indices, ensure_ascii=False),
-                    1 if answer_none else 0,
-                    answer_text,
-                    raw_text,
-                ),
-            )
-
-            question_json = build_question_json(
-                {
-                    "serial": serial,
-                    "exam_type": exam_type,
-                    "exam_session": exam_session,
-                    "subject": subject_name,
-                    "case_text": case_text,
-                    "stem": stem,
-                    "choices": choices,
-                    "answer_index": answer_index,
-                    "answer_indices": answer_indices,
-                    "answer_none": answer_none,
-                    "answer_text": answer_text,
-                }
-            )
-            json_path = json_dir / f"{serial}.json"
-            json_path.write_text(
-                json.dumps(question_json, ensure_ascii=False, indent=2),
-                encoding="utf-8",
-            )
-
+        write_started = time.perf_counter()
+        updated += write_questions(
+            conn, records, subject_cache, case_cache, json_dir, args.write_mode, pack_raw
+        )
+        write_seconds += time.perf_counter() - write_started
+        if json_dir is None:
+            for record in records:
+                pack_groups.setdefault(pack_shard_name(record["serial"]), []).append(record)
+        next_manifest[txt_path.name] = {
+            "sha256": file_hashes[txt_path.name],
+            "serials": [record["serial"] for record in records],
+        }
+
+    write_started = time.perf_counter()
+    removed, kept = prune_questions(
+        conn, vanished_serials(previous_manifest, next_manifest, failed, retained)
+    )
+    if removed:
+        print(f"Questions removed (gone from the TXT files): {len(removed)}")
+        if json_dir is not None:
+            for serial in removed:
+                (json_dir / f"{serial}.json").unlink(missing_ok=True)
+    if kept:
+        print(
+            f"Questions gone from the TXT files but kept for their annotations: {len(kept)}"
+            f" ({', '.join(kept[:10])}{' ...' if len(kept) > 10 else ''});"
+            " rebuild with --snapshot to drop them"
+        )
+    monitor = seen_version = None
+    if args.snapshot and live_path.exists():
+        # Watch the live DB for edits made while the snapshot is prepared.
+        monitor = sqlite3.connect(live_path)
+        seen_version = data_version(monitor)
+        ahaki_db.migrate(conn, ahaki_db.ANNOTATIONS_VERSION)
+        for table, (copied, total) in carry_over_annotations(conn, live_path).items():
+            dropped = f" ({total - copied} dropped)" if copied != total else ""
+            print(f"Carried over {table}: {copied}{dropped}")
+    if staged:
+        create_indexes(conn)
+    ahaki_db.prune_cases(conn)
+    ahaki_text.compress_cold_text(conn, raw_text=True)
+    ahaki_db.sync_search_index(conn)
     conn.commit()
-    conn.close()
-    print(f"SQLite saved: {db_path}")
-    print(f"Question JSON saved: {json_dir}")
+    if staged:
+        # raw_text was loaded before there was a dictionary to pack it with;
+        # nobody reads the new file yet, so drop the freed space right away.
+        conn.execute("VACUUM")
+    cases = ahaki_db.load_cases(conn)
+    if args.snapshot:
+        swap_snapshot(conn, db_path, live_path, monitor, seen_version)
+    else:
+        conn.close()
+    if json_dir is None and (pack_groups or removed):
+        written = write_question_pack(
+            pack_dir, args.json_layout, pack_groups, case_cache, removed
+        )
+        print(f"Question pack files written: {written}")
+    write_cases_json((json_dir or pack_dir) / CASES_JSON_NAME, cases)
+    write_seconds += time.perf_counter() - write_started
+    total_seconds = time.perf_counter() - started
+    save_manifest(manifest_path, next_manifest, args.json_layout, kept)
+    print(f"Questions written: {updated}")
+    print(
+        f"Timing ({args.write_mode}): parse {total_seconds - write_seconds:.3f}s"
+        f" / write {write_seconds:.3f}s / total {total_seconds:.3f}s"
+    )
+    print(f"SQLite saved: {live_path}")
+    print(f"Question JSON saved: {json_dir or pack_dir}")
 
 
 if __name__ == "__main__":
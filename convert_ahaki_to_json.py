@@ -2,6 +2,9 @@ import pandas as pd
 import os
 import re
 import json     # JSON for generation
+from openpyxl import Workbook
+
+OUTPUT_COLUMNS = ['Serial Number','Exam Type','Exam Session','Subject','Case Details','Question']
 
 # ──────────────────────────────────
 # 1. Text -> DataFrame
@@ -50,48 +53,39 @@ def generate_question_number(df):
     session = int(m.group(1).translate(str.maketrans('０１２３４５６７８９','0123456789')))
     prefix = f'{exam_type}{session:02}-'
 
-    df['Serial Number'] = None
-    for i, row in df.iterrows():
-        if str(row['Question']).startswith('問題'):
-            m2 = re.search(r'問題(\d+)', row['Question'])
-            if m2:
-                df.at[i, 'Serial Number'] = prefix + f'{int(m2.group(1)):03}'
+    questions = df['Question'].astype(str)
+    numbers = questions.str.extract(r'問題(\d+)', expand=False).where(questions.str.startswith('問題'))
+    serials = numbers.map(lambda n: prefix + f'{int(n):03}', na_action='ignore')
+    df['Serial Number'] = serials.astype(object).where(serials.notna(), None)
     cols = ['Serial Number'] + [c for c in df.columns if c != 'Serial Number']
     return df[cols]
 
 def replace_question_with_serial(df):
-    mapping = {}
-    for _, r in df.iterrows():
-        if pd.notna(r['Serial Number']):
-            m = re.search(r'問題([０-９0-9]+)', r['Question'])
-            if m:
-                mapping[f'{int(m.group(1).translate(str.maketrans("０１２３４５６７８９","0123456789"))):03}'] = r['Serial Number']
+    to_ascii = str.maketrans("０１２３４５６７８９","0123456789")
+    has_serial = df['Serial Number'].notna()
+    numbers = df.loc[has_serial, 'Question'].str.extract(r'問題([０-９0-9]+)', expand=False).dropna()
+    keys = numbers.map(lambda n: f'{int(n.translate(to_ascii)):03}')
+    mapping = dict(zip(keys, df.loc[numbers.index, 'Serial Number']))
 
     def repl(m):
-        return mapping.get(f'{int(m.group(1).translate(str.maketrans("０１２３４５６７８９","0123456789"))):03}', m.group(0))
+        return mapping.get(f'{int(m.group(1).translate(to_ascii)):03}', m.group(0))
 
-    df['Question'] = df['Question'].apply(lambda x: re.sub(r'問題([０-９0-9]+)', repl, x))
+    df['Question'] = df['Question'].str.replace(r'問題([０-９0-9]+)', repl, regex=True)
     return df
 
 def add_subject_to_questions_and_rearrange_columns(df):
-    df['Subject'] = None
-    current, drop_rows = None, []
-    for i, r in df.iterrows():
-        m = re.search(r'《([^》]+)》', r['Question'])
-        if m:
-            current = m.group(1)
-            drop_rows.append(i)
-        df.at[i, 'Subject'] = current
-    df.drop(drop_rows, inplace=True)
-    df.reset_index(drop=True, inplace=True)
+    markers = df['Question'].str.extract(r'《([^》]+)》', expand=False)
+    subjects = markers.ffill()
+    df['Subject'] = subjects.astype(object).where(subjects.notna(), None)
+    df = df[markers.isna()].reset_index(drop=True)
     cols = ['Serial Number', 'Subject'] + [c for c in df.columns if c not in ('Serial Number','Subject')]
     return df[cols]
 
 def store_case_details_next_to_questions(df):
-    serial_re = re.compile(r'[AB]\d{2}-\d{3}')
-    grouped_re = re.compile(r'([AB]\d{2})-(\d{3})(?:[、,](\d{1,3}))+')
+    serial_re = re.compile(r'[AB]\d{2}-\d{3,}')
+    grouped_re = re.compile(r'([AB]\d{2})-(\d{3,})(?:[、,](\d{1,3}))+')
     case_intro_re = re.compile(r'(次の.*症例|症例について)')
-    df['Case Details'] = None
+    question_row_re = re.compile(r'^[AB]\d{2}-\d{3}')
 
     def extract_serials(text):
         serials = set(serial_re.findall(text))
@@ -102,27 +96,42 @@ def store_case_details_next_to_questions(df):
                 serials.add(f'{prefix}-{int(num):03}')
         return sorted(serials)
 
-    for i, r in df.iterrows():
-        text = r['Question']
-        if re.match(r'^[AB]\d{2}-\d{3}', text):
+    # Single forward pass: every open case collects lines until the next
+    # question row, then is written through a serial -> row index.
+    texts = df['Question'].tolist()
+    rows_by_serial = {}
+    for pos, sn in enumerate(df['Serial Number'].tolist()):
+        if isinstance(sn, str):
+            rows_by_serial.setdefault(sn, []).append(pos)
+    case_details = [None] * len(texts)
+    open_cases = []
+
+    def close_cases():
+        for sns, case_lines in open_cases:
+            combined = '\n'.join(case_lines)
+            for sn in sns:
+                for pos in rows_by_serial.get(sn, []):
+                    case_details[pos] = combined
+        open_cases.clear()
+
+    for text in texts:
+        if question_row_re.match(text):
+            close_cases()
             continue
+        for _, case_lines in open_cases:
+            case_lines.append(text)
         if '症例' not in text or not case_intro_re.search(text):
             continue
         sns = extract_serials(text)
         if sns:
-            case_lines = [text]
-            j = i + 1
-            while j < len(df) and not re.match(r'^[AB]\d{2}-\d{3}', df.iloc[j]['Question']):
-                case_lines.append(df.iloc[j]['Question'])
-                j += 1
-            combined = '\n'.join(case_lines)
-            for sn in sns:
-                df.loc[df['Serial Number']==sn, 'Case Details'] = combined
+            open_cases.append((sns, [text]))
+    close_cases()
+    df['Case Details'] = pd.Series(case_details, index=df.index, dtype=object)
     df = df.dropna(subset=['Serial Number']).reset_index(drop=True)
     return df[['Serial Number','Subject','Case Details','Question']]
 
 def remove_serial_number_from_questions(df):
-    df['Question'] = df['Question'].apply(lambda x: re.sub(r'\b[AB]\d{2}-\d{3}\s+','',x))
+    df['Question'] = df['Question'].apply(lambda x: re.sub(r'\b[AB]\d{2}-\d{3,}\s+','',x))
     return df
 
 def clean_subject_names(df):
@@ -135,17 +144,37 @@ def add_exam_type_column(df):
 
 def extract_exam_session_number(df):
     df['Exam Session'] = df['Serial Number'].str.extract(r'[AB](\d{2})-').astype(float).astype('Int64')
-    return df[['Serial Number','Exam Type','Exam Session','Subject','Case Details','Question']]
+    return df[OUTPUT_COLUMNS]
 
 # ──────────────────────────────────
 # 3. DataFrame -> JS Conversion
 # ──────────────────────────────────
+def js_string_literal(text):
+    """Escape text for use inside a single-quoted JS string literal."""
+    return (text.replace('\\', '\\\\').replace("'", "\\'")
+            .replace('\u2028', '\\u2028').replace('\u2029', '\\u2029'))
+
+def df_to_js_chunk(df):
+    """Compact JSON for the records of df without the surrounding brackets."""
+    return df.to_json(orient='records', force_ascii=False)[1:-1]
+
+def write_js_prologue(f, var_name='data'):
+    # JSON.parse of a string literal is parsed much faster by browsers than
+    # an equivalent object literal.
+    f.write(f"const {var_name} = JSON.parse('[")
+
+def write_js_epilogue(f, var_name='data'):
+    f.write("]');\n")
+    f.write(f"window.{var_name} = {var_name};\n")   # Make accessible from other scripts
+
 def save_df_as_js(df, js_path, var_name='data'):
-    json_str = df.to_json(orient='records', force_ascii=False, indent=2)
-    js  = f"const {var_name} = {json_str};\n"
-    js += f"window.{var_name} = {var_name};\n"   # Make accessible from other scripts
     with open(js_path,'w',encoding='utf-8') as f:
-        f.write(js)
+        write_js_prologue(f, var_name)
+        f.write(js_string_literal(df_to_js_chunk(df)))
+        write_js_epilogue(f, var_name)
+
+def df_rows_for_excel(df):
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
 
 # ──────────────────────────────────
 # 4. Main Processing
@@ -157,36 +186,49 @@ def process_all_files_in_directory(directory_path):
     output_dir = os.path.join(base_dir, 'output', 'convert')
     os.makedirs(output_dir, exist_ok=True)
 
-    all_df = pd.DataFrame()
+    excel_path = os.path.join(output_dir, 'all_output_data.xlsx')
+    js_path = os.path.join(output_dir, 'data.js')
+
+    # (1) Integrated Excel and (2) data.js are written file by file, so only
+    # one exam file's frame is in memory at a time.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
+    ws.append(OUTPUT_COLUMNS)
+    wrote_records = False
 
     print(f"Processing {len(txt_files)} files in {directory_path}...")
 
-    for txt in txt_files:
-        fp = os.path.join(directory_path, txt)
-        # print(f"Processing {txt}...")
-        try:
-            df = (process_questions(fp)
-                .pipe(generate_question_number)
-                .pipe(replace_question_with_serial)
-                .pipe(add_subject_to_questions_and_rearrange_columns)
-                .pipe(store_case_details_next_to_questions)
-                .pipe(remove_serial_number_from_questions)
-                .pipe(clean_subject_names)
-                .pipe(add_exam_type_column)
-                .pipe(extract_exam_session_number))
-            
-            all_df = pd.concat([all_df, df], ignore_index=True)
-        except Exception as e:
-            print(f"Error processing {txt}: {e}")
-
-    # (1) Integrated Excel
-    excel_path = os.path.join(output_dir, 'all_output_data.xlsx')
-    all_df.to_excel(excel_path, index=False)
+    with open(js_path, 'w', encoding='utf-8') as js_file:
+        write_js_prologue(js_file)
+        for txt in txt_files:
+            fp = os.path.join(directory_path, txt)
+            # print(f"Processing {txt}...")
+            try:
+                df = (process_questions(fp)
+                    .pipe(generate_question_number)
+                    .pipe(replace_question_with_serial)
+                    .pipe(add_subject_to_questions_and_rearrange_columns)
+                    .pipe(store_case_details_next_to_questions)
+                    .pipe(remove_serial_number_from_questions)
+                    .pipe(clean_subject_names)
+                    .pipe(add_exam_type_column)
+                    .pipe(extract_exam_session_number))
+            except Exception as e:
+                print(f"Error processing {txt}: {e}")
+                continue
+
+            for row in df_rows_for_excel(df):
+                ws.append(row)
+            chunk = df_to_js_chunk(df)
+            if chunk:
+                if wrote_records:
+                    js_file.write(',')
+                js_file.write(js_string_literal(chunk))
+                wrote_records = True
+        write_js_epilogue(js_file)
+
+    wb.save(excel_path)
     print(f'Excel saved: {excel_path}')
-
-    # (2) data.js
-    js_path = os.path.join(output_dir, 'data.js')
-    save_df_as_js(all_df, js_path)
     print(f'JS saved: {js_path}')
 
 # ──────────────────────────────────
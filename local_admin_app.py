@@ -2,7 +2,8 @@ import argparse
 import json
 import os
 import re
-import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
@@ -10,6 +11,10 @@ from urllib.parse import parse_qs, urlparse, quote
 from urllib.request import Request, urlopen
 from urllib.error import URLError, HTTPError
 
+import ahaki_backup
+import ahaki_db
+import ahaki_text
+
 
 HTML_PAGE = """<!doctype html>
 <html lang="ja">
@@ -622,7 +627,12 @@ HTML_PAGE = """<!doctype html>
         result.textContent = "バックアップ中...";
         try {
           const resp = await fetch("/api/backup", { method: "POST" });
-          const data = await resp.json();
+          let data = await resp.json();
+          result.textContent = data.message || "バックアップ中...";
+          while (data.running) {
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            data = await (await fetch("/api/backup")).json();
+          }
           result.textContent = data.message || "完了しました。";
         } catch (err) {
           result.textContent = "バックアップに失敗しました。";
@@ -1030,6 +1040,12 @@ HTML_PAGE = """<!doctype html>
           "</table>";
       }
 
+      function highlightSnippet(text) {
+        return escapeHtml(text)
+          .replace(/\\u0002/g, "<mark>")
+          .replace(/\\u0003/g, "</mark>");
+      }
+
       function renderPreview(data) {
         if (!data || !data.length) return "<div>該当なし</div>";
         var out = "";
@@ -1048,6 +1064,7 @@ HTML_PAGE = """<!doctype html>
           out += "<div class='preview-card'>" +
             "<div><strong>" + item.serial + "</strong> / " + item.subject + "</div>" +
             "<div>" + escapeHtml(item.stem) + "</div>" +
+            (item.snippet ? "<div class='note'>" + highlightSnippet(item.snippet) + "</div>" : "") +
             "<div>解説:</div>" +
             "<div>" + expHtml + "</div>" +
             "<div>タグ: " + (item.tags.join(", ") || "(なし)") + "</div>" +
@@ -1354,6 +1371,17 @@ def parse_args():
         default="/Users/nishitani/Downloads",
         help="Downloads directory for batch import.",
     )
+    parser.add_argument(
+        "--backup-dir",
+        default=None,
+        help="Backup directory (default: $AHAKI_BACKUP_DIR, else backups/ next to the DB).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Request worker threads (writes still go through one writer thread).",
+    )
     return parser.parse_args()
 
 
@@ -1402,6 +1430,7 @@ def build_explanation_prompt(sample_text, jsonl_text):
         "【指示】\n"
         "以下は【国家試験問題】のデータである。質問は不要で、そのまま解説を作成する。\n"
         "出力はJSONLのみとし、各行のexplanationを埋め、他のキーは変更しない。\n"
+        "case_refがある行は、case_refのserialの行と同じcase_text（症例）の問題である。\n"
         "回答は画面表示ではなく、JSONLファイルとして保存して返す。\n"
         "ファイル名は explanations_batch_filled.jsonl とする。\n"
         "だ・である調で簡潔に、長くなりすぎない説明にする。\n"
@@ -1419,6 +1448,7 @@ def build_tag_prompt(jsonl_text):
         "対象は問題文と選択肢から抽出される医学・制度・概念・疾患・検査・解剖・症候など。\n"
         "1問につき3〜7個、重複や表記ゆれを避け、短い名詞で出力する。\n"
         "出力はJSONLのみで、tags以外のキーは変更しない。\n"
+        "case_refがある行は、case_refのserialの行と同じcase_text（症例）の問題である。\n"
         "回答は画面表示ではなく、JSONLファイルとして保存して返す。\n"
         "ファイル名は tags_batch_filled.jsonl とする。\n\n"
         "【国家試験問題(JSONL)】\n"
@@ -1431,6 +1461,7 @@ def build_subtopic_prompt(jsonl_text):
         "以下のJSONLを読み取り、各行のsubtopicsに該当する小項目を配列で入れてください。\n"
         "候補はcandidate_subtopicsから選び、1問につき1〜3個に絞る。\n"
         "出力はJSONLのみで、subtopics以外のキーは変更しない。\n"
+        "case_refがある行は、case_refのserialの行と同じcase_text（症例）の問題である。\n"
         "回答は画面表示ではなく、JSONLファイルとして保存して返す。\n"
         "ファイル名は subtopics_batch_filled.jsonl とする。\n\n"
         "【国家試験問題(JSONL)】\n"
@@ -1443,6 +1474,7 @@ def build_combined_prompt(sample_text, jsonl_text):
         "【指示】\n"
         "以下は【国家試験問題】のデータである。質問は不要で、そのまま解説・タグ・小項目を作成する。\n"
         "出力はJSONLのみとし、各行のexplanation/tags/subtopicsを埋め、他のキーは変更しない。\n"
+        "case_refがある行は、case_refのserialの行と同じcase_text（症例）の問題である。\n"
         "回答は画面表示ではなく、JSONLファイルとして保存して返す。\n"
         "ファイル名は explanations_tags_subtopics_batch_filled.jsonl とする。\n"
         "解説はだ・である調で簡潔に、長くなりすぎない説明にする。\n"
@@ -1512,25 +1544,18 @@ def select_questions(
 
     if unannotated:
         kinds_set = set(kinds or ["explanation", "tag", "subtopic"])
-        if "explanation" in kinds_set:
-            where.append(
-                "NOT EXISTS (SELECT 1 FROM explanations e WHERE e.question_id = q.id)"
-            )
-        if "tag" in kinds_set:
-            where.append(
-                "NOT EXISTS (SELECT 1 FROM question_tags qt WHERE qt.question_id = q.id)"
-            )
-        if "subtopic" in kinds_set:
-            where.append(
-                "NOT EXISTS (SELECT 1 FROM question_subtopics qs WHERE qs.question_id = q.id)"
+        where.extend(
+            ahaki_db.missing_annotation_clauses(
+                [kind for kind in ("explanation", "tag", "subtopic") if kind in kinds_set]
             )
+        )
     where_sql = " AND ".join(where) if where else "1=1"
     columns = question_columns(conn)
     select_fields = [
         "q.id",
         "q.serial",
         "s.name AS subject",
-        "q.case_text",
+        "q.case_id",
         "q.stem",
         "q.choices_json",
         "q.answer_index",
@@ -1552,18 +1577,24 @@ def select_questions(
     return conn.execute(query, params).fetchall()
 
 
-def build_jsonl(records, subtopic_catalog):
+def build_jsonl(records, subtopic_catalog, cases):
+    """Build the four prompt JSONL payloads for records from select_questions.
+
+    cases is ahaki_db.load_cases() for the records' case ids.  A case text is
+    written on the first row that uses it; later rows point back with case_ref.
+    """
     explanation_rows = []
     tag_rows = []
     subtopic_rows = []
     combined_rows = []
+    carried = {}
 
     for row in records:
         (
             _,
             serial,
             subject,
-            case_text,
+            case_id,
             stem,
             choices_json,
             answer_index,
@@ -1575,12 +1606,13 @@ def build_jsonl(records, subtopic_catalog):
         answer_indices, answer_none_flag = parse_answer_meta(
             answer_text, answer_index, answer_indices_json, answer_none
         )
+        case = ahaki_db.case_fields(serial, case_id, cases, carried)
 
         explanation_rows.append(
             {
                 "serial": serial,
                 "subject": subject,
-                "case_text": case_text,
+                **case,
                 "stem": stem,
                 "choices": choices,
                 "answer_index": answer_index,
@@ -1595,7 +1627,7 @@ def build_jsonl(records, subtopic_catalog):
             {
                 "serial": serial,
                 "subject": subject,
-                "case_text": case_text,
+                **case,
                 "stem": stem,
                 "choices": choices,
                 "answer_index": answer_index,
@@ -1610,7 +1642,7 @@ def build_jsonl(records, subtopic_catalog):
             {
                 "serial": serial,
                 "subject": subject,
-                "case_text": case_text,
+                **case,
                 "stem": stem,
                 "choices": choices,
                 "answer_index": answer_index,
@@ -1626,7 +1658,7 @@ def build_jsonl(records, subtopic_catalog):
             {
                 "serial": serial,
                 "subject": subject,
-                "case_text": case_text,
+                **case,
                 "stem": stem,
                 "choices": choices,
                 "answer_index": answer_index,
@@ -1652,7 +1684,37 @@ def build_jsonl(records, subtopic_catalog):
     )
 
 
+class PooledHTTPServer(HTTPServer):
+    """Serves requests on a fixed set of threads.
+
+    Long-lived workers keep their pooled read connections warm; writes from
+    every worker are funnelled into the server's ahaki_db.WriteQueue.
+    """
+
+    def __init__(self, address, handler, workers):
+        super().__init__(address, handler)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
 class Handler(BaseHTTPRequestHandler):
+    def handle_one_request(self):
+        # Connections are pooled across requests; never carry a transaction over.
+        try:
+            super().handle_one_request()
+        finally:
+            ahaki_db.release_connections()
+
     def _set_cors(self):
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
@@ -1725,7 +1787,7 @@ class Handler(BaseHTTPRequestHandler):
                 "subtopic",
             ]
 
-            conn = sqlite3.connect(self.server.db_path)
+            conn = ahaki_db.get_connection(self.server.db_path, readonly=True)
             records = select_questions(
                 conn,
                 serials,
@@ -1737,14 +1799,14 @@ class Handler(BaseHTTPRequestHandler):
                 subject,
                 kinds,
             )
-            conn.close()
 
             if not records:
                 self._send_json({"count": 0})
                 return
 
+            cases = ahaki_db.load_cases(conn, [row[3] for row in records])
             exp_jsonl, tag_jsonl, sub_jsonl, combined_jsonl = build_jsonl(
-                records, self.server.subtopic_catalog
+                records, self.server.subtopic_catalog, cases
             )
 
             exp_enabled = "explanation" in kinds
@@ -1787,6 +1849,12 @@ class Handler(BaseHTTPRequestHandler):
             }
             self._send_json(payload)
             return
+        if parsed.path == "/api/backup":
+            with BACKUP_LOCK:
+                state = dict(BACKUP_STATE)
+            self._send_json(state)
+            return
+
         if parsed.path == "/api/progress":
             payload = build_progress(self.server.db_path)
             self._send_json(payload)
@@ -1901,8 +1969,8 @@ class Handler(BaseHTTPRequestHandler):
             self._send_json(result)
             return
         if parsed.path == "/api/backup":
-            message = run_backup(self.server.repo_root)
-            self._send_json({"message": message})
+            message = run_backup(self.server.db_path, self.server.backup_dir)
+            self._send_json({"message": message, "running": True})
             return
         parsed = urlparse(self.path)
         if parsed.path == "/api/import/explanations_text":
@@ -2092,9 +2160,17 @@ class Handler(BaseHTTPRequestHandler):
 
 
 def import_explanations(db_path, jsonl_text, mode, version):
-    conn = sqlite3.connect(db_path)
+    inserted, cleared = apply_explanation_import(db_path, jsonl_text, mode, version)
+    clear_supabase_feedback_items(cleared)
+    return inserted
+
+
+@ahaki_db.serialized_write
+def apply_explanation_import(db_path, jsonl_text, mode, version):
+    conn = ahaki_db.get_connection(db_path)
     cursor = conn.cursor()
     inserted = 0
+    cleared = []
     for line in jsonl_text.splitlines():
         line = line.strip()
         if not line:
@@ -2127,7 +2203,7 @@ def import_explanations(db_path, jsonl_text, mode, version):
             """,
             (question_id,),
         ).fetchone()
-        if latest and latest[0].strip() == explanation:
+        if latest and ahaki_text.unpack_text(cursor, latest[0]).strip() == explanation:
             continue
         if mode == "replace":
             cursor.execute("DELETE FROM explanations WHERE question_id = ?", (question_id,))
@@ -2147,19 +2223,26 @@ def import_explanations(db_path, jsonl_text, mode, version):
             (question_id, explanation, next_version, source),
         )
         clear_feedback_flag(conn, serial, "explanation")
-        clear_supabase_feedback(serial, "explanation")
+        cleared.append((serial, "explanation"))
         inserted += 1
     if inserted:
         add_explanation_update(conn, inserted)
-    conn.commit()
-    conn.close()
-    return inserted
+    ahaki_db.commit(conn)
+    return inserted, cleared
 
 
 def import_tags(db_path, jsonl_text, mode):
-    conn = sqlite3.connect(db_path)
+    inserted, cleared = apply_tag_import(db_path, jsonl_text, mode)
+    clear_supabase_feedback_items(cleared)
+    return inserted
+
+
+@ahaki_db.serialized_write
+def apply_tag_import(db_path, jsonl_text, mode):
+    conn = ahaki_db.get_connection(db_path)
     cursor = conn.cursor()
     inserted = 0
+    cleared = []
     for line in jsonl_text.splitlines():
         line = line.strip()
         if not line:
@@ -2209,16 +2292,23 @@ def import_tags(db_path, jsonl_text, mode):
             updated = True
         if updated or mode == "replace":
             clear_feedback_flag(conn, serial, "tag")
-            clear_supabase_feedback(serial, "tag")
-    conn.commit()
-    conn.close()
-    return inserted
+            cleared.append((serial, "tag"))
+    ahaki_db.commit(conn)
+    return inserted, cleared
 
 
 def import_subtopics(db_path, jsonl_text, mode):
-    conn = sqlite3.connect(db_path)
+    inserted, cleared = apply_subtopic_import(db_path, jsonl_text, mode)
+    clear_supabase_feedback_items(cleared)
+    return inserted
+
+
+@ahaki_db.serialized_write
+def apply_subtopic_import(db_path, jsonl_text, mode):
+    conn = ahaki_db.get_connection(db_path)
     cursor = conn.cursor()
     inserted = 0
+    cleared = []
     for line in jsonl_text.splitlines():
         line = line.strip()
         if not line:
@@ -2268,17 +2358,24 @@ def import_subtopics(db_path, jsonl_text, mode):
             updated = True
         if updated or mode == "replace":
             clear_feedback_flag(conn, serial, "subtopic")
-            clear_supabase_feedback(serial, "subtopic")
-    conn.commit()
-    conn.close()
-    return inserted
+            cleared.append((serial, "subtopic"))
+    ahaki_db.commit(conn)
+    return inserted, cleared
 
 
 def import_combined(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub):
-    conn = sqlite3.connect(db_path)
+    counts, cleared = apply_combined_import(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub)
+    clear_supabase_feedback_items(cleared)
+    return counts
+
+
+@ahaki_db.batched_write
+def apply_combined_import(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub):
+    conn = ahaki_db.get_connection(db_path)
     cursor = conn.cursor()
     counts = {"explanations": 0, "tags": 0, "subtopics": 0}
-    for line in jsonl_text.splitlines():
+    cleared = []
+    for line in ahaki_db.locked_batches(db_path, conn, jsonl_text.splitlines()):
         line = line.strip()
         if not line:
             continue
@@ -2304,7 +2401,7 @@ def import_combined(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub):
                 """,
                 (question_id,),
             ).fetchone()
-            is_same = latest and latest[0].strip() == explanation
+            is_same = latest and ahaki_text.unpack_text(cursor, latest[0]).strip() == explanation
             if mode_exp == "skip":
                 exists = cursor.execute(
                     "SELECT 1 FROM explanations WHERE question_id = ? LIMIT 1",
@@ -2327,7 +2424,7 @@ def import_combined(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub):
                     )
                     counts["explanations"] += 1
                     clear_feedback_flag(conn, serial, "explanation")
-                    clear_supabase_feedback(serial, "explanation")
+                    cleared.append((serial, "explanation"))
             else:
                 if not is_same:
                     if mode_exp == "replace":
@@ -2351,7 +2448,7 @@ def import_combined(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub):
                     )
                     counts["explanations"] += 1
                     clear_feedback_flag(conn, serial, "explanation")
-                    clear_supabase_feedback(serial, "explanation")
+                    cleared.append((serial, "explanation"))
 
         tags = record.get("tags", [])
         if tags:
@@ -2382,7 +2479,7 @@ def import_combined(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub):
                         )
                         counts["tags"] += 1
                     clear_feedback_flag(conn, serial, "tag")
-                    clear_supabase_feedback(serial, "tag")
+                    cleared.append((serial, "tag"))
             else:
                 if mode_tag == "replace":
                     cursor.execute(
@@ -2413,7 +2510,7 @@ def import_combined(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub):
                     updated = True
                 if updated or mode_tag == "replace":
                     clear_feedback_flag(conn, serial, "tag")
-                    clear_supabase_feedback(serial, "tag")
+                    cleared.append((serial, "tag"))
 
         subtopics = record.get("subtopics", [])
         if subtopics:
@@ -2444,7 +2541,7 @@ def import_combined(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub):
                         )
                         counts["subtopics"] += 1
                     clear_feedback_flag(conn, serial, "subtopic")
-                    clear_supabase_feedback(serial, "subtopic")
+                    cleared.append((serial, "subtopic"))
             else:
                 if mode_sub == "replace":
                     cursor.execute(
@@ -2475,84 +2572,21 @@ def import_combined(db_path, jsonl_text, mode_exp, version, mode_tag, mode_sub):
                     updated = True
                 if updated or mode_sub == "replace":
                     clear_feedback_flag(conn, serial, "subtopic")
-                    clear_supabase_feedback(serial, "subtopic")
+                    cleared.append((serial, "subtopic"))
 
     if counts["explanations"]:
-        add_explanation_update(conn, counts["explanations"])
-    conn.commit()
-    conn.close()
-    return counts
+        with ahaki_db.write_lock(db_path):
+            add_explanation_update(conn, counts["explanations"])
+            ahaki_db.commit(conn)
+    return counts, cleared
 
 
 def build_progress(db_path):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    total_questions = cursor.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
-    explained = cursor.execute(
-        "SELECT COUNT(DISTINCT question_id) FROM explanations"
-    ).fetchone()[0]
-    tagged = cursor.execute(
-        "SELECT COUNT(DISTINCT question_id) FROM question_tags"
-    ).fetchone()[0]
-    subtopic_assigned = cursor.execute(
-        "SELECT COUNT(DISTINCT question_id) FROM question_subtopics"
-    ).fetchone()[0]
-
-    subjects = cursor.execute("SELECT id, name FROM subjects ORDER BY name").fetchall()
-    subject_rows = []
-    for subject_id, name in subjects:
-        subject_total = cursor.execute(
-            "SELECT COUNT(*) FROM questions WHERE subject_id = ?",
-            (subject_id,),
-        ).fetchone()[0]
-        subject_explained = cursor.execute(
-            """
-            SELECT COUNT(DISTINCT q.id)
-            FROM questions q
-            JOIN explanations e ON e.question_id = q.id
-            WHERE q.subject_id = ?
-            """,
-            (subject_id,),
-        ).fetchone()[0]
-        subject_tagged = cursor.execute(
-            """
-            SELECT COUNT(DISTINCT q.id)
-            FROM questions q
-            JOIN question_tags qt ON qt.question_id = q.id
-            WHERE q.subject_id = ?
-            """,
-            (subject_id,),
-        ).fetchone()[0]
-        subject_subtopics = cursor.execute(
-            """
-            SELECT COUNT(DISTINCT q.id)
-            FROM questions q
-            JOIN question_subtopics qs ON qs.question_id = q.id
-            WHERE q.subject_id = ?
-            """,
-            (subject_id,),
-        ).fetchone()[0]
-        subject_rows.append(
-            {
-                "subject": name,
-                "total_questions": subject_total,
-                "explained": subject_explained,
-                "tagged": subject_tagged,
-                "subtopic_assigned": subject_subtopics,
-            }
-        )
-    conn.close()
-    return {
-        "total_questions": total_questions,
-        "explained": explained,
-        "tagged": tagged,
-        "subtopic_assigned": subtopic_assigned,
-        "by_subject": subject_rows,
-    }
+    return ahaki_db.load_progress(ahaki_db.get_connection(db_path, readonly=True))
 
 
 def build_history(db_path):
-    conn = sqlite3.connect(db_path)
+    conn = ahaki_db.get_connection(db_path, readonly=True)
     cursor = conn.cursor()
     history = []
     expl = cursor.execute(
@@ -2565,7 +2599,14 @@ def build_history(db_path):
         """
     ).fetchall()
     for row in expl:
-        history.append({"type": "explanation", "id": row[0], "serial": row[1], "text": row[2]})
+        history.append(
+            {
+                "type": "explanation",
+                "id": row[0],
+                "serial": row[1],
+                "text": ahaki_text.unpack_text(cursor, row[2]),
+            }
+        )
     tags = cursor.execute(
         """
         SELECT qt.question_id, q.serial, t.label
@@ -2590,34 +2631,116 @@ def build_history(db_path):
     ).fetchall()
     for row in subs:
         history.append({"type": "subtopic", "serial": row[1], "text": row[2]})
-    conn.close()
     return history[:20]
 
 
-def build_preview(db_path, query):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+SEARCH_MARK_START = "\x02"
+SEARCH_MARK_END = "\x03"
+SERIAL_QUERY_RE = re.compile(r"^[AB]\d{2}-\d{3,}$")
 
-    if not query:
-        conn.close()
+
+def search_match_expression(terms):
+    """FTS5 phrases for trigram search; every term must have 3+ chars."""
+    phrases = ['"' + term.replace('"', '""') + '"' for term in terms]
+    return " AND ".join(phrases)
+
+
+def like_snippet(texts, terms, width=24):
+    for text in texts:
+        if not text:
+            continue
+        for term in terms:
+            pos = text.find(term)
+            if pos < 0:
+                continue
+            start = max(0, pos - width)
+            end = min(len(text), pos + len(term) + width)
+            snippet = text[start:end]
+            for item in terms:
+                snippet = snippet.replace(item, SEARCH_MARK_START + item + SEARCH_MARK_END)
+            return ("…" if start else "") + snippet + ("…" if end < len(text) else "")
+    return ""
+
+
+def search_questions(cursor, query, limit=20):
+    """Ranked (id, snippet) pairs from the FTS5 search indexes.
+
+    Whitespace-separated terms are ANDed.  When every term has 3+
+    characters the trigram index answers with its own snippets; otherwise
+    question_search_bigram does the matching and ranking, and the snippet
+    is cut from the stored text.
+    """
+    terms = query.split()
+    if not terms:
         return []
+    if SERIAL_QUERY_RE.match(query.upper()):
+        row = cursor.execute(
+            "SELECT id FROM questions WHERE serial = ?", (query.upper(),)
+        ).fetchone()
+        if row:
+            return [(row[0], "")]
+
+    # Column weights follow SEARCH_COLUMNS: stem, choices, case_text,
+    # explanation, tags, subtopics.
+    if all(len(term) >= 3 for term in terms):
+        rows = cursor.execute(
+            """
+            SELECT rowid,
+                   snippet(question_search, -1, ?, ?, '…', 16)
+            FROM question_search
+            WHERE question_search MATCH ?
+            ORDER BY bm25(question_search, 10.0, 5.0, 3.0, 2.0, 4.0, 4.0)
+            LIMIT ?
+            """,
+            [SEARCH_MARK_START, SEARCH_MARK_END, search_match_expression(terms), limit],
+        ).fetchall()
+        return [(row[0], row[1]) for row in rows]
 
+    match = ahaki_db.bigram_match_expression(terms)
+    if not match:
+        return []
+    columns = ahaki_db.SEARCH_COLUMNS
     rows = cursor.execute(
-        """
-        SELECT q.id, q.serial, s.name, q.stem, q.choices_json, q.answer_index
-        FROM questions q
-        LEFT JOIN subjects s ON s.id = q.subject_id
-        WHERE q.serial = ?
-           OR q.stem LIKE ?
-        ORDER BY q.serial
-        LIMIT 20
+        f"""
+        SELECT b.rowid, {", ".join(f"s.{col}" for col in columns)}
+        FROM question_search_bigram b
+        JOIN question_search s ON s.rowid = b.rowid
+        WHERE question_search_bigram MATCH ?
+        ORDER BY bm25(question_search_bigram, 10.0, 5.0, 3.0, 2.0, 4.0, 4.0)
+        LIMIT ?
         """,
-        (query, f"%{query}%"),
+        [match, limit],
     ).fetchall()
+    return [(row[0], like_snippet(row[1:], terms)) for row in rows]
+
 
+@ahaki_db.serialized_write
+def sync_search(db_path):
+    conn = ahaki_db.get_connection(db_path)
+    ahaki_db.sync_search_index(conn)
+    ahaki_db.commit(conn)
+
+
+def build_preview(db_path, query):
+    if not query:
+        return []
+
+    cursor = ahaki_db.get_connection(db_path, readonly=True).cursor()
+    # Edits queue search rows; index them through the writer first.
+    if cursor.execute("SELECT 1 FROM question_search_pending LIMIT 1").fetchone():
+        sync_search(db_path)
+    hits = search_questions(cursor, query.strip())
     results = []
-    for row in rows:
-        qid, serial, subject, stem, choices_json, answer_index = row
+    for qid, snippet in hits:
+        serial, subject, stem, choices_json, answer_index = cursor.execute(
+            """
+            SELECT q.serial, s.name, q.stem, q.choices_json, q.answer_index
+            FROM questions q
+            LEFT JOIN subjects s ON s.id = q.subject_id
+            WHERE q.id = ?
+            """,
+            (qid,),
+        ).fetchone()
         explanations = cursor.execute(
             """
             SELECT body, version
@@ -2656,28 +2779,29 @@ def build_preview(db_path, query):
                 "stem": stem,
                 "choices": json.loads(choices_json),
                 "answer_index": answer_index,
-                "explanations": [{"body": e[0], "version": e[1]} for e in explanations],
+                "snippet": snippet,
+                "explanations": [
+                    {"body": ahaki_text.unpack_text(cursor, e[0]), "version": e[1]}
+                    for e in explanations
+                ],
                 "tags": [t[0] for t in tags],
                 "subtopics": [s[0] for s in subtopics],
             }
         )
 
-    conn.close()
     return results
 
 
 def build_missing(db_path, params):
-    conn = sqlite3.connect(db_path)
+    conn = ahaki_db.get_connection(db_path, readonly=True)
     cursor = conn.cursor()
-    where_clauses = []
-    if params.get("explanations"):
-        where_clauses.append("NOT EXISTS (SELECT 1 FROM explanations e WHERE e.question_id = q.id)")
-    if params.get("tags"):
-        where_clauses.append("NOT EXISTS (SELECT 1 FROM question_tags qt WHERE qt.question_id = q.id)")
-    if params.get("subtopics"):
-        where_clauses.append("NOT EXISTS (SELECT 1 FROM question_subtopics qs WHERE qs.question_id = q.id)")
+    kinds = [
+        kind
+        for kind, key in (("explanation", "explanations"), ("tag", "tags"), ("subtopic", "subtopics"))
+        if params.get(key)
+    ]
+    where_clauses = ahaki_db.missing_annotation_clauses(kinds)
     if not where_clauses:
-        conn.close()
         return []
     where_sql = " AND ".join(where_clauses)
     rows = cursor.execute(
@@ -2690,7 +2814,6 @@ def build_missing(db_path, params):
         LIMIT 200
         """
     ).fetchall()
-    conn.close()
     return [
         {"serial": row[0], "subject": row[1], "stem": row[2]}
         for row in rows
@@ -2709,9 +2832,8 @@ def build_missing_csv(db_path, params):
 
 
 def load_subjects(db_path):
-    conn = sqlite3.connect(db_path)
+    conn = ahaki_db.get_connection(db_path, readonly=True)
     rows = conn.execute("SELECT name FROM subjects ORDER BY name").fetchall()
-    conn.close()
     return [row[0] for row in rows]
 
 
@@ -2762,55 +2884,9 @@ def import_from_downloads(db_path, downloads_dir, mode_exp, version, mode_tag, m
     return " / ".join(messages)
 
 
-def ensure_feedback_table(db_path):
-    conn = sqlite3.connect(db_path)
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS feedback_reports (
-            serial TEXT PRIMARY KEY,
-            explain INTEGER DEFAULT 0,
-            tag INTEGER DEFAULT 0,
-            subtopic INTEGER DEFAULT 0,
-            reported_at TEXT NOT NULL
-        )
-        """
-    )
-    cols = [row[1] for row in conn.execute("PRAGMA table_info(feedback_reports)").fetchall()]
-    if "explain" not in cols:
-        conn.execute("ALTER TABLE feedback_reports ADD COLUMN explain INTEGER DEFAULT 0")
-    if "tag" not in cols:
-        conn.execute("ALTER TABLE feedback_reports ADD COLUMN tag INTEGER DEFAULT 0")
-    if "subtopic" not in cols:
-        conn.execute("ALTER TABLE feedback_reports ADD COLUMN subtopic INTEGER DEFAULT 0")
-    conn.commit()
-    conn.close()
-
-
-def ensure_update_log_table_db(db_path):
-    conn = sqlite3.connect(db_path)
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS explanation_update_log (
-            date TEXT PRIMARY KEY,
-            count INTEGER NOT NULL DEFAULT 0
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
-
-
 def add_explanation_update(conn, count):
     if count <= 0:
         return
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS explanation_update_log (
-            date TEXT PRIMARY KEY,
-            count INTEGER NOT NULL DEFAULT 0
-        )
-        """
-    )
     today = datetime.now().strftime("%Y-%m-%d")
     conn.execute(
         """
@@ -2822,12 +2898,13 @@ def add_explanation_update(conn, count):
     )
 
 
+@ahaki_db.serialized_write
 def add_report(db_path, serial, kind):
     if not serial:
         return "シリアルが指定されていません。"
     if kind not in {"explanation", "tag", "subtopic"}:
         return "種別が指定されていません。"
-    conn = sqlite3.connect(db_path)
+    conn = ahaki_db.get_connection(db_path)
     row = conn.execute(
         "SELECT explain, tag, subtopic FROM feedback_reports WHERE serial = ?",
         (serial,),
@@ -2851,13 +2928,12 @@ def add_report(db_path, serial, kind):
         """,
         (serial, explain, tag, subtopic),
     )
-    conn.commit()
-    conn.close()
+    ahaki_db.commit(conn)
     return f"報告しました: {serial} ({kind})"
 
 
 def list_reports(db_path):
-    conn = sqlite3.connect(db_path)
+    conn = ahaki_db.get_connection(db_path, readonly=True)
     rows = conn.execute(
         """
         SELECT serial, explain, tag, subtopic, reported_at
@@ -2865,7 +2941,6 @@ def list_reports(db_path):
         ORDER BY reported_at DESC
         """
     ).fetchall()
-    conn.close()
     return {
         "count": len(rows),
         "serials": [row[0] for row in rows],
@@ -2882,10 +2957,10 @@ def list_reports(db_path):
     }
 
 
+@ahaki_db.serialized_write
 def clear_reports(db_path, items):
-    conn = sqlite3.connect(db_path)
+    conn = ahaki_db.get_connection(db_path)
     if not items:
-        conn.close()
         return "消去対象がありません。"
     for item in items:
         serial = item.get("serial")
@@ -2909,8 +2984,7 @@ def clear_reports(db_path, items):
             "DELETE FROM feedback_reports WHERE serial = ? AND explain = 0 AND tag = 0 AND subtopic = 0",
             (serial,),
         )
-    conn.commit()
-    conn.close()
+    ahaki_db.commit(conn)
     return "選択した報告フラグを消去しました。"
 
 
@@ -3205,7 +3279,25 @@ def sync_supabase_overrides(db_path, since):
         return {"message": error, "counts": {}}
     if not rows:
         return {"message": "Supabase差分はありません。", "counts": {}}
-    conn = sqlite3.connect(db_path)
+    counts, synced_serials = apply_supabase_overrides(db_path, rows)
+    synced_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    _, sync_error = mark_supabase_overrides_synced(synced_serials, synced_at)
+    if sync_error:
+        return {
+            "message": f"SQLite同期は完了しましたが、Supabaseの同期フラグ更新に失敗しました: {sync_error}",
+            "counts": counts,
+            "since": since or "",
+        }
+    return {
+        "message": "Supabase差分を同期しました。",
+        "counts": counts,
+        "since": since or "",
+    }
+
+
+@ahaki_db.serialized_write
+def apply_supabase_overrides(db_path, rows):
+    conn = ahaki_db.get_connection(db_path)
     cursor = conn.cursor()
     counts = {
         "explanations": 0,
@@ -3247,22 +3339,11 @@ def sync_supabase_overrides(db_path, since):
         counts["choices"] += 1 if question_updates.get("choices") else 0
         counts["answers"] += 1 if question_updates.get("answers") else 0
         synced_serials.append(serial)
+    if counts["case_text"]:
+        ahaki_db.prune_cases(conn)
     add_explanation_update(conn, counts["explanations"])
-    conn.commit()
-    conn.close()
-    synced_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-    _, sync_error = mark_supabase_overrides_synced(synced_serials, synced_at)
-    if sync_error:
-        return {
-            "message": f"SQLite同期は完了しましたが、Supabaseの同期フラグ更新に失敗しました: {sync_error}",
-            "counts": counts,
-            "since": since or "",
-        }
-    return {
-        "message": "Supabase差分を同期しました。",
-        "counts": counts,
-        "since": since or "",
-    }
+    ahaki_db.commit(conn)
+    return counts, synced_serials
 
 
 def apply_override_explanation(cursor, question_id, body, source):
@@ -3279,6 +3360,7 @@ def apply_override_explanation(cursor, question_id, body, source):
     latest_body, latest_source, latest_version = (
         latest if latest else ("", "", 0)
     )
+    latest_body = ahaki_text.unpack_text(cursor, latest_body)
     if body is None:
         body = latest_body
     if not body:
@@ -3353,9 +3435,13 @@ def apply_override_subtopics(cursor, question_id, subtopics):
 def apply_override_question_fields(cursor, question_id, row):
     updated = {"case_text": False, "stem": False, "choices": False, "answers": False}
     if "case_text" in row and row.get("case_text") is not None:
+        # Cases are shared by their linked questions: an edited text resolves
+        # to its own case row and leaves the other questions untouched.
+        case_text = row.get("case_text") or None
+        case_ids = ahaki_db.resolve_case_ids(cursor.connection, [case_text], {})
         cursor.execute(
-            "UPDATE questions SET case_text = ? WHERE id = ?",
-            (row.get("case_text"), question_id),
+            "UPDATE questions SET case_id = ? WHERE id = ?",
+            (case_ids.get(case_text), question_id),
         )
         updated["case_text"] = True
     if "stem" in row and row.get("stem") is not None:
@@ -3616,9 +3702,18 @@ def apply_edit_requests(db_path, items):
     if not edits:
         return {"message": "対象の提案が見つかりません。"}
 
-    conn = sqlite3.connect(db_path)
+    applied, applied_ids = apply_edit_rows(db_path, edits)
+    update_edit_request_status([{"id": edit_id} for edit_id in applied_ids], "applied")
+    web_message = run_build_web(Path(__file__).resolve().parent)
+    return {"message": f"{applied} 件をSQLiteに反映しました。 / {web_message}"}
+
+
+@ahaki_db.serialized_write
+def apply_edit_rows(db_path, edits):
+    conn = ahaki_db.get_connection(db_path)
     cursor = conn.cursor()
     applied = 0
+    applied_ids = []
     explanation_added = 0
     for edit in edits:
         if edit.get("status") != "open":
@@ -3645,7 +3740,7 @@ def apply_edit_requests(db_path, items):
                 """,
                 (question_id,),
             ).fetchone()
-            if row and row[0].strip() == body:
+            if row and ahaki_text.unpack_text(cursor, row[0]).strip() == body:
                 continue
             row = cursor.execute(
                 "SELECT MAX(version) FROM explanations WHERE question_id = ?",
@@ -3672,7 +3767,7 @@ def apply_edit_requests(db_path, items):
             ).fetchone()
             if not row:
                 continue
-            body = row[0]
+            body = ahaki_text.unpack_text(cursor, row[0])
             row = cursor.execute(
                 "SELECT MAX(version) FROM explanations WHERE question_id = ?",
                 (question_id,),
@@ -3763,14 +3858,12 @@ def apply_edit_requests(db_path, items):
                     (question_id, sub_id),
                 )
             applied += 1
-        update_edit_request_status([{"id": edit.get("id")}], "applied")
+        applied_ids.append(edit.get("id"))
 
     if explanation_added:
         add_explanation_update(conn, explanation_added)
-    conn.commit()
-    conn.close()
-    web_message = run_build_web(Path(__file__).resolve().parent)
-    return {"message": f"{applied} 件をSQLiteに反映しました。 / {web_message}"}
+    ahaki_db.commit(conn)
+    return applied, applied_ids
 
 
 def add_report_supabase(serial, kind, comment=""):
@@ -3805,11 +3898,25 @@ def clear_reports_supabase(items):
     return {"message": "選択した報告フラグを消去しました。"}
 
 
-def clear_supabase_feedback(serial, kind):
-    if kind not in {"explanation", "tag", "subtopic"}:
-        return
-    query = f"?serial=eq.{quote(serial)}&kind=eq.{quote(kind)}"
-    supabase_request("DELETE", "feedback", query)
+def clear_supabase_feedback_items(items, chunk_size=100):
+    """Clear the Supabase reports for (serial, kind) pairs, one request per kind and chunk.
+
+    Called after the write job has committed: the HTTP round-trips must not
+    hold the writer thread or the database lock.
+    """
+    serials_by_kind = {}
+    for serial, kind in items:
+        if kind in {"explanation", "tag", "subtopic"}:
+            serials_by_kind.setdefault(kind, []).append(serial)
+    for kind, serials in serials_by_kind.items():
+        serials = sorted(set(serials))
+        for i in range(0, len(serials), chunk_size):
+            chunk = ",".join(f'"{serial}"' for serial in serials[i : i + chunk_size])
+            query = f"?serial=in.({quote(chunk)})&kind=eq.{quote(kind)}"
+            supabase_request("DELETE", "feedback", query)
+
+
+WEB_BUILD_LOCK = threading.Lock()
 
 
 def run_command(repo_root, args):
@@ -3827,35 +3934,43 @@ def run_command(repo_root, args):
     return f"完了: {' '.join(args)}"
 
 
-def run_backup(repo_root):
-    import subprocess
+BACKUP_STATE = {"running": False, "message": ""}
+BACKUP_LOCK = threading.Lock()
 
-    script_path = Path(repo_root) / "scripts" / "backup_sqlite.sh"
-    if not script_path.exists():
-        return "失敗: scripts/backup_sqlite.sh が見つかりません。"
-    result = subprocess.run(
-        ["bash", str(script_path)],
-        cwd=repo_root,
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        return f"失敗: {result.stderr.strip()}"
-    output = result.stdout.strip()
-    return output or "完了しました。"
+
+def run_backup(db_path, backup_dir):
+    """Start an online backup on a background thread; imports keep running."""
+    with BACKUP_LOCK:
+        if BACKUP_STATE["running"]:
+            return "バックアップ実行中です。"
+        BACKUP_STATE.update(running=True, message="バックアップ中...")
+    threading.Thread(target=backup_worker, args=(db_path, backup_dir), daemon=True).start()
+    return "バックアップを開始しました。"
+
+
+def backup_worker(db_path, backup_dir):
+    try:
+        path, created = ahaki_backup.backup_database(db_path, backup_dir)
+        message = f"バックアップ完了: {path}" if created else f"変更なし（最新: {path}）"
+    except Exception as exc:
+        message = f"失敗: {exc}"
+    with BACKUP_LOCK:
+        BACKUP_STATE.update(running=False, message=message)
 
 
 def run_build_web(repo_root):
-    message = run_command(
-        repo_root,
-        [
-            "scripts/generate_web_json.py",
-            "--out",
-            "output/web/questions.json",
-            "--index-dir",
-            "output/web/index",
-        ],
-    )
+    # Request threads run this after their imports; one rebuild at a time.
+    with WEB_BUILD_LOCK:
+        message = run_command(
+            repo_root,
+            [
+                "scripts/generate_web_json.py",
+                "--out-dir",
+                "output/web",
+                "--index-dir",
+                "output/web/index",
+            ],
+        )
     return message
 
 
@@ -3899,15 +4014,23 @@ def main():
     if prompt_sample_path.exists():
         prompt_sample = prompt_sample_path.read_text(encoding="utf-8")
 
-    server = HTTPServer((args.host, args.port), Handler)
+    server = PooledHTTPServer((args.host, args.port), Handler, args.workers)
     server.db_path = db_path
     server.subtopic_catalog = subtopic_catalog
     server.prompt_sample = prompt_sample
     server.repo_root = Path(__file__).resolve().parent
     server.downloads_dir = args.downloads
-    ensure_feedback_table(db_path)
-    ensure_update_log_table_db(db_path)
+    server.backup_dir = (
+        Path(args.backup_dir) if args.backup_dir else ahaki_backup.default_backup_dir(db_path)
+    )
+    ahaki_db.ensure_schema(db_path)
+    ahaki_db.WriteQueue(db_path).start()
 
+    if not args.backup_dir and not os.environ.get("AHAKI_BACKUP_DIR"):
+        print(
+            f"Warning: backups go to {server.backup_dir}, next to the DB."
+            " Set --backup-dir or AHAKI_BACKUP_DIR for an offsite copy."
+        )
     print(f"Server running: http://{args.host}:{args.port}")
     try:
         server.serve_forever()
@@ -1,8 +1,12 @@
 import argparse
 import json
-import sqlite3
+import sys
 from pathlib import Path
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -21,8 +25,8 @@ def parse_args():
     return parser.parse_args()
 
 
-def apply_map(conn, table, column, mapping):
-    for src, dst in mapping.items():
+def apply_map(db_path, conn, table, column, mapping):
+    for src, dst in ahaki_db.locked_batches(db_path, conn, mapping.items()):
         if src == dst:
             continue
         row = conn.execute(
@@ -72,9 +76,9 @@ def main():
     tag_map = mapping.get("tags", {})
     subtopic_map = mapping.get("subtopics", {})
 
-    conn = sqlite3.connect(db_path)
-    apply_map(conn, "tags", "label", tag_map)
-    apply_map(conn, "subtopics", "name", subtopic_map)
+    conn = ahaki_db.connect(db_path, timeout=ahaki_db.BUSY_TIMEOUTS["batch"])
+    apply_map(db_path, conn, "tags", "label", tag_map)
+    apply_map(db_path, conn, "subtopics", "name", subtopic_map)
     conn.commit()
     conn.close()
     print(f"Normalization applied: {map_path}")
@@ -1,9 +1,13 @@
 import argparse
 import json
 import re
-import sqlite3
+import sys
 from pathlib import Path
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
 FULLWIDTH_TO_ASCII = str.maketrans("０１２３４５６７８９", "0123456789")
 
 
@@ -24,13 +28,6 @@ def parse_answer_text(text):
     return indices, False
 
 
-def ensure_column(conn, name, ddl):
-    cols = [row[1] for row in conn.execute("PRAGMA table_info(questions)").fetchall()]
-    if name in cols:
-        return
-    conn.execute(ddl)
-
-
 def parse_args():
     parser = argparse.ArgumentParser(
         description="Backfill answer_indices_json and answer_none from answer_text."
@@ -46,25 +43,15 @@ def parse_args():
 def main():
     args = parse_args()
     db_path = Path(args.db)
-    conn = sqlite3.connect(db_path)
-
-    ensure_column(
-        conn,
-        "answer_indices_json",
-        "ALTER TABLE questions ADD COLUMN answer_indices_json TEXT",
-    )
-    ensure_column(
-        conn,
-        "answer_none",
-        "ALTER TABLE questions ADD COLUMN answer_none INTEGER DEFAULT 0",
-    )
+    ahaki_db.ensure_schema(db_path)
+    conn = ahaki_db.connect(db_path, timeout=ahaki_db.BUSY_TIMEOUTS["batch"])
 
     rows = conn.execute(
         "SELECT id, answer_text FROM questions"
     ).fetchall()
 
     updated = 0
-    for qid, answer_text in rows:
+    for qid, answer_text in ahaki_db.locked_batches(db_path, conn, rows):
         indices, answer_none = parse_answer_text(answer_text or "")
         conn.execute(
             """
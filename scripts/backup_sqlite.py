@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_backup  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Take a verified, compressed online backup of the SQLite database."
+    )
+    parser.add_argument(
+        "--db",
+        default=str(REPO_ROOT / "output" / "ahaki.sqlite"),
+        help="Path to SQLite database.",
+    )
+    parser.add_argument(
+        "--dest",
+        default=None,
+        help="Backup directory (default: $AHAKI_BACKUP_DIR; one of the two is required).",
+    )
+    parser.add_argument(
+        "--keep",
+        type=int,
+        default=ahaki_backup.BACKUP_KEEP,
+        help="Number of backups to keep (0 = keep all).",
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        default=ahaki_backup.BACKUP_STEP_PAGES,
+        help="Pages copied per backup step (-1 = everything in one step, never restarts).",
+    )
+    parser.add_argument(
+        "--max-restarts",
+        type=int,
+        default=ahaki_backup.BACKUP_MAX_RESTARTS,
+        help="Give up after the copy restarts this many times because of concurrent writes.",
+    )
+    parser.add_argument(
+        "--step-sleep",
+        type=float,
+        default=0.0,
+        help="Seconds to pause between steps to leave I/O to other work.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_path = Path(args.db)
+    if not db_path.exists():
+        print(f"SQLiteが見つかりません: {db_path}", file=sys.stderr)
+        return 1
+    if not args.dest and not os.environ.get("AHAKI_BACKUP_DIR"):
+        # The old script copied to a fixed offsite folder; do not silently
+        # switch to a local one that --keep then rotates.
+        print(
+            "保存先が指定されていません。--dest か環境変数 AHAKI_BACKUP_DIR を指定してください"
+            "（ローカルに保存する場合は --dest output/backups）",
+            file=sys.stderr,
+        )
+        return 2
+    dest = Path(args.dest) if args.dest else ahaki_backup.default_backup_dir(db_path)
+    path, created = ahaki_backup.backup_database(
+        db_path,
+        dest,
+        keep=args.keep,
+        pages=args.pages,
+        step_sleep=args.step_sleep,
+        max_restarts=args.max_restarts,
+    )
+    if created:
+        print(f"バックアップ完了: {path}")
+    else:
+        print(f"変更がないためスキップしました（最新: {path}）")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,19 +1,7 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Kept for existing cron jobs; the backup itself lives in backup_sqlite.py.
+# Set AHAKI_BACKUP_DIR (or pass --dest); without either it exits with status 2.
 PROJECT_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
-DB_PATH="${PROJECT_ROOT}/output/ahaki.sqlite"
-BACKUP_DIR="/Users/nishitani/Library/CloudStorage/GoogleDrive-fedorp4pdk@gmail.com/マイドライブ/99_その他/AhakiStudyViewer/backups"
-
-if [[ ! -f "${DB_PATH}" ]]; then
-  echo "SQLiteが見つかりません: ${DB_PATH}" >&2
-  exit 1
-fi
-
-mkdir -p "${BACKUP_DIR}"
-
-timestamp="$(date "+%Y%m%d_%H%M%S")"
-backup_path="${BACKUP_DIR}/ahaki_${timestamp}.sqlite"
-
-cp "${DB_PATH}" "${backup_path}"
-echo "バックアップ完了: ${backup_path}"
+exec python3 "${PROJECT_ROOT}/scripts/backup_sqlite.py" "$@"
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+import build_ahaki_sqlite  # noqa: E402
+import local_admin_app  # noqa: E402
+
+SCENARIOS = [
+    "parse_question_content",
+    "build_ahaki_sqlite",
+    "generate_web_json",
+    "generate_web_json_incremental",
+    "import_combined_1k",
+    "import_combined_10k",
+    "build_preview",
+    "build_progress",
+]
+PREVIEW_QUERIES = 50
+INCREMENTAL_LINES = 20
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run seeded benchmarks on a synthetic corpus and compare results."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Run the benchmark scenarios.")
+    run.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Synthetic corpus scale (see generate_synthetic_corpus.py).",
+    )
+    run.add_argument("--seed", type=int, default=42, help="Random seed.")
+    run.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs per scenario; the median is compared.",
+    )
+    run.add_argument(
+        "--only",
+        nargs="+",
+        choices=SCENARIOS,
+        help="Run only these scenarios.",
+    )
+    run.add_argument(
+        "--out",
+        default="output/benchmarks/latest.json",
+        help="Output JSON path for results.",
+    )
+    run.add_argument(
+        "--work-dir",
+        default=None,
+        help="Keep generated data here instead of a temporary directory.",
+    )
+
+    compare = sub.add_parser("compare", help="Compare results against a baseline.")
+    compare.add_argument(
+        "--baseline",
+        default="output/benchmarks/baseline.json",
+        help="Baseline results JSON.",
+    )
+    compare.add_argument(
+        "--current",
+        default="output/benchmarks/latest.json",
+        help="Current results JSON.",
+    )
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Relative slowdown of the median that counts as a regression.",
+    )
+    return parser.parse_args()
+
+
+def measure(fn, repeat, setup=None):
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return {
+        "median": statistics.median(runs),
+        "min": min(runs),
+        "runs": runs,
+    }
+
+
+def run_script(*args):
+    subprocess.run(
+        [sys.executable, *args],
+        cwd=REPO_ROOT,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def load_terms():
+    catalog_path = REPO_ROOT / "config" / "subtopics_catalog.json"
+    if not catalog_path.exists():
+        return ["肝臓", "腎臓", "経穴", "脈診"]
+    catalog = json.loads(catalog_path.read_text(encoding="utf-8"))
+    return [str(item) for items in catalog.values() for item in items]
+
+
+def build_import_jsonl(rng, serials, terms, lines):
+    out = []
+    for index in range(lines):
+        serial = serials[index % len(serials)]
+        out.append(
+            json.dumps(
+                {
+                    "serial": serial,
+                    "explanation": "。".join(rng.choice(terms) for _ in range(8)),
+                    "tags": rng.sample(terms, 3),
+                    "subtopics": rng.sample(terms, 1),
+                },
+                ensure_ascii=False,
+            )
+        )
+    return "\n".join(out) + "\n"
+
+
+def prepare_db(src, dst):
+    # Pooled connections would keep reading the replaced file.
+    ahaki_db.close_connections(dst)
+    shutil.copyfile(src, dst)
+    ahaki_db.ensure_schema(dst)
+
+
+def run_benchmarks(args, work_dir):
+    selected = set(args.only or SCENARIOS)
+    rng = random.Random(args.seed)
+    terms = load_terms()
+    corpus_dir = work_dir / "kokushitxt"
+    build_dir = work_dir / "build"
+    base_db = build_dir / "ahaki.sqlite"
+    results = {}
+
+    run_script(
+        "scripts/generate_synthetic_corpus.py",
+        "--out-dir", str(corpus_dir),
+        "--scale", str(args.scale),
+        "--seed", str(args.seed),
+    )
+    run_script(
+        "build_ahaki_sqlite.py",
+        "--full",
+        "--input-dir", str(corpus_dir),
+        "--output-dir", str(build_dir),
+    )
+
+    if "parse_question_content" in selected:
+        texts = []
+        for txt_path in sorted(corpus_dir.glob("*.txt")):
+            for record in build_ahaki_sqlite.parse_exam_file(txt_path):
+                texts.append(build_ahaki_sqlite.LEADING_SERIAL_RE.sub("", record["raw_text"]))
+
+        def parse_all():
+            for text in texts:
+                build_ahaki_sqlite.parse_question_content(text)
+
+        results["parse_question_content"] = measure(parse_all, args.repeat)
+
+    if "build_ahaki_sqlite" in selected:
+        cold_dir = work_dir / "cold_build"
+        results["build_ahaki_sqlite"] = measure(
+            lambda: run_script(
+                "build_ahaki_sqlite.py",
+                "--full",
+                "--input-dir", str(corpus_dir),
+                "--output-dir", str(cold_dir),
+            ),
+            args.repeat,
+            setup=lambda: shutil.rmtree(cold_dir, ignore_errors=True),
+        )
+
+    conn = sqlite3.connect(base_db)
+    serials = [row[0] for row in conn.execute("SELECT serial FROM questions ORDER BY serial")]
+    conn.close()
+    jsonl_by_lines = {
+        lines: build_import_jsonl(rng, serials, terms, lines) for lines in (1000, 10000)
+    }
+
+    import_db = work_dir / "import.sqlite"
+    for lines, name in ((1000, "import_combined_1k"), (10000, "import_combined_10k")):
+        if name not in selected:
+            continue
+        results[name] = measure(
+            lambda text=jsonl_by_lines[lines]: local_admin_app.import_combined(
+                import_db, text, "append", None, "append", "append"
+            ),
+            args.repeat,
+            setup=lambda: prepare_db(base_db, import_db),
+        )
+
+    # Read-side scenarios run against an annotated copy of the corpus.
+    annotated_db = work_dir / "annotated.sqlite"
+    prepare_db(base_db, annotated_db)
+    local_admin_app.import_combined(
+        annotated_db, jsonl_by_lines[10000], "append", None, "append", "append"
+    )
+    conn = sqlite3.connect(annotated_db)
+    ahaki_db.sync_search_index(conn)
+    conn.commit()
+    conn.close()
+
+    if "generate_web_json" in selected:
+        web_dir = work_dir / "web"
+        results["generate_web_json"] = measure(
+            lambda: run_script(
+                "scripts/generate_web_json.py",
+                "--db", str(annotated_db),
+                "--out-dir", str(web_dir),
+                "--index-dir", str(web_dir / "index"),
+                "--full",
+            ),
+            args.repeat,
+        )
+
+    if "generate_web_json_incremental" in selected:
+        # A small import followed by the regeneration the admin server runs.
+        web_db = work_dir / "web.sqlite"
+        web_dir = work_dir / "web_incremental"
+        web_args = [
+            "scripts/generate_web_json.py",
+            "--db", str(web_db),
+            "--out-dir", str(web_dir),
+            "--index-dir", str(web_dir / "index"),
+        ]
+        prepare_db(annotated_db, web_db)
+        run_script(*web_args)
+        results["generate_web_json_incremental"] = measure(
+            lambda: run_script(*web_args),
+            args.repeat,
+            setup=lambda: local_admin_app.import_combined(
+                web_db,
+                build_import_jsonl(rng, serials, terms, INCREMENTAL_LINES),
+                "append", None, "append", "append",
+            ),
+        )
+
+    if "build_preview" in selected:
+        queries = []
+        for _ in range(PREVIEW_QUERIES):
+            queries.append(rng.choice(serials) if rng.random() < 0.3 else rng.choice(terms))
+
+        def preview_all():
+            for query in queries:
+                local_admin_app.build_preview(annotated_db, query)
+
+        results["build_preview"] = measure(preview_all, args.repeat)
+
+    if "build_progress" in selected:
+        results["build_progress"] = measure(
+            lambda: local_admin_app.build_progress(annotated_db), args.repeat
+        )
+
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "scale": args.scale,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "questions": len(serials),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, threshold):
+    regressions = []
+    print(f"{'scenario':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, entry in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:<24} {'-':>10} {entry['median']:>9.3f}s {'new':>8}")
+            continue
+        change = (entry["median"] - base["median"]) / base["median"] if base["median"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:<24} {base['median']:>9.3f}s {entry['median']:>9.3f}s"
+            f" {change:>+7.1%}{flag}"
+        )
+    for key in ("scale", "seed", "questions"):
+        if baseline.get("meta", {}).get(key) != current.get("meta", {}).get(key):
+            print(f"Warning: {key} differs from the baseline; results may not be comparable.")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    if args.command == "compare":
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        current = json.loads(Path(args.current).read_text(encoding="utf-8"))
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions.")
+        return
+
+    # Imports must never touch the real Supabase project.
+    for key in ("SUPABASE_URL", "SUPABASE_SERVICE_KEY", "SUPABASE_SERVICE_ROLE_KEY"):
+        os.environ.pop(key, None)
+
+    if args.work_dir:
+        work_dir = Path(args.work_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        work_dir.mkdir(parents=True)
+        report = run_benchmarks(args, work_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="ahaki-bench-") as tmp:
+            report = run_benchmarks(args, Path(tmp))
+
+    out_path = Path(args.out)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    for name, entry in report["results"].items():
+        print(f"{name:<24} median {entry['median']:.3f}s  min {entry['min']:.3f}s")
+    print(f"Benchmark results saved: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
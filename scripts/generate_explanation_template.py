@@ -1,8 +1,13 @@
 import argparse
 import json
 import sqlite3
+import sys
 from pathlib import Path
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -50,7 +55,7 @@ def fetch_questions(conn, serials, limit):
             SELECT
                 q.serial,
                 s.name AS subject,
-                q.case_text,
+                q.case_id,
                 q.stem,
                 q.choices_json,
                 q.answer_index,
@@ -66,7 +71,7 @@ def fetch_questions(conn, serials, limit):
         SELECT
             q.serial,
             s.name AS subject,
-            q.case_text,
+            q.case_id,
             q.stem,
             q.choices_json,
             q.answer_index,
@@ -89,20 +94,24 @@ def main():
     prompt_template_path = Path(args.prompt_template)
     prompt_out_path = Path(args.prompt_out) if args.prompt_out else None
 
+    ahaki_db.ensure_schema(db_path)
     conn = sqlite3.connect(db_path)
     rows = fetch_questions(conn, args.serials, args.limit)
+    cases = ahaki_db.load_cases(conn, [row[2] for row in rows])
     conn.close()
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # Each case text is written once; later rows point back with case_ref.
+    carried = {}
     with out_path.open("w", encoding="utf-8") as f:
         for row in rows:
-            serial, subject, case_text, stem, choices_json, answer_index, answer_text = row
+            serial, subject, case_id, stem, choices_json, answer_index, answer_text = row
             choices = json.loads(choices_json)
             record = {
                 "serial": serial,
                 "subject": subject,
-                "case_text": case_text,
+                **ahaki_db.case_fields(serial, case_id, cases, carried),
                 "stem": stem,
                 "choices": choices,
                 "answer_index": answer_index,
@@ -122,6 +131,7 @@ def main():
             "【指示】\n"
             "以下は【国家試験問題】のデータである。質問は不要で、そのまま解説を作成する。\n"
             "出力はJSONLのみとし、各行のexplanationを埋め、他のキーは変更しない。\n"
+            "case_refがある行は、case_refのserialの行と同じcase_text（症例）の問題である。\n"
             "回答は画面表示ではなく、JSONLファイルとして保存して返す。\n"
             "ファイル名は explanations_batch_filled.jsonl とする。\n"
             "だ・である調で簡潔に、長くなりすぎない説明にする。\n\n"
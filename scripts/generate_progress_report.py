@@ -1,8 +1,13 @@
 import argparse
 import json
 import sqlite3
+import sys
 from pathlib import Path
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -26,74 +31,9 @@ def main():
     db_path = Path(args.db)
     out_path = Path(args.out)
 
+    ahaki_db.ensure_schema(db_path)
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    total_questions = cursor.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
-
-    explained = cursor.execute(
-        "SELECT COUNT(DISTINCT question_id) FROM explanations"
-    ).fetchone()[0]
-    tagged = cursor.execute(
-        "SELECT COUNT(DISTINCT question_id) FROM question_tags"
-    ).fetchone()[0]
-    subtopic_assigned = cursor.execute(
-        "SELECT COUNT(DISTINCT question_id) FROM question_subtopics"
-    ).fetchone()[0]
-
-    subjects = cursor.execute("SELECT id, name FROM subjects ORDER BY name").fetchall()
-    subject_rows = []
-    for subject_id, name in subjects:
-        subject_total = cursor.execute(
-            "SELECT COUNT(*) FROM questions WHERE subject_id = ?",
-            (subject_id,),
-        ).fetchone()[0]
-        subject_explained = cursor.execute(
-            """
-            SELECT COUNT(DISTINCT q.id)
-            FROM questions q
-            JOIN explanations e ON e.question_id = q.id
-            WHERE q.subject_id = ?
-            """,
-            (subject_id,),
-        ).fetchone()[0]
-        subject_tagged = cursor.execute(
-            """
-            SELECT COUNT(DISTINCT q.id)
-            FROM questions q
-            JOIN question_tags qt ON qt.question_id = q.id
-            WHERE q.subject_id = ?
-            """,
-            (subject_id,),
-        ).fetchone()[0]
-        subject_subtopics = cursor.execute(
-            """
-            SELECT COUNT(DISTINCT q.id)
-            FROM questions q
-            JOIN question_subtopics qs ON qs.question_id = q.id
-            WHERE q.subject_id = ?
-            """,
-            (subject_id,),
-        ).fetchone()[0]
-
-        subject_rows.append(
-            {
-                "subject": name,
-                "total_questions": subject_total,
-                "explained": subject_explained,
-                "tagged": subject_tagged,
-                "subtopic_assigned": subject_subtopics,
-            }
-        )
-
-    report = {
-        "total_questions": total_questions,
-        "explained": explained,
-        "tagged": tagged,
-        "subtopic_assigned": subtopic_assigned,
-        "by_subject": subject_rows,
-    }
-
+    report = ahaki_db.load_progress(conn)
     conn.close()
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
@@ -1,8 +1,13 @@
 import argparse
 import json
 import sqlite3
+import sys
 from pathlib import Path
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -50,7 +55,7 @@ def fetch_questions(conn, serials, limit):
             SELECT
                 q.serial,
                 s.name AS subject,
-                q.case_text,
+                q.case_id,
                 q.stem,
                 q.choices_json
             FROM questions q
@@ -64,7 +69,7 @@ def fetch_questions(conn, serials, limit):
         SELECT
             q.serial,
             s.name AS subject,
-            q.case_text,
+            q.case_id,
             q.stem,
             q.choices_json
         FROM questions q
@@ -87,21 +92,25 @@ def main():
 
     catalog = json.loads(catalog_path.read_text(encoding="utf-8"))
 
+    ahaki_db.ensure_schema(db_path)
     conn = sqlite3.connect(db_path)
     rows = fetch_questions(conn, args.serials, args.limit)
+    cases = ahaki_db.load_cases(conn, [row[2] for row in rows])
     conn.close()
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # Each case text is written once; later rows point back with case_ref.
+    carried = {}
     with out_path.open("w", encoding="utf-8") as f:
         for row in rows:
-            serial, subject, case_text, stem, choices_json = row
+            serial, subject, case_id, stem, choices_json = row
             choices = json.loads(choices_json)
             candidates = catalog.get(subject, [])
             record = {
                 "serial": serial,
                 "subject": subject,
-                "case_text": case_text,
+                **ahaki_db.case_fields(serial, case_id, cases, carried),
                 "stem": stem,
                 "choices": choices,
                 "candidate_subtopics": candidates,
@@ -117,6 +126,7 @@ def main():
             "以下のJSONLを読み取り、各行のsubtopicsに該当する小項目を配列で入れてください。\n"
             "候補はcandidate_subtopicsから選び、1問につき1〜3個に絞る。\n"
             "出力はJSONLのみで、subtopics以外のキーは変更しない。\n"
+            "case_refがある行は、case_refのserialの行と同じcase_text（症例）の問題である。\n"
             "回答は画面表示ではなく、JSONLファイルとして保存して返す。\n"
             "ファイル名は subtopics_batch_filled.jsonl とする。\n\n"
             "【国家試験問題(JSONL)】\n"
@@ -0,0 +1,230 @@
+import argparse
+import json
+import math
+import random
+from pathlib import Path
+
+# Roughly the size of the real kokushitxt corpus; --scale multiplies it.
+BASE_QUESTIONS = 10000
+
+EXAM_HEADERS = {
+    "A": "あん摩マッサージ指圧師試験",
+    "B": "はり師・きゆう師試験",
+}
+
+COMMON_SUBJECTS = [
+    "医療概論",
+    "関係法規",
+    "衛生学／公衆衛生学",
+    "解剖学",
+    "生理学",
+    "病理学概論",
+    "臨床医学総論",
+    "臨床医学各論",
+    "リハビリテーション医学",
+    "東洋医学概論",
+    "経絡経穴概論",
+    "東洋医学臨床論",
+]
+EXAM_SUBJECTS = {
+    "A": COMMON_SUBJECTS + ["あん摩マッサージ指圧理論"],
+    "B": COMMON_SUBJECTS + ["はり理論", "きゅう理論"],
+}
+CASE_SUBJECTS = {"臨床医学各論", "東洋医学臨床論"}
+
+FALLBACK_TERMS = [
+    "肝臓",
+    "腎臓",
+    "心拍出量",
+    "脳血管障害",
+    "関節リウマチ",
+    "腰痛",
+    "経穴",
+    "脈診",
+    "血糖値",
+    "骨格筋",
+    "自律神経",
+    "感染症",
+]
+STEM_TEMPLATES = [
+    "{a}について正しいのはどれか。",
+    "{a}で誤っているのはどれか。",
+    "{a}と{b}の組合せで正しいのはどれか。",
+    "{a}に関する記述で適切なのはどれか。",
+    "{a}の原因として最も考えられるのはどれか。",
+]
+CASE_TEMPLATES = [
+    "{age}歳の{sex}。{a}を主訴とする。",
+    "{b}の既往がある。",
+    "{a}は{b}に伴って増悪する。",
+    "所見として{a}を認める。",
+]
+
+FULLWIDTH = str.maketrans("0123456789", "０１２３４５６７８９")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic UTF-16 exam corpus for scale testing."
+    )
+    parser.add_argument(
+        "--out-dir",
+        default="output/synthetic/kokushitxt",
+        help="Output directory for generated TXT files.",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help=f"Corpus size as a multiple of {BASE_QUESTIONS} questions (up to 100).",
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=30,
+        help="Sessions per exam type (1-99).",
+    )
+    parser.add_argument(
+        "--case-ratio",
+        type=float,
+        default=0.08,
+        help="Share of questions in clinical subjects that belong to case blocks.",
+    )
+    parser.add_argument(
+        "--catalog",
+        default="config/subtopics_catalog.json",
+        help="Subtopic catalog used as extra vocabulary (optional).",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed.",
+    )
+    return parser.parse_args()
+
+
+def load_terms(catalog_path):
+    terms = list(FALLBACK_TERMS)
+    if catalog_path.exists():
+        catalog = json.loads(catalog_path.read_text(encoding="utf-8"))
+        for items in catalog.values():
+            terms.extend(str(item) for item in items)
+    return terms
+
+
+def number_text(rng, value):
+    """Real files mix ASCII and full-width digits."""
+    text = str(value)
+    return text.translate(FULLWIDTH) if rng.random() < 0.7 else text
+
+
+def build_choices(rng, terms):
+    lines = []
+    for index in range(1, 5):
+        line = f"{number_text(rng, index)}．{rng.choice(terms)}"
+        lines.append(line)
+        if rng.random() < 0.03:
+            lines.append(f"　{rng.choice(terms)}を含む")
+    return lines
+
+
+def build_answer(rng):
+    roll = rng.random()
+    if roll < 0.01:
+        return "解答　なし"
+    if roll < 0.02:
+        return "解答　すべて"
+    if roll < 0.06:
+        first, second = sorted(rng.sample(range(1, 5), 2))
+        return f"解答　{number_text(rng, first)}・{number_text(rng, second)}"
+    return f"解答　{number_text(rng, rng.randint(1, 4))}"
+
+
+def build_question(rng, terms, number):
+    stem = rng.choice(STEM_TEMPLATES).format(a=rng.choice(terms), b=rng.choice(terms))
+    return [
+        f"問題{number_text(rng, number)}　{stem}",
+        *build_choices(rng, terms),
+        build_answer(rng),
+    ]
+
+
+def build_case_intro(rng, terms, numbers):
+    refs = [number_text(rng, n) for n in numbers]
+    if len(numbers) == 2 and numbers[1] < 1000 and rng.random() < 0.5:
+        # Grouped form: "問題６、７" becomes "A25-006、７" after serial replacement.
+        intro = f"次の文で示す症例について、問題{refs[0]}、{refs[1]}の問いに答えよ。"
+    else:
+        intro = "次の症例について、{}の問いに答えよ。".format(
+            "、".join(f"問題{ref}" for ref in refs)
+        )
+    lines = [intro]
+    for _ in range(rng.randint(2, 4)):
+        lines.append(
+            "　"
+            + rng.choice(CASE_TEMPLATES).format(
+                age=number_text(rng, rng.randint(18, 85)),
+                sex=rng.choice(["男性", "女性"]),
+                a=rng.choice(terms),
+                b=rng.choice(terms),
+            )
+        )
+    return lines
+
+
+def build_exam_file(rng, terms, exam_type, session, question_count, case_ratio):
+    subjects = EXAM_SUBJECTS[exam_type]
+    lines = [f"第{number_text(rng, session)}回　{EXAM_HEADERS[exam_type]}　問題", ""]
+    per_subject = math.ceil(question_count / len(subjects))
+    number = 1
+    for subject in subjects:
+        if number > question_count:
+            break
+        lines.append(f"《{subject}》")
+        last = min(question_count, number + per_subject - 1)
+        while number <= last:
+            group = 1
+            if subject in CASE_SUBJECTS and number < last and rng.random() < case_ratio:
+                group = min(rng.randint(2, 3), last - number + 1)
+                lines.extend(build_case_intro(rng, terms, list(range(number, number + group))))
+            for _ in range(group):
+                lines.extend(build_question(rng, terms, number))
+                lines.append("")
+                number += 1
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    args = parse_args()
+    if not 0 < args.scale <= 100:
+        raise SystemExit("--scale must be in (0, 100].")
+    if not 1 <= args.sessions <= 99:
+        raise SystemExit("--sessions must be between 1 and 99.")
+
+    rng = random.Random(args.seed)
+    terms = load_terms(Path(args.catalog))
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    total = max(1, round(BASE_QUESTIONS * args.scale))
+    file_count = len(EXAM_HEADERS) * args.sessions
+    per_file = math.ceil(total / file_count)
+
+    written = 0
+    files_written = 0
+    for exam_type in EXAM_HEADERS:
+        for session in range(1, args.sessions + 1):
+            count = min(per_file, total - written)
+            if count <= 0:
+                break
+            text = build_exam_file(rng, terms, exam_type, session, count, args.case_ratio)
+            (out_dir / f"{exam_type}{session:02}.txt").write_text(text, encoding="utf-16")
+            written += count
+            files_written += 1
+
+    print(f"Generated {written} questions in {files_written} files: {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
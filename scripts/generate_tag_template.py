@@ -1,8 +1,13 @@
 import argparse
 import json
 import sqlite3
+import sys
 from pathlib import Path
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -45,7 +50,7 @@ def fetch_questions(conn, serials, limit):
             SELECT
                 q.serial,
                 s.name AS subject,
-                q.case_text,
+                q.case_id,
                 q.stem,
                 q.choices_json
             FROM questions q
@@ -59,7 +64,7 @@ def fetch_questions(conn, serials, limit):
         SELECT
             q.serial,
             s.name AS subject,
-            q.case_text,
+            q.case_id,
             q.stem,
             q.choices_json
         FROM questions q
@@ -79,20 +84,24 @@ def main():
     out_path = Path(args.out)
     prompt_out_path = Path(args.prompt_out) if args.prompt_out else None
 
+    ahaki_db.ensure_schema(db_path)
     conn = sqlite3.connect(db_path)
     rows = fetch_questions(conn, args.serials, args.limit)
+    cases = ahaki_db.load_cases(conn, [row[2] for row in rows])
     conn.close()
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # Each case text is written once; later rows point back with case_ref.
+    carried = {}
     with out_path.open("w", encoding="utf-8") as f:
         for row in rows:
-            serial, subject, case_text, stem, choices_json = row
+            serial, subject, case_id, stem, choices_json = row
             choices = json.loads(choices_json)
             record = {
                 "serial": serial,
                 "subject": subject,
-                "case_text": case_text,
+                **ahaki_db.case_fields(serial, case_id, cases, carried),
                 "stem": stem,
                 "choices": choices,
                 "tags": [],
@@ -108,6 +117,7 @@ def main():
             "対象は問題文と選択肢から抽出される医学・制度・概念・疾患・検査・解剖・症候など。\n"
             "1問につき3〜7個、重複や表記ゆれを避け、短い名詞で出力する。\n"
             "出力はJSONLのみで、tags以外のキーは変更しない。\n"
+            "case_refがある行は、case_refのserialの行と同じcase_text（症例）の問題である。\n"
             "回答は画面表示ではなく、JSONLファイルとして保存して返す。\n"
             "ファイル名は tags_batch_filled.jsonl とする。\n\n"
             "【国家試験問題(JSONL)】\n"
@@ -1,10 +1,36 @@
 import argparse
+import base64
+import gzip
+import hashlib
 import json
+import os
 import re
 import sqlite3
+import sys
 from pathlib import Path
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+import ahaki_text  # noqa: E402
+
+try:
+    import brotli
+except ImportError:  # Production output then has gzip siblings only.
+    brotli = None
+
 FULLWIDTH_TO_ASCII = str.maketrans("０１２３４５６７８９", "0123456789")
+# Bump when the output shape changes so the next run renders every question.
+OUTPUT_FORMAT = 5
+SHARD_DIR_NAME = "questions"
+DETAIL_DIR_NAME = "details"
+DETAIL_FIELDS = ("explanation_latest", "explanation_latest_source", "explanations")
+MANIFEST_NAME = "manifest.json"
+STATE_NAME = ".questions.state"
+ASSETS_NAME = "assets.json"
+COMPRESSED_SUFFIXES = (".gz", ".br")
+# Questions changed after a journal sequence; {column} is the question id column.
+CHANGED_SQL = "{column} IN (SELECT question_id FROM question_changes WHERE seq > ?)"
 
 
 def normalize_digits(value):
@@ -38,21 +64,47 @@ def parse_args():
         default="output/ahaki.sqlite",
         help="Path to SQLite database.",
     )
+    parser.add_argument(
+        "--out-dir",
+        default="output/web",
+        help="Output directory (question shards go to questions/, plus update_log.json).",
+    )
     parser.add_argument(
         "--out",
-        default="output/web/questions.json",
-        help="Output JSON path.",
+        default=None,
+        help="Deprecated: the old questions.json path; its directory is used as --out-dir.",
     )
     parser.add_argument(
         "--index-dir",
         default="output/web/index",
         help="Output directory for index JSON files.",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-render every question instead of only those changed since the last run.",
+    )
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help=(
+            "Write minified JSON with .gz/.br siblings and content-hashed file names "
+            f"(listed in {ASSETS_NAME}) for long-lived caching."
+        ),
+    )
+    args = parser.parse_args()
+    if args.out:
+        if args.out_dir != parser.get_default("out_dir"):
+            parser.error("--out is a deprecated alias of --out-dir; pass only --out-dir")
+        out = Path(args.out)
+        args.out_dir = str(out.parent if out.suffix == ".json" else out)
+        print(f"Warning: --out is deprecated; use --out-dir {args.out_dir}", file=sys.stderr)
+    return args
 
 
-def load_questions(conn):
+def load_questions(conn, where="1", params=()):
     columns = load_question_columns(conn)
+    case_col = "case_id" if "case_id" in columns else "case_text"
     extra_cols = []
     if "answer_text" in columns:
         extra_cols.append("q.answer_text")
@@ -69,16 +121,22 @@ def load_questions(conn):
             q.exam_type,
             q.exam_session,
             s.name AS subject,
-            q.case_text,
+            q.{case_col},
             q.stem,
             q.choices_json,
             q.answer_index
             {extra}
         FROM questions q
         LEFT JOIN subjects s ON q.subject_id = s.id
+        WHERE {where}
         ORDER BY q.serial
         """
-        ).format(extra=(", " + ", ".join(extra_cols)) if extra_cols else "")
+        ).format(
+            case_col=case_col,
+            extra=(", " + ", ".join(extra_cols)) if extra_cols else "",
+            where=where,
+        ),
+        params,
     ).fetchall()
     columns = [
         "id",
@@ -86,7 +144,7 @@ def load_questions(conn):
         "exam_type",
         "exam_session",
         "subject",
-        "case_text",
+        case_col,
         "stem",
         "choices_json",
         "answer_index",
@@ -95,30 +153,51 @@ def load_questions(conn):
     return [dict(zip(columns, row)) for row in rows]
 
 
-def load_explanations(conn):
+def load_cases(conn, questions):
+    """Return {case_id: text} for the cases the questions reference.
+
+    Databases from before the cases table keep case_text on every question;
+    their texts are numbered here so the output has the same shape.
+    """
+    if "case_id" in load_question_columns(conn):
+        used = {q["case_id"] for q in questions if q["case_id"] is not None}
+        rows = conn.execute("SELECT id, body FROM cases ORDER BY id").fetchall()
+        return {case_id: body for case_id, body in rows if case_id in used}
+    ids = {}
+    for q in questions:
+        text = q.pop("case_text")
+        q["case_id"] = ids.setdefault(text, len(ids) + 1) if text else None
+    return {case_id: text for text, case_id in ids.items()}
+
+
+def load_explanations(conn, where="1", params=()):
     rows = conn.execute(
-        """
+        f"""
         SELECT question_id, body, version, source
         FROM explanations
+        WHERE {where}
         ORDER BY id
-        """
+        """,
+        params,
     ).fetchall()
     data = {}
     for question_id, body, version, source in rows:
         data.setdefault(question_id, []).append(
-            {"body": body, "version": version, "source": source}
+            {"body": ahaki_text.unpack_text(conn, body), "version": version, "source": source}
         )
     return data
 
 
-def load_tags(conn):
+def load_tags(conn, where="1", params=()):
     rows = conn.execute(
-        """
+        f"""
         SELECT qt.question_id, t.label
         FROM question_tags qt
         JOIN tags t ON t.id = qt.tag_id
+        WHERE {where}
         ORDER BY t.label
-        """
+        """,
+        params,
     ).fetchall()
     data = {}
     for question_id, label in rows:
@@ -126,14 +205,16 @@ def load_tags(conn):
     return data
 
 
-def load_subtopics(conn):
+def load_subtopics(conn, where="1", params=()):
     rows = conn.execute(
-        """
+        f"""
         SELECT qs.question_id, st.name
         FROM question_subtopics qs
         JOIN subtopics st ON st.id = qs.subtopic_id
+        WHERE {where}
         ORDER BY st.name
-        """
+        """,
+        params,
     ).fetchall()
     data = {}
     for question_id, name in rows:
@@ -240,67 +321,82 @@ def format_date_display(value):
     return value
 
 
-def main():
-    args = parse_args()
-    db_path = Path(args.db)
-    out_path = Path(args.out)
-    index_dir = Path(args.index_dir)
-
-    conn = sqlite3.connect(db_path)
-    questions = load_questions(conn)
-    explanations = load_explanations(conn)
-    tags = load_tags(conn)
-    subtopics = load_subtopics(conn)
-    update_log = load_explanation_update_log(conn)
-    conn.close()
-
-    output = []
+def build_record(q, explanations, tags, subtopics):
+    qid = q["id"]
+    answer_indices, answer_none = resolve_answer_meta(q)
+    exp_list = explanations.get(qid, [])
+    exp_list_sorted = sorted(exp_list, key=lambda x: x.get("version", 0))
+    latest_exp = exp_list_sorted[-1]["body"] if exp_list_sorted else None
+    latest_source = exp_list_sorted[-1].get("source") if exp_list_sorted else None
+    return {
+        "serial": q["serial"],
+        "exam_type": q["exam_type"],
+        "exam_session": q["exam_session"],
+        "subject": q["subject"],
+        "case_id": q["case_id"],
+        "stem": q["stem"],
+        "choices": json.loads(q["choices_json"]),
+        "answer_index": q["answer_index"],
+        "answer_indices": answer_indices,
+        "answer_none": answer_none,
+        "explanation_latest": latest_exp,
+        "explanation_latest_source": latest_source,
+        "explanations": exp_list_sorted,
+        "tags": tags.get(qid, []),
+        "subtopics": subtopics.get(qid, []),
+    }
+
+
+def build_records(conn, questions, where="1", params=()):
+    """Render questions whose children match where ({column} is the question id column)."""
+    explanations = load_explanations(conn, where.format(column="question_id"), params)
+    tags = load_tags(conn, where.format(column="qt.question_id"), params)
+    subtopics = load_subtopics(conn, where.format(column="qs.question_id"), params)
+    return [build_record(q, explanations, tags, subtopics) for q in questions]
+
+
+def frequent_keys(record):
+    """Return the (subject, subtopic) scopes a record is scored in."""
+    subtopics_list = record.get("subtopics") or []
+    if not subtopics_list:
+        return [(record["subject"], None)]
+    return [(record["subject"], subtopic) for subtopic in subtopics_list]
+
+
+def max_exam_session(output):
     max_session = 0
-    for q in questions:
-        qid = q["id"]
-        if q.get("exam_session") and int(q["exam_session"]) > max_session:
-            max_session = int(q["exam_session"])
-        answer_indices, answer_none = resolve_answer_meta(q)
-        exp_list = explanations.get(qid, [])
-        exp_list_sorted = sorted(exp_list, key=lambda x: x.get("version", 0))
-        latest_exp = exp_list_sorted[-1]["body"] if exp_list_sorted else None
-        latest_source = exp_list_sorted[-1].get("source") if exp_list_sorted else None
-        record = {
-            "serial": q["serial"],
-            "exam_type": q["exam_type"],
-            "exam_session": q["exam_session"],
-            "subject": q["subject"],
-            "case_text": q["case_text"],
-            "stem": q["stem"],
-            "choices": json.loads(q["choices_json"]),
-            "answer_index": q["answer_index"],
-            "answer_indices": answer_indices,
-            "answer_none": answer_none,
-            "explanation_latest": latest_exp,
-            "explanation_latest_source": latest_source,
-            "explanations": exp_list_sorted,
-            "tags": tags.get(qid, []),
-            "subtopics": subtopics.get(qid, []),
-        }
-        output.append(record)
-
-    if max_session <= 0:
-        max_session = 1
+    for record in output:
+        if record.get("exam_session") and int(record["exam_session"]) > max_session:
+            max_session = int(record["exam_session"])
+    return max_session if max_session > 0 else 1
+
+
+def apply_frequent_scores(output, scopes=None):
+    """Set the frequent_* fields of the records scored in scopes (default: all).
+
+    A score depends on the tags of every question in the same subject and
+    subtopic, so after a change the caller passes every scope the changed
+    questions were or are in, and every record sharing one is rescored.
+    """
+    max_session = max_exam_session(output)
+    rescored = output
+    needed = None
+    if scopes is not None:
+        rescored = [record for record in output if not scopes.isdisjoint(frequent_keys(record))]
+        # A rescored record is ranked in each of its scopes, touched or not.
+        needed = {key for record in rescored for key in frequent_keys(record)}
 
     tag_scores = {}
     for record in output:
-        subject = record["subject"]
         session = record.get("exam_session") or 0
         try:
             session_value = int(session)
         except (TypeError, ValueError):
             session_value = 0
         weight = 1.0 + (session_value / max_session)
-        subtopics_list = record.get("subtopics") or []
-        if not subtopics_list:
-            subtopics_list = [None]
-        for subtopic in subtopics_list:
-            key = (subject, subtopic)
+        for key in frequent_keys(record):
+            if needed is not None and key not in needed:
+                continue
             tag_scores.setdefault(key, {})
             for tag in record.get("tags") or []:
                 tag_scores[key][tag] = tag_scores[key].get(tag, 0.0) + weight
@@ -313,18 +409,12 @@ def main():
         top_tag_map[key] = ordered[:top_limit]
         max_score_map[key] = sum(score for _, score in ordered[:top_limit])
 
-    for record in output:
+    for record in rescored:
         subject = record["subject"]
-        subtopics_list = record.get("subtopics") or []
-        keys = []
-        if subtopics_list:
-            keys.extend((subject, subtopic) for subtopic in subtopics_list)
-        else:
-            keys.append((subject, None))
         best_score = 0.0
         best_tags = []
         best_scope = ""
-        for key in keys:
+        for key in frequent_keys(record):
             top_tags = top_tag_map.get(key, [])
             if not top_tags:
                 continue
@@ -355,15 +445,10 @@ def main():
         record["frequent_tags"] = best_tags[:2]
         record["frequent_scope"] = best_scope
 
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text(
-        json.dumps(output, ensure_ascii=False, indent=2) + "\n",
-        encoding="utf-8",
-    )
-    print(f"Web JSON saved: {out_path}")
 
+def build_update_entries(update_log, out_dir):
     update_notes = load_update_notes(Path("config/update_notes.json"))
-    existing_notes = load_existing_update_log(out_path.parent / "update_log.json")
+    existing_notes = load_existing_update_log(out_dir / "update_log.json")
     existing_set = {(note["date"], note["text"]) for note in update_notes}
     for note in existing_notes:
         key = (note["date"], note["text"])
@@ -392,41 +477,429 @@ def main():
             }
         )
     update_entries.sort(key=lambda x: normalize_date_key(x["date"]), reverse=True)
-    (out_path.parent / "update_log.json").write_text(
-        json.dumps(update_entries, ensure_ascii=False, indent=2) + "\n",
-        encoding="utf-8",
-    )
-
-    index_dir.mkdir(parents=True, exist_ok=True)
+    return update_entries
+
+
+def pack_ordinals(ordinals):
+    """Pack sorted ordinals as base64 of their gaps in LEB128 varints.
+
+    Gaps between the questions of one key are small, so most take a single
+    byte; web_app decodes them with decodeOrdinals().
+    """
+    packed = bytearray()
+    last = 0
+    for ordinal in ordinals:
+        gap = ordinal - last
+        last = ordinal
+        while gap >= 0x80:
+            packed.append(gap & 0x7F | 0x80)
+            gap >>= 7
+        packed.append(gap)
+    return base64.b64encode(bytes(packed)).decode("ascii")
+
+
+def build_indexes(output):
+    """Return the index files: the serial of each ordinal and the ordinals of each key.
+
+    An ordinal is a question's position in the shards taken in manifest
+    order, so the shards themselves need not change when one shifts.
+    """
+    ordered = [record for records in group_by_subject(output).values() for record in records]
     index_by_subject = {}
     index_by_tag = {}
     index_by_subtopic = {}
 
-    for record in output:
-        serial = record["serial"]
-        subject = record["subject"]
-        index_by_subject.setdefault(subject, []).append(serial)
+    for ordinal, record in enumerate(ordered):
+        index_by_subject.setdefault(record["subject"], []).append(ordinal)
 
         for tag in record["tags"]:
-            index_by_tag.setdefault(tag, []).append(serial)
+            index_by_tag.setdefault(tag, []).append(ordinal)
 
         for subtopic in record["subtopics"]:
-            index_by_subtopic.setdefault(subtopic, []).append(serial)
+            index_by_subtopic.setdefault(subtopic, []).append(ordinal)
+
+    def packed(index):
+        return {
+            "count": len(ordered),
+            "lists": {
+                key: pack_ordinals(sorted(set(ordinals))) for key, ordinals in index.items()
+            },
+        }
+
+    return {
+        "serials.json": [record["serial"] for record in ordered],
+        "index_by_subject.json": packed(index_by_subject),
+        "index_by_tag.json": packed(index_by_tag),
+        "index_by_subtopic.json": packed(index_by_subtopic),
+    }
+
+
+def dump_json(data, production=False):
+    if production:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(data, ensure_ascii=False, indent=2) + "\n"
+
+
+def compress(data, suffix):
+    if suffix == ".gz":
+        # mtime=0 keeps the bytes, and so the published file, stable across runs.
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11)
+
+
+def write_text(path, text, production=False):
+    """Write text unless the file already holds exactly that; return True if written.
 
-    (index_dir / "index_by_subject.json").write_text(
-        json.dumps(index_by_subject, ensure_ascii=False, indent=2) + "\n",
-        encoding="utf-8",
+    Production output also gets precompressed .gz (and .br, with brotli
+    installed) siblings for servers that serve them directly; otherwise
+    siblings left by an earlier production run are removed.
+    """
+    data = text.encode("utf-8")
+    written = not (path.exists() and path.read_bytes() == data)
+    if written:
+        path.write_bytes(data)
+    for suffix in COMPRESSED_SUFFIXES:
+        sibling = path.with_name(path.name + suffix)
+        if not production or (suffix == ".br" and brotli is None):
+            sibling.unlink(missing_ok=True)
+        elif written or not sibling.exists():
+            sibling.write_bytes(compress(data, suffix))
+    return written
+
+
+def write_json(path, data, production=False):
+    return write_text(path, dump_json(data, production), production)
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def asset_name(name, digest, production):
+    """Return the file name name is published under: content-hashed in production."""
+    if not production:
+        return name
+    return f"{name.removesuffix('.json')}.{digest}.json"
+
+
+def remove_stale(directory, pattern, keep):
+    """Delete files matching pattern, and their compressed siblings, not named in keep."""
+    for path in directory.glob(pattern):
+        name = path.name
+        for suffix in COMPRESSED_SUFFIXES:
+            name = name.removesuffix(suffix)
+        if name not in keep:
+            path.unlink()
+
+
+def shard_file_name(subject):
+    # Subject names are Japanese; a digest keeps the URL plain and stable.
+    digest = hashlib.sha256((subject or "").encode("utf-8")).hexdigest()[:8]
+    return f"subject_{digest}.json"
+
+
+def detail_key(serial):
+    """Return the exam part of a serial ("A25" for "A25-012"); details are chunked by it."""
+    return serial.split("-", 1)[0]
+
+
+def split_record(record):
+    """Return (summary, explanations) of a rendered record.
+
+    The summary is what the result list needs; the explanation bodies, of
+    which the latest is the last version, go to the detail chunks.
+    """
+    summary = {key: value for key, value in record.items() if key not in DETAIL_FIELDS}
+    summary["has_explanation"] = bool((record["explanation_latest"] or "").strip())
+    return summary, record["explanations"]
+
+
+def join_record(summary, explanations):
+    """Rebuild a rendered record from its summary and detail entry."""
+    record = {key: value for key, value in summary.items() if key != "has_explanation"}
+    record["explanations"] = explanations
+    record["explanation_latest"] = explanations[-1]["body"] if explanations else None
+    record["explanation_latest_source"] = explanations[-1].get("source") if explanations else None
+    return record
+
+
+def group_by_subject(output):
+    """Return {subject: records} in order of each subject's first serial."""
+    groups = {}
+    for record in output:
+        groups.setdefault(record["subject"], []).append(record)
+    return groups
+
+
+def write_details(detail_dir, stem, records, production):
+    """Write the detail chunks of one shard and return {chunk key: hash}."""
+    chunks = {}
+    for record in records:
+        chunks.setdefault(detail_key(record["serial"]), {})[record["serial"]] = split_record(
+            record
+        )[1]
+    hashes = {}
+    for key, chunk in chunks.items():
+        text = dump_json(chunk, production)
+        hashes[key] = content_hash(text)
+        path = detail_dir / asset_name(f"{stem}_{key}.json", hashes[key], production)
+        write_text(path, text, production)
+    return hashes
+
+
+def write_shards(shard_dir, output, cases, previous, touched, production):
+    """Write one summary shard and its detail chunks per subject.
+
+    Only subjects in touched (None: all) are rendered; the others keep the
+    hashes listed in previous.  Shards and chunks that no longer exist are
+    removed.  Returns (manifest, published file paths).
+    """
+    detail_dir = shard_dir / DETAIL_DIR_NAME
+    detail_dir.mkdir(parents=True, exist_ok=True)
+    entries = []
+    shard_files = set()
+    chunk_files = set()
+    exam_types = set()
+    for subject, records in group_by_subject(output).items():
+        name = shard_file_name(subject)
+        stem = name.removesuffix(".json")
+        old = previous.get(name)
+        if touched is None or subject in touched or old is None:
+            details = write_details(detail_dir, stem, records, production)
+            used = {record["case_id"] for record in records if record["case_id"] is not None}
+            text = dump_json(
+                {
+                    "subject": subject,
+                    "cases": {
+                        str(case_id): body for case_id, body in cases.items() if case_id in used
+                    },
+                    "details": details,
+                    "questions": [split_record(record)[0] for record in records],
+                },
+                production,
+            )
+            digest = content_hash(text)
+            write_text(shard_dir / asset_name(name, digest, production), text, production)
+        else:
+            details = old["details"]
+            digest = old["hash"]
+        shard_files.add(asset_name(name, digest, production))
+        chunk_files.update(
+            asset_name(f"{stem}_{key}.json", chunk_hash, production)
+            for key, chunk_hash in details.items()
+        )
+        subtopics = sorted({subtopic for record in records for subtopic in record["subtopics"]})
+        exam_types.update(record["exam_type"] for record in records if record["exam_type"])
+        entries.append(
+            {
+                "subject": subject,
+                "file": name,
+                "count": len(records),
+                "hash": digest,
+                "subtopics": subtopics,
+            }
+        )
+    remove_stale(shard_dir, "subject_*.json*", shard_files)
+    remove_stale(detail_dir, "subject_*.json*", chunk_files)
+    manifest = {
+        "total": len(output),
+        "max_session": max_exam_session(output),
+        "exam_types": sorted(exam_types),
+        "hashed": production,
+        "shards": entries,
+    }
+    published = [shard_dir / name for name in sorted(shard_files)]
+    published.extend(detail_dir / name for name in sorted(chunk_files))
+    return manifest, published
+
+
+def write_indexes(index_dir, output, production):
+    """Write the index files and return ({name: hash}, published file paths)."""
+    index_dir.mkdir(parents=True, exist_ok=True)
+    hashes = {}
+    published = []
+    for name, index in build_indexes(output).items():
+        text = dump_json(index, production)
+        hashes[name] = content_hash(text)
+        published.append(index_dir / asset_name(name, hashes[name], production))
+        write_text(published[-1], text, production)
+    keep = {path.name for path in published}
+    remove_stale(index_dir, "index_by_*.json*", keep)
+    remove_stale(index_dir, "serials*.json*", keep)
+    return hashes, published
+
+
+def write_assets(out_dir, immutable, revalidate, production):
+    """List the published files for scripts/prepare_pages.sh (production only).
+
+    Content-hashed files never change and can be cached for good; the entry
+    points that name them must be revalidated on every load.
+    """
+    if not production:
+        remove_stale(out_dir, f"{ASSETS_NAME}*", set())
+        return
+
+    def relative(paths):
+        return sorted(Path(os.path.relpath(path, out_dir)).as_posix() for path in paths)
+
+    write_json(
+        out_dir / ASSETS_NAME,
+        {"immutable": relative(immutable), "revalidate": relative(revalidate)},
     )
-    (index_dir / "index_by_tag.json").write_text(
-        json.dumps(index_by_tag, ensure_ascii=False, indent=2) + "\n",
-        encoding="utf-8",
+
+
+def load_state(path):
+    if not path.exists():
+        return None
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def load_previous_output(shard_dir):
+    """Return (records in serial order, {file: shard state}) from the last run, or None."""
+    detail_dir = shard_dir / DETAIL_DIR_NAME
+    try:
+        manifest = json.loads((shard_dir / MANIFEST_NAME).read_text(encoding="utf-8"))
+        hashed = manifest["hashed"]
+        previous = {}
+        output = []
+        for entry in manifest["shards"]:
+            name = entry["file"]
+            path = shard_dir / asset_name(name, entry["hash"], hashed)
+            shard = json.loads(path.read_text(encoding="utf-8"))
+            details = {}
+            for key, digest in shard["details"].items():
+                chunk_name = asset_name(f"{name.removesuffix('.json')}_{key}.json", digest, hashed)
+                details.update(json.loads((detail_dir / chunk_name).read_text(encoding="utf-8")))
+            output.extend(
+                join_record(summary, details[summary["serial"]]) for summary in shard["questions"]
+            )
+            previous[name] = {"hash": entry["hash"], "details": shard["details"]}
+    except (OSError, KeyError, TypeError, json.JSONDecodeError):
+        return None
+    output.sort(key=lambda record: record["serial"])
+    return output, previous
+
+
+def resume_sequence(args, state, expected, position):
+    """Return the journal sequence the existing output is current to, or None.
+
+    None means the output must be rendered in full: it was asked for, there
+    is no journal or earlier output, or the output came from another database
+    (a snapshot rebuild starts a new epoch) or from another generator format.
+    """
+    if args.full or position is None or state is None:
+        return None
+    if any(state.get(key) != value for key, value in expected.items()):
+        return None
+    seq = state.get("seq")
+    if not isinstance(seq, int) or seq > position[1]:
+        return None
+    return seq
+
+
+def merge_changes(conn, output, since):
+    """Re-render the questions changed after journal sequence since into output.
+
+    Returns the merged output and the scopes whose frequent scores must be
+    recomputed (None for all of them).
+    """
+    questions = load_questions(conn, CHANGED_SQL.format(column="q.id"), (since,))
+    records = {record["serial"]: record for record in output}
+    # Deleted questions and the old serial of a renamed one drop out.
+    serials = {row[0] for row in conn.execute("SELECT serial FROM questions")}
+    stale = {q["serial"] for q in questions} | (set(records) - serials)
+    replaced = [records[serial] for serial in stale if serial in records]
+    fresh = build_records(conn, questions, CHANGED_SQL, (since,))
+    for record in fresh:
+        records[record["serial"]] = record
+    merged = [records[serial] for serial in sorted(records) if serial in serials]
+    # Session weights are relative to the newest session.
+    if max_exam_session(merged) != max_exam_session(output):
+        return merged, None
+    return merged, {key for record in replaced + fresh for key in frequent_keys(record)}
+
+
+def main():
+    args = parse_args()
+    db_path = Path(args.db)
+    out_dir = Path(args.out_dir)
+    shard_dir = out_dir / SHARD_DIR_NAME
+    index_dir = Path(args.index_dir)
+
+    conn = sqlite3.connect(db_path)
+    # One read transaction, so the journal position matches the rows read.
+    conn.execute("BEGIN")
+    position = ahaki_db.change_position(conn)
+    expected = {
+        "format": OUTPUT_FORMAT,
+        "db": str(db_path.resolve()),
+        "epoch": position[0] if position else None,
+        "index_dir": str(index_dir.resolve()),
+        "production": args.production,
+    }
+    since = resume_sequence(args, load_state(out_dir / STATE_NAME), expected, position)
+    changed = 0
+    if since is not None:
+        changed = conn.execute(
+            "SELECT COUNT(*) FROM question_changes WHERE seq > ?", (since,)
+        ).fetchone()[0]
+    scopes = None
+    previous = {}
+    if changed:
+        loaded = load_previous_output(shard_dir)
+        if loaded is None:
+            since = None
+        else:
+            output, previous = loaded
+            output, scopes = merge_changes(conn, output, since)
+            cases = load_cases(conn, output)
+    if since is None:
+        questions = load_questions(conn)
+        cases = load_cases(conn, questions)
+        output = build_records(conn, questions)
+    update_log = load_explanation_update_log(conn)
+    conn.close()
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    update_log_path = out_dir / "update_log.json"
+    write_json(update_log_path, build_update_entries(update_log, out_dir), args.production)
+    if since is not None and not changed:
+        print(f"Web JSON up to date: {shard_dir}")
+        return
+
+    apply_frequent_scores(output, scopes)
+    # Scores are per subject, so only shards of rescored subjects change.
+    touched = None if scopes is None else {subject for subject, _ in scopes}
+    manifest, published = write_shards(
+        shard_dir, output, cases, previous, touched, args.production
     )
-    (index_dir / "index_by_subtopic.json").write_text(
-        json.dumps(index_by_subtopic, ensure_ascii=False, indent=2) + "\n",
-        encoding="utf-8",
+    index_hashes, index_files = write_indexes(index_dir, output, args.production)
+    # The manifest names every other file, so it is written last.
+    manifest["indexes"] = index_hashes
+    write_json(shard_dir / MANIFEST_NAME, manifest, args.production)
+    write_assets(
+        out_dir,
+        published + index_files,
+        [shard_dir / MANIFEST_NAME, update_log_path],
+        args.production,
     )
-
+    if since is None:
+        # The single-file questions.json of earlier versions would be published stale.
+        (out_dir / "questions.json").unlink(missing_ok=True)
+        print(f"Web JSON saved: {shard_dir} ({len(manifest['shards'])} shards)")
+    else:
+        print(f"Web JSON saved: {shard_dir} ({changed} changed questions)")
     print(f"Index JSON saved: {index_dir}")
+    if args.production and brotli is None:
+        print("brotli is not installed; wrote .gz siblings only.")
+
+    if position is not None:
+        state = dict(expected, seq=position[1])
+        (out_dir / STATE_NAME).write_text(json.dumps(state) + "\n", encoding="utf-8")
 
 
 if __name__ == "__main__":
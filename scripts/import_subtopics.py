@@ -1,8 +1,12 @@
 import argparse
 import json
-import sqlite3
+import sys
 from pathlib import Path
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -35,12 +39,12 @@ def main():
     db_path = Path(args.db)
     in_path = Path(args.infile)
 
-    conn = sqlite3.connect(db_path)
+    conn = ahaki_db.connect(db_path, timeout=ahaki_db.BUSY_TIMEOUTS["batch"])
     cursor = conn.cursor()
 
     inserted = 0
     with in_path.open("r", encoding="utf-8") as f:
-        for line in f:
+        for line in ahaki_db.locked_batches(db_path, conn, f):
             line = line.strip()
             if not line:
                 continue
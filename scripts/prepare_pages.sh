@@ -22,6 +22,28 @@ if [ -d "${ROOT_DIR}/output/web" ]; then
   cp -R "${ROOT_DIR}/output/web/"* "${DOCS_DIR}/output/web/"
 fi
 
+# Production output (generate_web_json.py --production) lists its files in
+# assets.json: content-hashed ones never change, the entry points do.
+# _headers is read by hosts such as Cloudflare Pages and Netlify.
+ASSETS_JSON="${ROOT_DIR}/output/web/assets.json"
+if [ -f "${ASSETS_JSON}" ]; then
+  python3 - "${ASSETS_JSON}" > "${DOCS_DIR}/_headers" <<'EOF'
+import json
+import sys
+
+with open(sys.argv[1], encoding="utf-8") as f:
+    assets = json.load(f)
+rules = [("public, max-age=31536000, immutable", assets["immutable"]),
+         ("no-cache", assets["revalidate"])]
+for cache_control, paths in rules:
+    for path in paths:
+        print(f"/output/web/{path}")
+        print(f"  Cache-Control: {cache_control}")
+EOF
+else
+  echo "Note: output/web is not a production build; run scripts/generate_web_json.py --production for long-lived caching."
+fi
+
 cat > "${DOCS_DIR}/index.html" <<'EOF'
 <!doctype html>
 <html lang="ja">
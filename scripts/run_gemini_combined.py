@@ -12,6 +12,7 @@ from urllib.error import HTTPError, URLError
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
 import local_admin_app  # noqa: E402
 
 
@@ -47,10 +48,11 @@ def build_prompt(db_path, catalog_path, sample_path, limit, unannotated, order_m
         subject=subject,
         kinds=["explanation", "tag", "subtopic"],
     )
+    cases = ahaki_db.load_cases(conn, [row[3] for row in records])
     conn.close()
     if not records:
         return "", ""
-    _, _, _, combined_jsonl = local_admin_app.build_jsonl(records, subtopic_catalog)
+    _, _, _, combined_jsonl = local_admin_app.build_jsonl(records, subtopic_catalog, cases)
     prompt = local_admin_app.build_combined_prompt(sample_text, combined_jsonl)
     return prompt, combined_jsonl
 
@@ -199,6 +201,7 @@ def main():
             print(f"{name} ({methods})")
         return 0
 
+    ahaki_db.ensure_schema(Path(args.db))
     usage_path = Path("output/gemini_usage.json")
     usage = read_usage(usage_path)
     today = datetime.now().strftime("%Y-%m-%d")
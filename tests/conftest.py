@@ -0,0 +1,72 @@
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
+SCRIPTS = REPO_ROOT / 'scripts'
+
+SUBJECTS = ['解剖学', '生理学', '東洋医学概論']
+
+
+def insert_question(conn, serial, subject_id, stem='正しいのはどれか。'):
+    session = int(serial[1:3])
+    return conn.execute(
+        "INSERT INTO questions (serial, exam_type_code, exam_type, exam_session, subject_id,"
+        " stem, choices_json, raw_text) VALUES (?, ?, 'あはき', ?, ?, ?, ?, ?)",
+        (serial, serial[0], session, subject_id, stem, '["1", "2", "3", "4"]', stem),
+    ).lastrowid
+
+
+@pytest.fixture
+def annotated_db(tmp_path):
+    """A migrated database with three subjects and a few questions in each."""
+    db_path = tmp_path / 'ahaki.sqlite'
+    ahaki_db.ensure_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA foreign_keys = ON')
+    for name in SUBJECTS:
+        conn.execute('INSERT INTO subjects(name) VALUES (?)', (name,))
+    for number in range(1, 10):
+        insert_question(conn, f'A25-{number:03}', (number - 1) % 3 + 1)
+    insert_question(conn, 'B24-001', None)
+    conn.executemany(
+        'INSERT INTO tags(label, type) VALUES (?, ?)', [('腰痛', 'symptom'), ('肝', 'organ')]
+    )
+    conn.executemany('INSERT INTO subtopics(name) VALUES (?)', [('骨格系',), ('循環器',)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def run(script, *args):
+    """Run a repo script with the current interpreter and return its stdout."""
+    return subprocess.run(
+        [sys.executable, str(script), *map(str, args)],
+        check=True,
+        capture_output=True,
+        cwd=REPO_ROOT,
+        text=True,
+    ).stdout
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """A small synthetic exam corpus."""
+    corpus = tmp_path / 'corpus'
+    run(SCRIPTS / 'generate_synthetic_corpus.py', '--out-dir', corpus, '--scale', 0.008,
+        '--sessions', 2, '--seed', 21)
+    return corpus
+
+
+@pytest.fixture
+def built_db(tmp_path, corpus):
+    """ahaki.sqlite built from the corpus fixture by build_ahaki_sqlite.py."""
+    build = tmp_path / 'build'
+    run(REPO_ROOT / 'build_ahaki_sqlite.py', '--input-dir', corpus, '--output-dir', build)
+    return build / 'ahaki.sqlite'
@@ -0,0 +1,133 @@
+import itertools
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+import local_admin_app  # noqa: E402
+
+KINDS = ['explanation', 'tag', 'subtopic']
+# The work-queue filters as they were written before annotation_flags.
+NOT_EXISTS = {
+    'explanation': 'NOT EXISTS (SELECT 1 FROM explanations e WHERE e.question_id = q.id)',
+    'tag': 'NOT EXISTS (SELECT 1 FROM question_tags qt WHERE qt.question_id = q.id)',
+    'subtopic': 'NOT EXISTS (SELECT 1 FROM question_subtopics qs WHERE qs.question_id = q.id)',
+}
+
+
+def flags(conn, serial):
+    return conn.execute(
+        'SELECT annotation_flags FROM questions WHERE serial = ?', (serial,)
+    ).fetchone()[0]
+
+
+def assert_flags_current(conn):
+    expected = conn.execute(
+        'SELECT serial, '
+        + ahaki_db.annotation_flags_sql('questions.id', 'questions.serial')
+        + ' FROM questions ORDER BY serial'
+    ).fetchall()
+    assert conn.execute('SELECT serial, annotation_flags FROM questions ORDER BY serial').fetchall() == expected
+
+
+def question_id(conn, serial):
+    return conn.execute('SELECT id FROM questions WHERE serial = ?', (serial,)).fetchone()[0]
+
+
+def test_flag_bits_follow_annotations(annotated_db):
+    conn = annotated_db
+    q1 = question_id(conn, 'A25-001')
+    assert flags(conn, 'A25-001') == 0
+
+    conn.execute("INSERT INTO explanations(question_id, body, version) VALUES (?, 'a', 1)", (q1,))
+    conn.execute("INSERT INTO explanations(question_id, body, version) VALUES (?, 'b', 2)", (q1,))
+    assert flags(conn, 'A25-001') == ahaki_db.FLAG_EXPLANATION
+    conn.execute('DELETE FROM explanations WHERE question_id = ? AND version = 1', (q1,))
+    assert flags(conn, 'A25-001') == ahaki_db.FLAG_EXPLANATION
+    conn.execute('DELETE FROM explanations WHERE question_id = ?', (q1,))
+    assert flags(conn, 'A25-001') == 0
+
+    conn.execute("INSERT INTO question_tags(question_id, tag_id, source) VALUES (?, 1, 'manual')", (q1,))
+    conn.execute('INSERT INTO question_subtopics(question_id, subtopic_id) VALUES (?, 1)', (q1,))
+    assert flags(conn, 'A25-001') == ahaki_db.FLAG_TAGS | ahaki_db.FLAG_SUBTOPICS
+    conn.execute('DELETE FROM question_tags WHERE question_id = ?', (q1,))
+    assert flags(conn, 'A25-001') == ahaki_db.FLAG_SUBTOPICS
+
+    # A report with every box cleared does not count as reported.
+    conn.execute(
+        "INSERT INTO feedback_reports(serial, explain, tag, subtopic, reported_at)"
+        " VALUES ('A25-001', 0, 1, 0, '2026-01-01')"
+    )
+    assert flags(conn, 'A25-001') == ahaki_db.FLAG_SUBTOPICS | ahaki_db.FLAG_REPORTED
+    conn.execute("UPDATE feedback_reports SET tag = 0 WHERE serial = 'A25-001'")
+    assert flags(conn, 'A25-001') == ahaki_db.FLAG_SUBTOPICS
+    conn.execute("UPDATE feedback_reports SET subtopic = 1 WHERE serial = 'A25-001'")
+    conn.execute("DELETE FROM feedback_reports WHERE serial = 'A25-001'")
+    assert flags(conn, 'A25-001') == ahaki_db.FLAG_SUBTOPICS
+    assert_flags_current(conn)
+
+
+def test_new_question_picks_up_existing_feedback(annotated_db):
+    conn = annotated_db
+    conn.execute(
+        "INSERT INTO feedback_reports(serial, explain, tag, subtopic, reported_at)"
+        " VALUES ('B25-001', 1, 0, 0, '2026-01-01')"
+    )
+    conn.execute(
+        "INSERT INTO questions (serial, exam_type_code, exam_type, exam_session,"
+        " stem, choices_json, raw_text) VALUES ('B25-001', 'B', 'あはき', 25, 's', '[]', 's')"
+    )
+    assert flags(conn, 'B25-001') == ahaki_db.FLAG_REPORTED
+
+
+def annotate(conn):
+    """Give the fixture questions every mix of explanation, tags and subtopics."""
+    ids = [row[0] for row in conn.execute('SELECT id FROM questions ORDER BY serial')]
+    for index, qid in enumerate(ids):
+        if index & 1:
+            conn.execute("INSERT INTO explanations(question_id, body) VALUES (?, 'x')", (qid,))
+        if index & 2:
+            conn.execute("INSERT INTO question_tags(question_id, tag_id, source) VALUES (?, 1, 'manual')", (qid,))
+        if index & 4:
+            conn.execute('INSERT INTO question_subtopics(question_id, subtopic_id) VALUES (?, 2)', (qid,))
+    conn.commit()
+
+
+def legacy_missing(conn, kinds, subject=None, order_mode='serial'):
+    where = [NOT_EXISTS[kind] for kind in kinds]
+    params = []
+    if subject:
+        where.append('s.name = ?')
+        params.append(subject)
+    order = 'q.exam_session DESC, q.serial DESC' if order_mode == 'new' else 'q.serial'
+    return [
+        row[0]
+        for row in conn.execute(
+            'SELECT q.serial FROM questions q LEFT JOIN subjects s ON q.subject_id = s.id'
+            f" WHERE {' AND '.join(where) or '1=1'} ORDER BY {order}",
+            params,
+        )
+    ]
+
+
+def kind_sets():
+    for size in range(1, len(KINDS) + 1):
+        yield from itertools.combinations(KINDS, size)
+
+
+def test_missing_selections_match_not_exists(annotated_db, tmp_path):
+    conn = annotated_db
+    annotate(conn)
+    for kinds in kind_sets():
+        for subject in (None, '解剖学', '生理学'):
+            for order_mode in ('serial', 'new'):
+                rows = local_admin_app.select_questions(
+                    conn, '', 100, True, order_mode, '', '', subject, list(kinds)
+                )
+                assert [row[1] for row in rows] == legacy_missing(
+                    conn, kinds, subject, order_mode
+                ), (kinds, subject, order_mode)
+        params = {f'{kind}s': '1' for kind in kinds}
+        missing = local_admin_app.build_missing(tmp_path / 'ahaki.sqlite', params)
+        assert [row['serial'] for row in missing] == legacy_missing(conn, kinds)
@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_backup  # noqa: E402
+
+
+def make_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, body TEXT)")
+    conn.executemany("INSERT INTO items(body) VALUES (?)", [("x" * 500,)] * 200)
+    conn.commit()
+    conn.close()
+
+
+def test_backup_and_skip_unchanged(tmp_path):
+    db_path = tmp_path / "db.sqlite"
+    make_db(db_path)
+    path, created = ahaki_backup.backup_database(db_path, tmp_path / "backups", pages=4)
+    assert created and path.exists()
+    again, created = ahaki_backup.backup_database(db_path, tmp_path / "backups", pages=4)
+    assert again == path and not created
+
+
+def test_backup_gives_up_under_steady_writes(tmp_path):
+    db_path = tmp_path / "db.sqlite"
+    make_db(db_path)
+    stop = threading.Event()
+
+    def writer():
+        conn = sqlite3.connect(db_path)
+        count = 0
+        while not stop.is_set():
+            count += 1
+            conn.execute("UPDATE items SET body = ? WHERE id = 1", (str(count),))
+            conn.commit()
+        conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        with pytest.raises(TimeoutError, match="restarted more than 2 times"):
+            ahaki_backup.backup_database(
+                db_path, tmp_path / "backups", pages=1, step_sleep=0.01, max_restarts=2
+            )
+    finally:
+        stop.set()
+        thread.join()
+    assert not list((tmp_path / "backups").glob(".*"))
+    # One step holds a single read transaction, so it cannot restart.
+    _, created = ahaki_backup.backup_database(db_path, tmp_path / "backups", pages=-1)
+    assert created
+
+
+def test_cli_needs_a_destination(tmp_path):
+    db_path = tmp_path / "db.sqlite"
+    make_db(db_path)
+    env = {key: value for key, value in os.environ.items() if key != "AHAKI_BACKUP_DIR"}
+    script = REPO_ROOT / "scripts" / "backup_sqlite.py"
+    result = subprocess.run(
+        [sys.executable, script, "--db", db_path], env=env, capture_output=True, text=True
+    )
+    assert result.returncode == 2 and "AHAKI_BACKUP_DIR" in result.stderr
+    assert not (tmp_path / "backups").exists()
+    env["AHAKI_BACKUP_DIR"] = str(tmp_path / "offsite")
+    subprocess.run([sys.executable, script, "--db", db_path], env=env, check=True)
+    assert list((tmp_path / "offsite").glob("ahaki_*.sqlite.gz"))
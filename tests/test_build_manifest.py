@@ -0,0 +1,30 @@
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import build_ahaki_sqlite  # noqa: E402
+
+PREVIOUS = {
+    'A01.txt': {'sha256': 'a', 'serials': ['A01-001', 'A01-002', 'A01-003']},
+    'A02.txt': {'sha256': 'b', 'serials': ['A02-001']},
+    'A03.txt': {'sha256': 'c', 'serials': ['A03-001']},
+}
+
+
+def test_vanished_serials():
+    current = {
+        # A01-003 was dropped from the file; A02.txt was deleted.
+        'A01.txt': {'sha256': 'd', 'serials': ['A01-001', 'A01-002']},
+    }
+    vanished = build_ahaki_sqlite.vanished_serials(
+        PREVIOUS, current, failed=['A03.txt'], retained=['A00-001', 'A01-001']
+    )
+    # A03.txt failed to parse, so its rows stay; a retained serial that is
+    # parsed again is no longer vanished.
+    assert vanished == ['A00-001', 'A01-003', 'A02-001']
+
+
+def test_entries_without_serials():
+    previous = {'A01.txt': {'sha256': 'a'}}
+    assert build_ahaki_sqlite.vanished_serials(previous, {}, failed=[]) == []
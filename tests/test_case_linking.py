@@ -0,0 +1,111 @@
+import re
+import sys
+from pathlib import Path
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import convert_ahaki_to_json  # noqa: E402
+
+
+def legacy_store_case_details(df):
+    """The stage before the single-pass rewrite, kept as the reference."""
+    serial_re = re.compile(r'[AB]\d{2}-\d{3}')
+    grouped_re = re.compile(r'([AB]\d{2})-(\d{3})(?:[、,](\d{1,3}))+')
+    case_intro_re = re.compile(r'(次の.*症例|症例について)')
+    df['Case Details'] = None
+
+    def extract_serials(text):
+        serials = set(serial_re.findall(text))
+        for m in grouped_re.finditer(text):
+            prefix = m.group(1)
+            nums = re.findall(r'\d{1,3}', m.group(0))
+            for num in nums:
+                serials.add(f'{prefix}-{int(num):03}')
+        return sorted(serials)
+
+    for i, r in df.iterrows():
+        text = r['Question']
+        if re.match(r'^[AB]\d{2}-\d{3}', text):
+            continue
+        if '症例' not in text or not case_intro_re.search(text):
+            continue
+        sns = extract_serials(text)
+        if sns:
+            case_lines = [text]
+            j = i + 1
+            while j < len(df) and not re.match(r'^[AB]\d{2}-\d{3}', df.iloc[j]['Question']):
+                case_lines.append(df.iloc[j]['Question'])
+                j += 1
+            combined = '\n'.join(case_lines)
+            for sn in sns:
+                df.loc[df['Serial Number'] == sn, 'Case Details'] = combined
+    df = df.dropna(subset=['Serial Number']).reset_index(drop=True)
+    return df[['Serial Number', 'Subject', 'Case Details', 'Question']]
+
+
+def question(serial, subject='臨床医学各論'):
+    return (serial, subject, f'{serial} 問題 最も考えられるのはどれか。\n1. 肝臓\n解答 1')
+
+
+def text(line):
+    return (None, None, line)
+
+
+FIXTURE = [
+    text('臨床医学各論'),
+    question('A25-001'),
+    # Grouped serial reference: "A25-002、3、4".
+    text('次の文で示す症例について、A25-002、3、4の問いに答えよ。'),
+    text('52歳の男性。主訴は腰痛。'),
+    text('3か月前から症状が続いている。'),
+    question('A25-002'),
+    question('A25-003'),
+    question('A25-004'),
+    # Overlapping intros: both are open until the next question row, and
+    # the later one wins for the serial they share.
+    text('次の症例について、A25-005、6の問いに答えよ。'),
+    text('68歳の女性。主訴は膝痛。'),
+    text('次の症例について、A25-006、7の問いに答えよ。'),
+    text('40歳の男性。主訴は頭痛。'),
+    question('A25-005'),
+    question('A25-006'),
+    question('A25-007'),
+    # A mention of 症例 that is not an intro stays unlinked.
+    text('症例数は年々増加している。A25-008'),
+    question('A25-008'),
+    # Back reference: a later intro names an earlier question and a
+    # question of the other exam with separate serials.
+    text('次の症例について、A25-001 及び B25-001 の問いに答えよ。'),
+    text('30歳の女性。主訴は肩こり。'),
+    question('B25-001', '東洋医学臨床論'),
+    question('B25-002', '東洋医学臨床論'),
+]
+
+
+def fixture_frame():
+    return pd.DataFrame(FIXTURE, columns=['Serial Number', 'Subject', 'Question'])
+
+
+def test_matches_legacy_loop():
+    expected = legacy_store_case_details(fixture_frame())
+    actual = convert_ahaki_to_json.store_case_details_next_to_questions(fixture_frame())
+    assert_frame_equal(actual, expected)
+
+
+def test_case_groups():
+    df = convert_ahaki_to_json.store_case_details_next_to_questions(fixture_frame())
+    cases = dict(zip(df['Serial Number'], df['Case Details']))
+    grouped = {cases['A25-002'], cases['A25-003'], cases['A25-004']}
+    assert len(grouped) == 1
+    assert grouped.pop().endswith('3か月前から症状が続いている。')
+    assert cases['A25-005'].startswith('次の症例について、A25-005、6')
+    assert '40歳の男性' in cases['A25-005']
+    assert cases['A25-006'] == cases['A25-007']
+    assert cases['A25-006'].startswith('次の症例について、A25-006、7')
+    assert cases['A25-008'] is None
+    assert cases['A25-001'] == cases['B25-001']
+    assert cases['A25-001'].endswith('30歳の女性。主訴は肩こり。')
+    assert cases['B25-002'] is None
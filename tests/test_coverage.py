@@ -0,0 +1,109 @@
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
+CHILD_TABLES = [
+    ('explained', 'explanations'),
+    ('tagged', 'question_tags'),
+    ('subtopic_assigned', 'question_subtopics'),
+]
+
+
+def recount(conn):
+    """load_progress() computed from the child tables, without any counters."""
+    exists = {
+        key: f'EXISTS (SELECT 1 FROM {table} c WHERE c.question_id = q.id)'
+        for key, table in CHILD_TABLES
+    }
+    sums = ', '.join(f'coalesce(SUM({expr}), 0)' for expr in exists.values())
+    totals = conn.execute(f'SELECT COUNT(*), {sums} FROM questions q').fetchone()
+    rows = conn.execute(
+        f"""
+        SELECT s.name, COUNT(q.id), {sums}
+        FROM subjects s
+        LEFT JOIN questions q ON q.subject_id = s.id
+        GROUP BY s.id
+        ORDER BY s.name
+        """
+    ).fetchall()
+    keys = ['total_questions'] + [key for key, _ in CHILD_TABLES]
+    progress = dict(zip(keys, totals))
+    progress['by_subject'] = [
+        {'subject': row[0], **dict(zip(keys, row[1:]))} for row in rows
+    ]
+    return progress
+
+
+def assert_consistent(conn):
+    assert ahaki_db.check_coverage(conn) == []
+    assert ahaki_db.load_progress(conn) == recount(conn)
+
+
+def question_id(conn, serial):
+    return conn.execute('SELECT id FROM questions WHERE serial = ?', (serial,)).fetchone()[0]
+
+
+def test_counters_follow_every_change(annotated_db):
+    conn = annotated_db
+    assert_consistent(conn)
+    q1 = question_id(conn, 'A25-001')
+    q2 = question_id(conn, 'A25-002')
+    orphan = question_id(conn, 'B24-001')
+
+    # Two explanation versions: deleting one keeps the question explained.
+    conn.execute("INSERT INTO explanations(question_id, body, version) VALUES (?, 'a', 1)", (q1,))
+    conn.execute("INSERT INTO explanations(question_id, body, version) VALUES (?, 'b', 2)", (q1,))
+    conn.execute("INSERT INTO explanations(question_id, body) VALUES (?, 'c')", (orphan,))
+    assert_consistent(conn)
+    conn.execute('DELETE FROM explanations WHERE question_id = ? AND version = 1', (q1,))
+    assert_consistent(conn)
+    assert ahaki_db.load_progress(conn)['explained'] == 2
+
+    conn.execute("INSERT INTO question_tags(question_id, tag_id, source) VALUES (?, 1, 'manual')", (q1,))
+    conn.execute("INSERT INTO question_tags(question_id, tag_id, source) VALUES (?, 2, 'gemini')", (q1,))
+    conn.execute("INSERT INTO question_tags(question_id, tag_id, source) VALUES (?, 1, 'manual')", (q2,))
+    assert_consistent(conn)
+    conn.execute('DELETE FROM question_tags WHERE question_id = ? AND tag_id = 1', (q1,))
+    conn.execute('DELETE FROM question_tags WHERE question_id = ?', (q2,))
+    assert_consistent(conn)
+
+    conn.execute('INSERT INTO question_subtopics(question_id, subtopic_id) VALUES (?, 1)', (q2,))
+    conn.execute('INSERT INTO question_subtopics(question_id, subtopic_id) VALUES (?, 2)', (q2,))
+    assert_consistent(conn)
+    conn.execute('DELETE FROM question_subtopics WHERE subtopic_id = 1')
+    assert_consistent(conn)
+
+    # Feedback only touches the reported bit, never the counters.
+    conn.execute(
+        "INSERT INTO feedback_reports(serial, explain, tag, subtopic, reported_at)"
+        " VALUES ('A25-001', 1, 0, 0, '2026-01-01')"
+    )
+    assert_consistent(conn)
+    conn.execute("UPDATE feedback_reports SET explain = 0, tag = 1 WHERE serial = 'A25-001'")
+    conn.execute("DELETE FROM feedback_reports WHERE serial = 'A25-001'")
+    assert_consistent(conn)
+
+    # Moving an annotated question carries its counts to the new subject.
+    conn.execute('UPDATE questions SET subject_id = 3 WHERE id = ?', (q1,))
+    assert_consistent(conn)
+    conn.execute('UPDATE questions SET subject_id = NULL WHERE id = ?', (q2,))
+    assert_consistent(conn)
+    conn.execute('UPDATE questions SET subject_id = 1 WHERE id = ?', (orphan,))
+    assert_consistent(conn)
+
+    conn.execute('DELETE FROM question_subtopics WHERE question_id = ?', (q2,))
+    conn.execute('DELETE FROM questions WHERE id = ?', (q2,))
+    assert_consistent(conn)
+
+
+def test_rebuild_matches_triggers(annotated_db):
+    conn = annotated_db
+    q1 = question_id(conn, 'A25-001')
+    conn.execute("INSERT INTO explanations(question_id, body) VALUES (?, 'a')", (q1,))
+    conn.execute('UPDATE subject_coverage SET explained = explained + 5')
+    assert ahaki_db.check_coverage(conn) != []
+    ahaki_db.rebuild_subject_coverage(conn)
+    assert_consistent(conn)
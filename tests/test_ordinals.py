@@ -0,0 +1,112 @@
+import base64
+import json
+import random
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / 'scripts'))
+import generate_web_json  # noqa: E402
+
+# The reference for decodeOrdinals() in web_app/data_loader.js: gaps 0, 5, 128 and 16384 are
+# the varints 00 / 05 / 80 01 / 80 80 01.
+KNOWN_ORDINALS = [0, 5, 133, 16517]
+KNOWN_PACKED = 'AAWAAYCAAQ=='
+
+
+def decode_ordinals(packed):
+    """Python twin of decodeOrdinals() in web_app/data_loader.js."""
+    ordinals = []
+    last = gap = shift = 0
+    for byte in base64.b64decode(packed):
+        gap |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        last += gap
+        ordinals.append(last)
+        gap = shift = 0
+    return ordinals
+
+
+def test_known_vector():
+    assert generate_web_json.pack_ordinals(KNOWN_ORDINALS) == KNOWN_PACKED
+    assert base64.b64decode(KNOWN_PACKED).hex() == '00058001808001'
+    assert decode_ordinals(KNOWN_PACKED) == KNOWN_ORDINALS
+
+
+def test_empty_list():
+    assert generate_web_json.pack_ordinals([]) == ''
+    assert decode_ordinals('') == []
+
+
+def random_cases():
+    rng = random.Random(25)
+    cases = [[0], [127], [128], [0, 127, 255, 383], [2**21 - 1, 2**21, 2**28 + 5]]
+    for _ in range(200):
+        size = rng.randint(1, 60)
+        # Mixed gaps: most one byte, some two or three bytes long.
+        gaps = [rng.choice([rng.randint(1, 127), rng.randint(128, 16383), rng.randint(16384, 10**6)])
+                for _ in range(size)]
+        ordinals = []
+        total = rng.randint(0, 200)
+        for gap in gaps:
+            ordinals.append(total)
+            total += gap
+        cases.append(ordinals)
+    return cases
+
+
+def test_round_trip():
+    for ordinals in random_cases():
+        assert decode_ordinals(generate_web_json.pack_ordinals(ordinals)) == ordinals
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+def test_page_decoder():
+    cases = [KNOWN_ORDINALS, [], *random_cases()]
+    packed = [generate_web_json.pack_ordinals(ordinals) for ordinals in cases]
+    script = (
+        "const { decodeOrdinals } = require(process.argv[1]);"
+        "const packed = JSON.parse(require('fs').readFileSync(0, 'utf8'));"
+        "console.log(JSON.stringify(packed.map(decodeOrdinals)));"
+    )
+    result = subprocess.run(
+        ['node', '-e', script, str(REPO_ROOT / 'web_app' / 'data_loader.js')],
+        input=json.dumps(packed),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert json.loads(result.stdout) == cases
+
+
+def test_build_indexes_lists_decode_to_members():
+    records = [
+        {'serial': f'A25-{n:03}', 'subject': subject, 'tags': tags, 'subtopics': []}
+        for n, (subject, tags) in enumerate(
+            [('解剖学', ['骨'])] * 150 + [('生理学', ['骨', '血液'])] * 3 + [('解剖学', [])] * 2,
+            1,
+        )
+    ]
+    indexes = generate_web_json.build_indexes(records)
+    serials = indexes['serials.json']
+    assert sorted(serials) == sorted(record['serial'] for record in records)
+    keys_of = {
+        'index_by_subject.json': lambda record: [record['subject']],
+        'index_by_tag.json': lambda record: record['tags'],
+    }
+    for name, keys in keys_of.items():
+        index = indexes[name]
+        assert index['count'] == len(records)
+        for key, packed in index['lists'].items():
+            members = [serials[ordinal] for ordinal in decode_ordinals(packed)]
+            assert sorted(members) == sorted(
+                record['serial'] for record in records if key in keys(record)
+            ), (name, key)
+    # Ordinals follow the shards: every 解剖学 question (152) comes first.
+    assert decode_ordinals(indexes['index_by_subject.json']['lists']['生理学']) == [152, 153, 154]
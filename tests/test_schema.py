@@ -0,0 +1,37 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
+
+@pytest.fixture
+def conn(tmp_path):
+    db_path = tmp_path / 'schema.sqlite'
+    ahaki_db.ensure_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+def test_schema_is_current(conn):
+    assert ahaki_db.current_version(conn) == ahaki_db.LATEST_VERSION
+
+
+def test_hot_queries_use_their_indexes(conn):
+    assert ahaki_db.check_query_plans(conn) == []
+
+
+@pytest.mark.parametrize(
+    'label, sql, index_name', ahaki_db.HOT_QUERIES, ids=[q[0] for q in ahaki_db.HOT_QUERIES]
+)
+def test_hot_query_plan(conn, label, sql, index_name):
+    params = [None] * sql.count('?')
+    plan = ' / '.join(
+        row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    )
+    assert index_name in plan, f'{label}: {plan}'
@@ -0,0 +1,63 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+import local_admin_app  # noqa: E402
+
+STEMS = [
+    '肝臓の機能で正しいのはどれか。',
+    '腰痛の原因で誤っているのはどれか。',
+    '肝と腎の関係で正しいのはどれか。',
+    '経穴の取穴部位で正しいのはどれか。',
+]
+
+
+def search_db(tmp_path):
+    db_path = tmp_path / 'search.sqlite'
+    ahaki_db.ensure_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    for number, stem in enumerate(STEMS, 1):
+        conn.execute(
+            "INSERT INTO questions (serial, exam_type_code, exam_type, exam_session,"
+            " stem, choices_json, raw_text) VALUES (?, 'A', 'あはき', 25, ?, ?, ?)",
+            (f'A25-{number:03}', stem, '["肝臓", "腎臓", "MRI検査"]', stem),
+        )
+    ahaki_db.sync_search_index(conn)
+    return conn
+
+
+def ids(conn, query):
+    return [row[0] for row in local_admin_app.search_questions(conn, query)]
+
+
+def test_short_terms_use_bigram_index(tmp_path):
+    conn = search_db(tmp_path)
+    assert sorted(ids(conn, '腰痛')) == [2]
+    assert sorted(ids(conn, '肝')) == [1, 2, 3, 4]
+    assert sorted(ids(conn, '肝と 正しい')) == [3]
+    assert sorted(ids(conn, 'mri')) == [1, 2, 3, 4]
+    # Choices are joined with spaces; bigrams do not cross them.
+    assert ids(conn, '臓腎') == []
+    snippet = local_admin_app.search_questions(conn, '経穴')[0][1]
+    assert '\x02経穴\x03' in snippet
+
+
+def test_bigram_index_follows_sync(tmp_path):
+    conn = search_db(tmp_path)
+    conn.execute("UPDATE questions SET stem = '禁忌で正しいのはどれか。' WHERE id = 2")
+    conn.execute("DELETE FROM questions WHERE id = 4")
+    ahaki_db.sync_search_index(conn)
+    assert ids(conn, '腰痛') == []
+    assert ids(conn, '禁忌') == [2]
+    assert ids(conn, '経穴') == []
+
+
+def test_old_sqlite_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(ahaki_db.sqlite3, 'sqlite_version_info', (3, 31, 1))
+    with pytest.raises(sqlite3.NotSupportedError, match='needs SQLite 3.34.0 or newer'):
+        ahaki_db.ensure_schema(tmp_path / 'old.sqlite')
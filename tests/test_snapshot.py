@@ -0,0 +1,120 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+import ahaki_text  # noqa: E402
+import build_ahaki_sqlite  # noqa: E402
+
+EDITED_STEM = '手で書き換えた問題文'
+
+
+def annotate(db_path):
+    """Teacher work on the live database; returns the serial whose stem was edited."""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT id, serial FROM questions ORDER BY serial').fetchall()
+    (q1, _), (q2, _), (q3, s3), (q4, s4) = rows[:4]
+    for version in (1, 2, 3):
+        conn.execute(
+            "INSERT INTO explanations(question_id, body, version, source) VALUES (?, ?, ?, 'manual')",
+            (q1, f'解説 第{version}版。' * 40, version),
+        )
+    conn.execute("INSERT INTO explanations(question_id, body, source) VALUES (?, '肝の解説', 'llm')", (q2,))
+    tag_id = conn.execute("INSERT INTO tags(label, type) VALUES ('腰痛', 'symptom')").lastrowid
+    conn.execute("INSERT INTO question_tags(question_id, tag_id, source) VALUES (?, ?, 'manual')", (q2, tag_id))
+    subtopic_id = conn.execute("INSERT INTO subtopics(name) VALUES ('骨格系')").lastrowid
+    conn.execute('INSERT INTO question_subtopics(question_id, subtopic_id) VALUES (?, ?)', (q3, subtopic_id))
+    conn.execute(
+        "INSERT INTO feedback_reports(serial, explain, tag, subtopic, reported_at)"
+        " VALUES (?, 1, 0, 1, '2026-10-01T09:00:00')",
+        (s3,),
+    )
+    conn.execute("INSERT INTO explanation_update_log(date, count) VALUES ('2026-10-01', 4)")
+    # The rebuild restores this stem from the TXT files.
+    conn.execute('UPDATE questions SET stem = ? WHERE id = ?', (EDITED_STEM, q4))
+    ahaki_db.commit(conn)
+    conn.close()
+    return s4
+
+
+def annotations(db_path):
+    conn = sqlite3.connect(db_path)
+    result = {
+        'explanations': sorted(
+            (serial, version, ahaki_text.unpack_text(conn, body), source)
+            for serial, version, body, source in conn.execute(
+                'SELECT q.serial, e.version, e.body, e.source'
+                ' FROM explanations e JOIN questions q ON q.id = e.question_id'
+            )
+        ),
+        'tags': conn.execute(
+            'SELECT q.serial, t.label, qt.source FROM question_tags qt'
+            ' JOIN questions q ON q.id = qt.question_id JOIN tags t ON t.id = qt.tag_id'
+            ' ORDER BY 1, 2'
+        ).fetchall(),
+        'subtopics': conn.execute(
+            'SELECT q.serial, st.name FROM question_subtopics qs'
+            ' JOIN questions q ON q.id = qs.question_id JOIN subtopics st ON st.id = qs.subtopic_id'
+            ' ORDER BY 1, 2'
+        ).fetchall(),
+        'feedback': conn.execute('SELECT * FROM feedback_reports ORDER BY serial').fetchall(),
+        'update_log': conn.execute('SELECT * FROM explanation_update_log').fetchall(),
+        'flags': conn.execute(
+            'SELECT serial, annotation_flags FROM questions WHERE annotation_flags != 0 ORDER BY serial'
+        ).fetchall(),
+    }
+    conn.close()
+    return result
+
+
+def stem_of(db_path, serial):
+    conn = sqlite3.connect(db_path)
+    stem = conn.execute('SELECT stem FROM questions WHERE serial = ?', (serial,)).fetchone()[0]
+    conn.close()
+    return stem
+
+
+def test_snapshot_keeps_annotations_and_swaps_in_one_step(built_db, corpus, monkeypatch):
+    conn = sqlite3.connect(built_db)
+    serial = conn.execute('SELECT serial FROM questions ORDER BY serial LIMIT 1 OFFSET 3').fetchone()[0]
+    conn.close()
+    source_stem = stem_of(built_db, serial)
+    assert annotate(built_db) == serial
+    before = annotations(built_db)
+    assert before['explanations'] and before['tags'] and before['subtopics'] and before['feedback']
+
+    # A reader mid-transaction keeps its view through the swap.
+    reader = sqlite3.connect(built_db)
+    reader.execute('BEGIN')
+    assert reader.execute('SELECT stem FROM questions WHERE serial = ?', (serial,)).fetchone()[0] == EDITED_STEM
+
+    seen = {}
+    swap = build_ahaki_sqlite.swap_snapshot
+
+    def watched_swap(conn, snapshot, live_path, monitor, seen_version):
+        # The snapshot is complete here; the live file must still be the old one.
+        seen['before'] = stem_of(live_path, serial)
+        seen['snapshot'] = stem_of(snapshot, serial)
+        swap(conn, snapshot, live_path, monitor, seen_version)
+        seen['after'] = stem_of(live_path, serial)
+
+    monkeypatch.setattr(build_ahaki_sqlite, 'swap_snapshot', watched_swap)
+    monkeypatch.setattr(sys, 'argv', [
+        'build_ahaki_sqlite.py', '--snapshot',
+        '--input-dir', str(corpus), '--output-dir', str(built_db.parent),
+    ])
+    build_ahaki_sqlite.main()
+
+    assert seen == {'before': EDITED_STEM, 'snapshot': source_stem, 'after': source_stem}
+    assert reader.execute('SELECT stem FROM questions WHERE serial = ?', (serial,)).fetchone()[0] == EDITED_STEM
+    reader.commit()
+    assert reader.execute('SELECT stem FROM questions WHERE serial = ?', (serial,)).fetchone()[0] == source_stem
+    reader.close()
+
+    assert annotations(built_db) == before
+    assert not build_ahaki_sqlite.snapshot_path(built_db).exists()
+    conn = sqlite3.connect(built_db)
+    assert ahaki_db.check_coverage(conn) == []
+    conn.close()
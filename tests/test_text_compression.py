@@ -0,0 +1,140 @@
+import random
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_text  # noqa: E402
+from conftest import insert_question  # noqa: E402
+
+PHRASES = [
+    '正しいのはどれか。',
+    '誤っているのはどれか。',
+    '次の文で示す症例について、問いに答えよ。',
+    '腰部の筋緊張を緩和する目的で、',
+    '経穴の取穴部位として適切なものを選ぶ。',
+    '肝臓は門脈から血液を受ける。',
+    '解答の根拠は教科書の記載による。',
+]
+
+
+def sentence(rng, words=12):
+    return ''.join(rng.choice(PHRASES) for _ in range(words)) + f'（{rng.randint(1, 9999)}）'
+
+
+def history_db(conn, questions=60, versions=3):
+    """Questions with raw_text and several explanation versions each."""
+    rng = random.Random(20)
+    originals = {}
+    raw = {}
+    for number in range(1, questions + 1):
+        text = sentence(rng, 20)
+        qid = insert_question(conn, f'B23-{number:03}', 1, stem=text[:30])
+        conn.execute('UPDATE questions SET raw_text = ? WHERE id = ?', (text, qid))
+        raw[qid] = text
+        for version in range(1, versions + 1):
+            body = sentence(rng)
+            explanation_id = conn.execute(
+                'INSERT INTO explanations(question_id, body, version) VALUES (?, ?, ?)',
+                (qid, body, version),
+            ).lastrowid
+            originals[explanation_id] = (qid, version, body)
+    return originals, raw
+
+
+def assert_round_trip(conn, originals, raw):
+    for explanation_id, (_, _, body) in originals.items():
+        stored = conn.execute(
+            'SELECT body FROM explanations WHERE id = ?', (explanation_id,)
+        ).fetchone()[0]
+        assert ahaki_text.unpack_text(conn, stored) == body
+    for qid, text in raw.items():
+        stored = conn.execute('SELECT raw_text FROM questions WHERE id = ?', (qid,)).fetchone()[0]
+        assert ahaki_text.unpack_text(conn, stored) == text
+
+
+def storage_types(conn):
+    """{(question_id, version): typeof(body)} for every explanation."""
+    return {
+        (qid, version): kind
+        for qid, version, kind in conn.execute(
+            'SELECT question_id, version, typeof(body) FROM explanations'
+        )
+    }
+
+
+def test_history_round_trip(annotated_db):
+    conn = annotated_db
+    originals, raw = history_db(conn)
+    assert ahaki_text.compress_cold_text(conn, raw_text=True) > 0
+    conn.commit()
+
+    types = storage_types(conn)
+    latest = {}
+    for (qid, version) in types:
+        latest[qid] = max(version, latest.get(qid, 0))
+    for (qid, version), kind in types.items():
+        assert kind == ('text' if version == latest[qid] else 'blob'), (qid, version)
+    for qid in raw:
+        assert conn.execute(
+            'SELECT typeof(raw_text) FROM questions WHERE id = ?', (qid,)
+        ).fetchone()[0] == 'blob'
+    for value, in conn.execute("SELECT body FROM explanations WHERE typeof(body) = 'blob'"):
+        assert value[: ahaki_text.TEXT_HEADER.size][0] == ahaki_text.TEXT_PACKED
+    # Dictionaries are read back from the database, not the process cache.
+    ahaki_text._dictionaries.clear()
+    assert_round_trip(conn, originals, raw)
+
+
+def test_retrain_keeps_every_row_readable(annotated_db):
+    conn = annotated_db
+    originals, raw = history_db(conn)
+    # A hand-made first dictionary, so the retrained one surely differs.
+    old_key = ahaki_text.store_dictionary(conn, ''.join(PHRASES[:3]).encode('utf-8'))
+    ahaki_text.compress_cold_text(conn, raw_text=True)
+    # New latest versions give the retrained dictionary different samples.
+    for explanation_id, (qid, version, body) in list(originals.items())[:30]:
+        if version == 3:
+            conn.execute(
+                'UPDATE explanations SET body = ? WHERE id = ?', (body + '追記。', explanation_id)
+            )
+            originals[explanation_id] = (qid, version, body + '追記。')
+    ahaki_text.retrain_dictionary(conn)
+    conn.commit()
+    keys = [row[0] for row in conn.execute('SELECT key FROM text_dictionaries')]
+    assert len(keys) == 1 and keys[0] != old_key
+    ahaki_text._dictionaries.clear()
+    assert_round_trip(conn, originals, raw)
+    for table, column in (('questions', 'raw_text'), ('explanations', 'body')):
+        for value, in conn.execute(
+            f"SELECT {column} FROM {table} WHERE typeof({column}) = 'blob'"
+        ):
+            assert ahaki_text.TEXT_HEADER.unpack_from(value)[1] == keys[0]
+
+
+def test_deleting_the_latest_makes_the_previous_plain(annotated_db):
+    conn = annotated_db
+    originals, raw = history_db(conn, questions=40)
+    ahaki_text.compress_cold_text(conn, raw_text=True)
+    qid, _, _ = next(iter(originals.values()))
+    conn.execute('DELETE FROM explanations WHERE question_id = ? AND version = 3', (qid,))
+    ahaki_text.compress_cold_text(conn)
+    assert storage_types(conn)[(qid, 2)] == 'text'
+    originals = {
+        key: value for key, value in originals.items() if not (value[0] == qid and value[1] == 3)
+    }
+    assert_round_trip(conn, originals, raw)
+
+
+def test_plain_values_pass_through(annotated_db):
+    conn = annotated_db
+    for value in ('正しいのはどれか。', '', None, '\x01\x00\x00\x00\x00abc'):
+        assert ahaki_text.unpack_text(conn, value) is value
+    history_db(conn)
+    ahaki_text.compress_cold_text(conn, raw_text=True)
+    pack = ahaki_text.text_packer(conn)
+    # Text that packing would not shrink is stored as it is.
+    assert pack('短') == '短'
+    packed = pack(PHRASES[0] * 10)
+    assert isinstance(packed, bytes)
+    assert ahaki_text.unpack_text(conn, packed) == PHRASES[0] * 10
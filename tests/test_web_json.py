@@ -0,0 +1,81 @@
+import json
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+from conftest import SCRIPTS, run  # noqa: E402
+
+
+def generate(db_path, out_dir, *extra):
+    return run(SCRIPTS / 'generate_web_json.py', '--db', db_path, '--out-dir', out_dir,
+        '--index-dir', out_dir / 'index', *extra)
+
+
+def tree(out_dir):
+    return {
+        path.relative_to(out_dir).as_posix(): path.read_bytes()
+        for path in sorted(out_dir.rglob('*'))
+        if path.is_file() and path.name != '.questions.state'
+    }
+
+
+def import_lines(tmp_path, db_path, name, script, records):
+    infile = tmp_path / f'{name}.jsonl'
+    infile.write_text(
+        ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records),
+        encoding='utf-8',
+    )
+    run(SCRIPTS / script, '--db', db_path, '--infile', infile)
+
+
+@pytest.mark.parametrize('production', [False, True], ids=['dev', 'production'])
+def test_incremental_matches_full(tmp_path, built_db, production):
+    extra = ['--production'] if production else []
+    incremental = tmp_path / 'incremental'
+    generate(built_db, incremental, *extra)
+    assert 'seq' in json.loads((incremental / '.questions.state').read_text())
+
+    conn = sqlite3.connect(built_db)
+    serials = [row[0] for row in conn.execute('SELECT serial FROM questions ORDER BY serial')]
+    subjects = [row[0] for row in conn.execute('SELECT id FROM subjects ORDER BY id')]
+    conn.close()
+    import_lines(tmp_path, built_db, 'explanations', 'import_explanations.py', [
+        {'serial': serial, 'explanation': f'{serial} の解説。正しいのは1である。'}
+        for serial in serials[:5]
+    ])
+    import_lines(tmp_path, built_db, 'tags', 'import_tags.py', [
+        {'serial': serial, 'tags': ['腰痛', '経穴']} for serial in serials[3:8]
+    ])
+
+    conn = sqlite3.connect(built_db)
+    # A deleted question and one moved to another subject.
+    conn.execute('DELETE FROM questions WHERE serial = ?', (serials[-1],))
+    conn.execute(
+        'UPDATE questions SET subject_id = ? WHERE serial = ?', (subjects[-1], serials[10])
+    )
+    ahaki_db.commit(conn)
+    conn.close()
+
+    # 5 explained, 5 tagged with 2 overlapping, 1 deleted, 1 moved.
+    assert '(10 changed questions)' in generate(built_db, incremental, *extra)
+    full = tmp_path / 'full'
+    generate(built_db, full, '--full', *extra)
+    expected = tree(full)
+    assert set(tree(incremental)) == set(expected)
+    assert tree(incremental) == expected
+
+
+def test_out_is_a_deprecated_alias(tmp_path, built_db):
+    result = subprocess.run(
+        [sys.executable, SCRIPTS / 'generate_web_json.py', '--db', built_db,
+         '--out', tmp_path / 'web' / 'questions.json', '--index-dir', tmp_path / 'web' / 'index'],
+        capture_output=True, text=True, check=True,
+    )
+    assert '--out is deprecated' in result.stderr
+    assert (tmp_path / 'web' / 'questions' / 'manifest.json').exists()
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import ahaki_db  # noqa: E402
+
+
+def add_tag(db_path, label, fail=False):
+    conn = ahaki_db.get_connection(db_path)
+    conn.execute("INSERT INTO tags(label) VALUES (?)", (label,))
+    if fail:
+        raise ValueError(label)
+    ahaki_db.commit(conn)
+
+
+def labels(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT label FROM tags ORDER BY label").fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+@pytest.fixture
+def writer(tmp_path):
+    db_path = tmp_path / 'queue.sqlite'
+    ahaki_db.ensure_schema(db_path)
+    queue = ahaki_db.WriteQueue(db_path).start()
+    yield queue
+    ahaki_db._writers.pop(os.path.abspath(db_path), None)
+
+
+def test_failing_job_rolls_back_only_itself(writer):
+    db_path = writer.db_path
+    started = threading.Event()
+    release = threading.Event()
+
+    def hold(db_path):
+        started.set()
+        release.wait(5)
+
+    results = {}
+
+    def submit(label, fail=False):
+        try:
+            ahaki_db.run_write(db_path, add_tag, db_path, label, fail)
+            results[label] = 'ok'
+        except ValueError:
+            results[label] = 'failed'
+
+    # Keep the writer busy so the next jobs are queued and run as one batch.
+    blocker = threading.Thread(target=ahaki_db.run_write, args=(db_path, hold, db_path))
+    blocker.start()
+    assert started.wait(5)
+    threads = [
+        threading.Thread(target=submit, args=(label, label == '肝'))
+        for label in ['腰痛', '肝', '頭痛', '腎']
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while writer.jobs.qsize() < len(threads) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer.jobs.qsize() == len(threads)
+    release.set()
+    for thread in [blocker, *threads]:
+        thread.join(5)
+
+    assert results == {'腰痛': 'ok', '肝': 'failed', '頭痛': 'ok', '腎': 'ok'}
+    assert labels(db_path) == sorted(['腰痛', '頭痛', '腎'])
+
+
+def test_locked_batches_commit_per_batch(tmp_path):
+    db_path = tmp_path / 'batches.sqlite'
+    ahaki_db.ensure_schema(db_path)
+    conn = ahaki_db.connect(db_path)
+    seen = []
+    for number in ahaki_db.locked_batches(db_path, conn, range(5), size=2):
+        if number % 2 == 0:
+            # A new batch starts only after the previous one committed.
+            seen.append(len(labels(db_path)))
+        conn.execute("INSERT INTO tags(label) VALUES (?)", (f'tag{number}',))
+    assert seen == [0, 2, 4]
+    assert not conn.in_transaction
+
+    rows = ahaki_db.locked_batches(db_path, conn, range(5), size=2)
+    for number in rows:
+        conn.execute("INSERT INTO tags(label) VALUES (?)", (f'more{number}',))
+        if number == 2:
+            break
+    rows.close()
+    assert not conn.in_transaction
+    # The batch that was cut short is rolled back; the first one stays.
+    assert labels(db_path) == sorted([f'tag{n}' for n in range(5)] + ['more0', 'more1'])
+    conn.close()
@@ -0,0 +1,196 @@
+// Loading of the question data written by scripts/generate_web_json.py,
+// shared by index.html and simple.html.
+//
+// Questions are split into one shard per subject, listed in manifest.json
+// with counts and content hashes; a page fetches only the shards its filter
+// needs.  Shards hold list summaries; explanation bodies and their versions
+// are in details/ chunks, one per subject and exam, fetched when shown.
+
+const SHARD_BASE = "../output/web/questions/";
+const INDEX_BASE = "../output/web/index/";
+
+// Each subject shard (questions/subject_*.json) stores the case texts its
+// questions use once under "cases"; put each back on the questions that
+// reference it by case_id.  details/ chunks hold only explanations.
+function unpackQuestions(data) {
+  if (Array.isArray(data)) return data;
+  const cases = (data && data.cases) || {};
+  const questions = (data && data.questions) || [];
+  questions.forEach(q => {
+    q.case_text = q.case_id != null ? cases[q.case_id] || null : null;
+  });
+  return questions;
+}
+
+// Index files give, per key, the ordinals (positions in serials.json) of
+// its questions as base64 of their gaps in LEB128 varints.
+const BASE64_VALUES = new Uint8Array(128);
+"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+  .split("")
+  .forEach((ch, value) => {
+    BASE64_VALUES[ch.charCodeAt(0)] = value;
+  });
+
+function decodeOrdinals(packed) {
+  const ordinals = [];
+  const text = packed || "";
+  let bits = 0;
+  let buffer = 0;
+  let gap = 0;
+  let shift = 0;
+  let last = 0;
+  for (let i = 0; i < text.length; i++) {
+    const code = text.charCodeAt(i);
+    if (code === 61) break; // "=" padding
+    buffer = ((buffer << 6) | BASE64_VALUES[code]) & 0xffff;
+    bits += 6;
+    if (bits < 8) continue;
+    bits -= 8;
+    const byte = (buffer >> bits) & 0xff;
+    gap |= (byte & 0x7f) << shift;
+    if (byte & 0x80) {
+      shift += 7;
+      continue;
+    }
+    last += gap;
+    ordinals.push(last);
+    gap = 0;
+    shift = 0;
+  }
+  return ordinals;
+}
+
+// A key's questions as one byte per ordinal, decoded once and kept.
+function indexMembers(index, key) {
+  if (!index.members) index.members = {};
+  if (!index.members[key]) {
+    const members = new Uint8Array(index.count || 0);
+    decodeOrdinals((index.lists || {})[key]).forEach(ordinal => {
+      members[ordinal] = 1;
+    });
+    index.members[key] = members;
+  }
+  return index.members[key];
+}
+
+// The loader keeps its caches on the page's state object: manifest,
+// shardLoads, loadedShards, detailUrlBySerial, detailQuestions and
+// detailLoads.  onMerge runs after newly loaded shards are merged into
+// state.questions.
+function createDataLoader(state, { onMerge } = {}) {
+  // A production build (generate_web_json.py --production) puts the content
+  // hash in every file name but the manifest's, so those files can be
+  // cached for good; otherwise the hash is a cache-busting query.
+  function assetUrl(base, name, hash) {
+    if (state.manifest && state.manifest.hashed) {
+      return `${base}${name.replace(/\.json$/, `.${hash}.json`)}`;
+    }
+    return hash ? `${base}${name}?v=${hash}` : `${base}${name}`;
+  }
+
+  function loadManifest() {
+    return fetch(`${SHARD_BASE}manifest.json`, { cache: "no-cache" })
+      .then(r => r.json())
+      .then(manifest => {
+        state.manifest = manifest;
+        return manifest;
+      });
+  }
+
+  function loadIndex(name) {
+    const hashes = state.manifest.indexes || {};
+    return fetch(assetUrl(INDEX_BASE, name, hashes[name])).then(r => r.json());
+  }
+
+  function mergeLoadedShards() {
+    const questions = [];
+    state.manifest.shards.forEach(shard => {
+      (state.loadedShards[shard.file] || []).forEach(q => questions.push(q));
+    });
+    questions.sort((a, b) => (a.serial < b.serial ? -1 : a.serial > b.serial ? 1 : 0));
+    state.questions = questions;
+    if (onMerge) onMerge(questions);
+  }
+
+  function shardsLoaded(shards) {
+    return shards.every(shard => state.loadedShards[shard.file]);
+  }
+
+  function loadShards(shards) {
+    if (shardsLoaded(shards)) return Promise.resolve();
+    const loads = shards.map(shard => {
+      if (!state.shardLoads[shard.file]) {
+        state.shardLoads[shard.file] = fetch(assetUrl(SHARD_BASE, shard.file, shard.hash))
+          .then(r => r.json())
+          .then(data => {
+            const questions = unpackQuestions(data);
+            registerDetails(shard, (data && data.details) || {}, questions);
+            state.loadedShards[shard.file] = questions;
+          })
+          .catch(err => {
+            delete state.shardLoads[shard.file];
+            throw err;
+          });
+      }
+      return state.shardLoads[shard.file];
+    });
+    return Promise.all(loads).then(mergeLoadedShards);
+  }
+
+  function registerDetails(shard, details, questions) {
+    const stem = shard.file.replace(/\.json$/, "");
+    questions.forEach(q => {
+      const key = q.serial.split("-")[0];
+      if (!details[key]) return;
+      const url = assetUrl(`${SHARD_BASE}details/`, `${stem}_${key}.json`, details[key]);
+      state.detailUrlBySerial[q.serial] = url;
+      (state.detailQuestions[url] = state.detailQuestions[url] || []).push(q);
+    });
+  }
+
+  function applyDetails(questions, chunk) {
+    questions.forEach(q => {
+      const explanations = chunk[q.serial] || [];
+      const latest = explanations[explanations.length - 1];
+      q.explanations = explanations;
+      // A teacher's edit loaded before the chunk takes precedence.
+      if (q.explanation_latest === undefined) {
+        q.explanation_latest = latest ? latest.body : null;
+      }
+      if (q.explanation_latest_source === undefined) {
+        q.explanation_latest_source = latest ? latest.source : null;
+      }
+    });
+  }
+
+  async function ensureDetailsLoaded(serials) {
+    const urls = new Set();
+    serials.forEach(serial => {
+      const url = state.detailUrlBySerial[serial];
+      if (url) urls.add(url);
+    });
+    const loads = [...urls].map(url => {
+      if (!state.detailLoads[url]) {
+        state.detailLoads[url] = fetch(url)
+          .then(r => r.json())
+          .then(chunk => applyDetails(state.detailQuestions[url], chunk))
+          .catch(err => {
+            delete state.detailLoads[url];
+            throw err;
+          });
+      }
+      return state.detailLoads[url];
+    });
+    try {
+      await Promise.all(loads);
+    } catch (err) {
+      console.warn("解説の取得に失敗しました。", err);
+    }
+  }
+
+  return { assetUrl, loadManifest, loadIndex, loadShards, shardsLoaded, ensureDetailsLoaded };
+}
+
+if (typeof module !== "undefined") {
+  module.exports = { unpackQuestions, decodeOrdinals, indexMembers, createDataLoader };
+}